@@ -1,10 +1,25 @@
-from PySide6.QtCore import QObject, QTimer, Signal
+import os
+import socket as pysocket
+from collections import deque
+from random import uniform
+from threading import Lock
+from time import perf_counter, strftime, time
+
+from PySide6.QtCore import QObject, Qt, QThread, QTimer, Signal
 from PySide6.QtNetwork import QAbstractSocket, QTcpSocket
 from PySide6.QtWidgets import QApplication
 
-from config import PORT, SERVER_IP
-from data import (DriveData, DriveMission, ManualDriveInstruction,
+from config import (BINARY_PROTOCOL, CONNECT_TIMEOUT, DISPLAY_RATE,
+                    KEEPALIVE_COUNT, KEEPALIVE_IDLE, KEEPALIVE_INTERVAL, PORT,
+                    RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY,
+                    RECORD_FLUSH_INTERVAL, RECORD_PATH, RECORD_SESSIONS,
+                    SEND_BATCH_SIZE, SEND_BUFFER_LIMIT, SEND_QUEUE_SIZE,
+                    SERVER_IP, SOCKET_THREADED, UNKNOWN_WARNING_INTERVAL)
+from data import (BINARY_HEADER, BINARY_MARKER, BINARY_TYPES, BinaryMode,
+                  DriveData, DriveMission, ManualDriveInstruction,
                   SemiDriveInstruction, get_type_and_data)
+from recorder import SessionRecorder
+from telemetry import TelemetryStore
 
 
 class BackendSignals(QObject):
@@ -16,6 +31,9 @@ class BackendSignals(QObject):
     new_drive_data = Signal(DriveData)
     """ New drive data has been recieved from the car"""
 
+    display_drive_data = Signal(DriveData)
+    """ Latest drive data to display, emitted at most DISPLAY_RATE times per second """
+
     new_map = Signal()
     """ New map has been created by user """
 
@@ -40,6 +58,15 @@ class BackendSignals(QObject):
     update_position = Signal(str)
     """ Updates cars diplayed position """
 
+    connection_changed = Signal(bool)
+    """ Socket has connected, or disconnected or failed to connect """
+
+    emergency_stop = Signal()
+    """ Car has been told to stop, its plan is cancelled """
+
+    main_thread_blocked = Signal(float)
+    """ Milliseconds the GUI thread was blocked during the last second """
+
 
 def backend_signals():
     """ Returns instance of the current BackendSignals """
@@ -48,11 +75,153 @@ def backend_signals():
     return BackendSignals._instance
 
 
+BINARY_MARKER_BYTE = bytes([BINARY_MARKER])
+
+
+class FrameDecoder:
+    """ Incremental decoder, splits a byte stream into newline terminated JSON
+    frames and length prefixed binary frames """
+
+    COMPACT_SIZE = 1 << 16
+    """ Consumed bytes allowed at the start of buffer before it is compacted """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0  # Start of first incomplete frame
+        self.dropped = 0  # Broken frames dropped
+
+    def feed(self, data) -> list[bytes]:
+        """ Appends data to buffer and returns all frames that are now complete.
+        Binary frames are returned with their header. An incomplete JSON frame
+        left in buffer has been searched for newlines and the marker already,
+        so only new data is searched. """
+        buffer = self.buffer
+        start = self.offset
+        scanned = len(buffer)
+        if BINARY_MARKER_BYTE not in data and \
+                (start == scanned or buffer[start] != BINARY_MARKER):
+            # Only JSON frames, split in one pass
+            if b"\n" not in data:
+                buffer += data
+                return []
+            frames = data.split(b"\n")
+            if start < scanned:
+                if start:
+                    del buffer[:start]
+                frames[0] = b"".join((buffer, frames[0]))
+            buffer.clear()
+            buffer += frames.pop()
+            self.offset = 0
+            return [frame for frame in frames if frame] if b"" in frames \
+                else frames
+
+        buffer += data
+        size = len(buffer)
+
+        frames = []
+        with memoryview(buffer) as view:
+            while start < size:
+                if buffer[start] == BINARY_MARKER:
+                    # Length prefixed binary frame
+                    if size - start < BINARY_HEADER.size:
+                        break
+                    end = start + BINARY_HEADER.size + \
+                        BINARY_HEADER.unpack_from(buffer, start)[2]
+                    if end > size:
+                        break
+                    frames.append(view[start:end].tobytes())
+                    start = end
+                else:
+                    # Newline terminated JSON frames, up to next binary frame
+                    begin = max(start, scanned)
+                    limit = buffer.find(BINARY_MARKER_BYTE, begin)
+                    if limit == -1:
+                        limit = size
+
+                    end = buffer.find(b"\n", begin, limit)
+                    while end != -1:
+                        if end > start:  # Ignore empty frames
+                            frames.append(view[start:end].tobytes())
+                        start = end + 1
+                        end = buffer.find(b"\n", start, limit)
+
+                    if start < limit:
+                        if limit == size:
+                            break
+                        # JSON can't contain the marker, drop broken frame
+                        self.dropped += 1
+                        start = limit
+
+        if start == size:
+            # Everything consumed, reuse buffer from the start
+            buffer.clear()
+            start = 0
+        elif start > self.COMPACT_SIZE:
+            # Drop consumed bytes before incomplete frame
+            del buffer[:start]
+            start = 0
+
+        self.offset = start
+        return frames
+
+    def clear(self):
+        """ Discards any buffered partial frame """
+        self.buffer.clear()
+        self.offset = 0
+
+
+class SendPriority:
+    """ How an outgoing message is queued """
+    STOP = 0
+    """ Written at once, ahead of everything queued. Queued messages that tell
+    the car to drive are discarded, others are sent after it. """
+    CONTROL = 1
+    """ Only the latest is kept, it is dropped if not connected """
+    NORMAL = 2
+    """ Queued in order, and kept until connected """
+
+
+STOP_DISCARDS = tuple('{{"{}"'.format(name).encode("utf-8") for name in
+                      ["DriveMission", "ManualDriveInstruction",
+                       "SemiDriveInstruction"])
+""" Starts of queued messages that a stop discards, as the car must not drive
+on after it """
+
+
+class SendStats:
+    """ Counters for messages sent to the car """
+
+    __slots__ = ("messages", "writes", "bytes", "dropped", "latency_total",
+                 "latency_max")
+
+    def __init__(self):
+        self.messages = 0
+        self.writes = 0  # Calls to write, each with a batch of messages
+        self.bytes = 0
+        self.dropped = 0  # Messages discarded or replaced before sent
+        self.latency_total = 0.0  # Seconds from send_message to write
+        self.latency_max = 0.0
+
+    @property
+    def latency_mean(self) -> float:
+        return self.latency_total / max(self.messages, 1)
+
+
 class Socket(QObject):
     """ A singleton class, representing a tcp socket for communication with the car """
 
     # Maintain only one websocket instance
     _instance = None
+    _thread: QThread = None
+
+    class Requests(QObject):
+        """ Requests handled by the thread owning pSocket. The connections are
+        queued when the socket has been moved to a worker thread. """
+        connect_host = Signal()
+        disconnect_host = Signal()
+        abort = Signal()
+        send = Signal(bytes, int, float)
+        """ Message, SendPriority and time it was sent """
 
     def __init__(self, parent):
         super().__init__(parent)
@@ -60,61 +229,181 @@ class Socket(QObject):
         self.pSocket.readyRead.connect(self.on_recieved)
         self.pSocket.connected.connect(self.on_connected)
         self.pSocket.disconnected.connect(self.on_disconnected)
+        self.pSocket.stateChanged.connect(self.on_state_changed)
         self.pSocket.errorOccurred.connect(self.on_error)
-        self.overflow = ""
+        self.pSocket.bytesWritten.connect(self.on_bytes_written)
+        self.decoder = FrameDecoder()
+        self.is_connected = False
+        self.recorder: SessionRecorder = None
+        # Write and sync recorded frames also when none are recieved
+        self.record_timer = QTimer(self)
+        self.record_timer.setInterval(int(RECORD_FLUSH_INTERVAL * 1000))
+        self.record_timer.timeout.connect(self.flush_recording)
+
+        # Outgoing messages with the time they were sent, written in batches
+        self.queue: deque[tuple[bytes, float]] = deque()
+        self.control: tuple[bytes, float] = None  # Latest CONTROL message
+        self.send_stats = SendStats()
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)  # Flush once per event loop tick
+        self.flush_timer.timeout.connect(self.flush)
+
+        # Socket.connect shadows QObject.connect, keep signals in a child
+        self.requests = self.Requests(self)
+        self.requests.connect_host.connect(self.connect_to_host)
+        self.requests.disconnect_host.connect(self.disconnect_from_host)
+        self.requests.abort.connect(self.pSocket.abort)
+        self.requests.send.connect(self.enqueue)
 
     def connect(self):
         """ Connect socket to host """
         self.log("Connecting to car....")
-        self.pSocket.connectToHost(SERVER_IP, PORT)
+        self.requests.connect_host.emit()
 
     def disconnect(self):
         """ Disconnect socket from host """
         self.log("Disconnecting from car...")
+        self.requests.disconnect_host.emit()
+
+    def connect_to_host(self):
+        self.pSocket.connectToHost(SERVER_IP, PORT)
+
+    def disconnect_from_host(self):
         self.pSocket.disconnectFromHost()
 
     def emergency_stop_car(self):
         """ Sends emergency stop signal to car """
         self.log("EMERGENCY STOP", "WARN")
-        self.send_message("STOP")
-
-    def send_message(self, message: str):
-        """ Sends message to car. Throws if connection not valid. """
-        if (not self.pSocket.state() == QAbstractSocket.ConnectedState):
-            self.log("No connection to car", "ERROR")
-            print("Error sending:\n", message)
-            raise ConnectionError("Socket not Connected")
+        self.send_message("STOP", SendPriority.STOP)
+        backend_signals().emergency_stop.emit()
 
+    def send_message(self, message: str, priority: int = SendPriority.NORMAL):
+        """ Queues message to be sent to car, see SendPriority """
         message += "\n"  # Add terminating char
         bytes = message.encode("utf-8")
         print("Sending:", bytes)
-        self.pSocket.write(bytes)
+        self.requests.send.emit(bytes, priority, perf_counter())
+
+    def send_first(self, messages: list[str]):
+        """ Queues messages ahead of everything queued, and removes queued
+        copies of them. Must be called in the thread owning the socket. """
+        sent = perf_counter()
+        first = [((message + "\n").encode("utf-8"), sent)
+                 for message in messages]
+        resent = {bytes for bytes, _ in first}
+        rest = [item for item in self.queue if item[0] not in resent]
+        self.queue.clear()
+        self.queue.extend(first + rest)
+        if self.is_connected and not self.flush_timer.isActive():
+            self.flush_timer.start(0)
+
+    @property
+    def queue_depth(self) -> int:
+        """ Number of messages waiting to be written """
+        return len(self.queue) + (self.control is not None)
+
+    def enqueue(self, bytes: bytes, priority: int, sent: float):
+        """ Queues message, in the thread owning the socket """
+        stats = self.send_stats
+        if priority == SendPriority.STOP:
+            # Nothing queued before a stop may make the car drive after it
+            kept = [item for item in self.queue
+                    if not item[0].startswith(STOP_DISCARDS)]
+            stats.dropped += self.queue_depth - len(kept)
+            self.queue.clear()
+            self.queue.extend(kept)
+            self.control = None
+            if not self.is_connected:
+                self.log("No connection to car", "ERROR")
+                stats.dropped += 1
+                return
+            self.write([(bytes, sent)])  # Ignores backpressure
+            return
+
+        if priority == SendPriority.CONTROL:
+            if not self.is_connected:
+                self.log("No connection to car", "ERROR")
+                stats.dropped += 1
+                return
+            if self.control is not None:
+                stats.dropped += 1  # Replaced by newer state
+            self.control = (bytes, sent)
+        else:
+            if len(self.queue) >= SEND_QUEUE_SIZE:
+                self.queue.popleft()
+                stats.dropped += 1
+                self.log("Send queue full, oldest message dropped", "WARN")
+            self.queue.append((bytes, sent))
+            if not self.is_connected:
+                self.log("No connection to car, message is sent when connected",
+                         "WARN")
+                return
+
+        if not self.flush_timer.isActive():
+            self.flush_timer.start(0)
+
+    def flush(self):
+        """ Writes queued messages in one batch, unless the socket's write
+        buffer is above SEND_BUFFER_LIMIT """
+        if not self.is_connected:
+            return
+        if self.pSocket.bytesToWrite() > SEND_BUFFER_LIMIT:
+            return  # Continued by on_bytes_written
+
+        batch = []
+        size = 0
+        if self.control is not None:
+            batch.append(self.control)
+            size += len(self.control[0])
+            self.control = None
+        queue = self.queue
+        while queue and size < SEND_BATCH_SIZE:
+            batch.append(queue.popleft())
+            size += len(batch[-1][0])
+
+        if batch:
+            self.write(batch)
+        if queue:
+            self.flush_timer.start(0)
+
+    def write(self, batch: list[tuple[bytes, float]]):
+        """ Writes messages to socket in one call """
+        now = perf_counter()
+        stats = self.send_stats
+        data = b"".join([bytes for bytes, _ in batch])
+        for _, sent in batch:
+            latency = now - sent
+            stats.latency_total += latency
+            if latency > stats.latency_max:
+                stats.latency_max = latency
+        stats.messages += len(batch)
+        stats.writes += 1
+        stats.bytes += len(data)
+
+        self.pSocket.write(data)
         self.pSocket.flush()  # Clear buffer after send
 
+    def on_bytes_written(self, count: int):
+        if self.queue_depth and not self.flush_timer.isActive():
+            self.flush_timer.start(0)
+
     def on_recieved(self):
         """ Parses messages in buffer when ready signal is recieved """
-        bytes = self.pSocket.readAll()
-        print("Reading data:", bytes)
-
-        recieved = str(bytes)[2:-1]  # Extract string from buffer
-        messages = recieved.split(r"\n")
-        messages[0] = self.overflow + messages[0]  # Prepend previous overflow
-        self.overflow = ""
+        bytes = self.pSocket.readAll().data()
 
-        for message in messages[:-1]:
-            type, data = get_type_and_data(message)
+        dispatcher = message_dispatcher()
+        dispatcher.recieved = time()
+        dispatch = dispatcher.dispatch
+        dropped = self.decoder.dropped
+        for message in self.decoder.feed(bytes):
+            if self.recorder is not None:
+                self.recorder.record(message)
 
-            if type == "DriveData":
-                backend_signals().new_drive_data.emit(DriveData.from_json(data))
-            elif type == "InstructionId":
-                backend_signals().remove_semi_instruction.emit(str(data))
-            elif type == "Position":
-                backend_signals().update_position.emit(str(data))
-            else:
-                print("Unknown type: " + type, "\n"+str(data))
-                self.log("Unknown data recieved from car", "WARN")
+            dispatch(message)
 
-        self.overflow = messages[-1]  # Last message is always any overflow
+        if self.decoder.dropped != dropped:
+            self.log("Dropped {} broken frames from car".format(
+                self.decoder.dropped - dropped), "WARN")
 
     def on_error(self, error):
         print(error)
@@ -124,23 +413,518 @@ class Socket(QObject):
             self.log("Remote closed connection incorrectly", "ERROR")
 
     def on_connected(self):
-        backend_signals().clear_semi_instructions.emit()
+        self.is_connected = True
+        self.decoder.clear()  # Drop partial frame from previous connection
+        self.set_socket_options()
+        if RECORD_SESSIONS:
+            self.start_recording()
         self.log("Connected")
 
+        if BINARY_PROTOCOL:
+            self.send_message(BinaryMode().to_json())  # Ask for binary frames
+        backend_signals().connection_changed.emit(True)  # Resync is queued here
+        if self.queue_depth:
+            self.log("Sending {} queued messages".format(self.queue_depth))
+            self.flush_timer.start(0)
+
+    def on_state_changed(self, state):
+        if state == QAbstractSocket.UnconnectedState:
+            backend_signals().connection_changed.emit(False)
+
+    def set_socket_options(self):
+        """ Disables Nagle's algorithm, and enables keepalive so a dead link is
+        detected within KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_COUNT """
+        self.pSocket.setSocketOption(QAbstractSocket.LowDelayOption, 1)
+        self.pSocket.setSocketOption(QAbstractSocket.KeepAliveOption, 1)
+        if not hasattr(pysocket, "TCP_KEEPIDLE"):
+            return  # Only system default keepalive times
+
+        # Qt can't set keepalive times, set them on a duplicate of the descriptor
+        with pysocket.fromfd(self.pSocket.socketDescriptor(), pysocket.AF_INET,
+                             pysocket.SOCK_STREAM) as duplicate:
+            duplicate.setsockopt(pysocket.IPPROTO_TCP, pysocket.TCP_KEEPIDLE,
+                                 KEEPALIVE_IDLE)
+            duplicate.setsockopt(pysocket.IPPROTO_TCP, pysocket.TCP_KEEPINTVL,
+                                 KEEPALIVE_INTERVAL)
+            duplicate.setsockopt(pysocket.IPPROTO_TCP, pysocket.TCP_KEEPCNT,
+                                 KEEPALIVE_COUNT)
+
     def on_disconnected(self):
+        self.is_connected = False
+        self.control = None  # Old control state must not be sent later
+        self.stop_recording()
         self.log("Disconnected")
 
+    def start_recording(self):
+        """ Records all recieved frames to a new session log """
+        self.stop_recording()
+
+        os.makedirs(RECORD_PATH, exist_ok=True)
+        path = RECORD_PATH + strftime("session_%Y%m%d_%H%M%S.rec")
+        try:
+            self.recorder = SessionRecorder(path)
+        except OSError as e:
+            self.log("Could not record session: " + str(e), "ERROR")
+            return
+
+        # Index drive data in this thread, right after its frame is recorded
+        backend_signals().new_drive_data.connect(self.recorder.index,
+                                                 Qt.DirectConnection)
+        self.record_timer.start()
+        self.log("Recording session to \"{}\"".format(path))
+
+    def stop_recording(self):
+        """ Closes the current session log, if any """
+        if self.recorder is None:
+            return
+
+        self.record_timer.stop()
+        backend_signals().new_drive_data.disconnect(self.recorder.index)
+        self.recorder.close()
+        self.recorder = None
+
+    def flush_recording(self):
+        """ Writes buffered frames of the session log, syncing if it is time """
+        if self.recorder is not None:
+            self.recorder.flush()
+
     def log(self, message, severity="INFO"):
         backend_signals().log_msg.emit(severity, message)
 
 
+class MessageStats:
+    """ Counters for one message type """
+
+    __slots__ = ("messages", "bytes", "decode_time", "errors")
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.decode_time = 0.0  # Seconds spent decoding
+        self.errors = 0  # Messages that could not be decoded
+
+    def __str__(self):
+        return "{} messages, {} bytes, {:.1f} us/message decode, {} errors".format(
+            self.messages, self.bytes,
+            self.decode_time / max(self.messages, 1) * 1e6, self.errors)
+
+
+class MessageDispatcher:
+    """ A singleton class, which passes each message from the car to the handler
+    registered for its type. Handlers get the decoded data, or the raw frame if
+    registered with raw=True. JSON and binary frames of a type go to the same
+    handler. """
+
+    # Maintain only one instance
+    _instance = None
+
+    class Handler:
+        __slots__ = ("callback", "raw", "stats")
+
+        def __init__(self, callback, raw: bool, stats: MessageStats):
+            self.callback = callback
+            self.raw = raw
+            self.stats = stats
+
+    def __init__(self):
+        # Handlers by type name as bytes, so JSON frames are looked up undecoded
+        self.handlers: dict[bytes, MessageDispatcher.Handler] = {}
+        self.binary_types = {tag: (name.encode("utf-8"), decode)
+                             for tag, (name, decode) in BINARY_TYPES.items()}
+        self.stats: dict[str, MessageStats] = {}
+        self.recieved = 0.0  # Time (s since epoch) the current frames were read
+
+        self.last_warning: dict[bytes, float] = {}  # Time of last warning by type
+        self.suppressed: dict[bytes, int] = {}  # Warnings not logged by type
+
+        signals = backend_signals()
+        self.register("DriveData", self.on_drive_data)
+        self.register("InstructionId",
+                      lambda id: signals.remove_semi_instruction.emit(str(id)))
+        self.register("Position",
+                      lambda position: signals.update_position.emit(str(position)))
+        self.register("BinaryMode", lambda _: signals.log_msg.emit(
+            "INFO", "Car sends drive data as binary frames"))
+
+    def on_drive_data(self, data: DriveData):
+        data.recieved = self.recieved
+        backend_signals().new_drive_data.emit(data)
+
+    def register(self, type_name: str, callback, raw: bool = False):
+        """ Sets callback as handler of messages of type_name, replacing any
+        previous handler """
+        if type_name not in self.stats:
+            self.stats[type_name] = MessageStats()
+        self.handlers[type_name.encode("utf-8")] = self.Handler(
+            callback, raw, self.stats[type_name])
+
+    def unregister(self, type_name: str):
+        """ Removes handler of type_name, its messages are then unknown """
+        self.handlers.pop(type_name.encode("utf-8"), None)
+
+    def dispatch(self, message: bytes):
+        """ Passes message to the handler of its type """
+        if message[0] == BINARY_MARKER:
+            name, decode = self.binary_types.get(message[1], (None, None))
+            if name is None:
+                self.unknown(b"binary tag %d" % message[1], message)
+                return
+        else:
+            # Type is the first key of the JSON object
+            start = message.find(b'"') + 1
+            name = message[start:message.find(b'"', start)]
+            decode = None
+
+        handler = self.handlers.get(name)
+        if handler is None:
+            self.unknown(name, message)
+            return
+
+        stats = handler.stats
+        stats.messages += 1
+        stats.bytes += len(message)
+        if handler.raw:
+            handler.callback(message)
+            return
+
+        start = perf_counter()
+        if decode is not None:
+            data = decode(message[BINARY_HEADER.size:])
+        else:
+            type, data = get_type_and_data(message)
+            if type == "Error":
+                stats.errors += 1
+                self.warn(name, "Invalid {} recieved from car: {}".format(
+                    name.decode("utf-8", "replace"), data))
+                return
+        stats.decode_time += perf_counter() - start
+        handler.callback(data)
+
+    def unknown(self, name: bytes, message: bytes):
+        """ Counts message of unhandled type, and warns about it """
+        type_name = name.decode("utf-8", "replace")
+        if type_name not in self.stats:
+            self.stats[type_name] = MessageStats()
+        stats = self.stats[type_name]
+        stats.messages += 1
+        stats.bytes += len(message)
+        self.warn(name, "Unknown data recieved from car: " + type_name)
+
+    def warn(self, name: bytes, message: str):
+        """ Logs warning about a message of type name, at most once per
+        UNKNOWN_WARNING_INTERVAL and type """
+        now = perf_counter()
+        if now - self.last_warning.get(name, -UNKNOWN_WARNING_INTERVAL) \
+                < UNKNOWN_WARNING_INTERVAL:
+            self.suppressed[name] = self.suppressed.get(name, 0) + 1
+            return
+
+        suppressed = self.suppressed.pop(name, 0)
+        if suppressed:
+            message += " ({} more not logged)".format(suppressed)
+        print(message)
+        backend_signals().log_msg.emit("WARN", message)
+        self.last_warning[name] = now
+
+    def summary(self) -> str:
+        """ Returns the counters of every type seen, one line per type """
+        return "\n".join("{}: {}".format(type_name, stats)
+                         for type_name, stats in self.stats.items())
+
+
+def message_dispatcher():
+    """ Returns instance of the current MessageDispatcher """
+    if MessageDispatcher._instance is None:
+        MessageDispatcher._instance = MessageDispatcher()
+    return MessageDispatcher._instance
+
+
+def dispatch_message(message: bytes):
+    """ Decodes a message from the car and passes it to its handler """
+    message_dispatcher().dispatch(message)
+
+
 def socket():
     """ Returns instance of the current tcp socket """
     if Socket._instance is None:
-        Socket._instance = Socket(QApplication.instance())
+        if SOCKET_THREADED:
+            start_socket_thread()
+        else:
+            Socket._instance = Socket(QApplication.instance())
     return Socket._instance
 
 
+def start_socket_thread():
+    """ Creates the socket in a worker thread, where reading and decoding is done """
+    app = QApplication.instance()
+    backend_signals()  # Signals must be created in the GUI thread
+    message_dispatcher()
+
+    Socket._thread = QThread(app)
+    Socket._instance = Socket(None)  # Only objects without parent can be moved
+    Socket._instance.moveToThread(Socket._thread)
+    Socket._thread.finished.connect(Socket._instance.deleteLater)
+    app.aboutToQuit.connect(stop_socket_thread)
+    Socket._thread.start()
+
+
+def stop_socket_thread():
+    """ Stops the socket worker thread, if running """
+    if Socket._thread is not None:
+        Socket._thread.quit()
+        Socket._thread.wait()
+        Socket._thread = None
+
+
+class ConnectionManager(QObject):
+    """ A singleton class, which keeps the socket connected. Reconnects with
+    jittered exponential backoff when the link drops, and resyncs the car by
+    resending the map, parameters and plan after each connect. """
+
+    # Maintain only one instance
+    _instance = None
+
+    RESYNC_TYPES = ("MapData", "ParameterConfiguration", "DriveMission")
+    """ Message types of which the latest sent is resent after connecting """
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.enabled = False  # Reconnect when disconnected
+        self.connected = False
+        self.attempt = 0  # Failed attempts since last connected
+
+        self.reconnect_timer = QTimer(self)
+        self.reconnect_timer.setSingleShot(True)
+        self.reconnect_timer.timeout.connect(self.attempt_connect)
+        self.timeout_timer = QTimer(self)
+        self.timeout_timer.setSingleShot(True)
+        self.timeout_timer.timeout.connect(self.on_timeout)
+
+        # Latest message of each RESYNC_TYPES, and unfinished semi-auto
+        # instructions. Changed in the GUI thread, read by resync in the
+        # socket's thread, under lock.
+        self.state: dict[str, str] = {}
+        self.instructions: dict[str, str] = {}
+        self.lock = Lock()
+
+        # Statistics
+        self.connections = 0
+        self.connected_time = 0.0  # Seconds connected, before current connection
+        self.connected_at = 0.0
+        self.disconnected_at: float = None  # Time link dropped, if reconnecting
+        self.reconnect_latency = 0.0  # Seconds to reconnect, last time
+
+        signals = backend_signals()
+        # Resync in the socket's thread, before queued messages are written
+        signals.connection_changed.connect(self.resync, Qt.DirectConnection)
+        signals.connection_changed.connect(self.on_connection_changed)
+        signals.new_semi_instruction.connect(self.add_instruction)
+        signals.remove_semi_instruction.connect(self.remove_instruction)
+        signals.clear_semi_instructions.connect(self.clear_instructions)
+        signals.emergency_stop.connect(self.forget_plan)
+
+    def start(self):
+        """ Connects, and keeps reconnecting until stop """
+        self.enabled = True
+        self.attempt = 0
+        if not self.connected:
+            self.attempt_connect()
+
+    def stop(self):
+        """ Disconnects and stops reconnecting """
+        self.enabled = False
+        self.reconnect_timer.stop()
+        self.timeout_timer.stop()
+        self.disconnected_at = None
+        socket().disconnect()
+
+    def send_state(self, type_name: str, message: str):
+        """ Sends message, and remembers it to resend after reconnecting """
+        with self.lock:
+            self.state[type_name] = message
+        socket().send_message(message)
+
+    def add_instruction(self, instruction: SemiDriveInstruction):
+        with self.lock:
+            self.instructions[instruction.id] = instruction.to_json()
+
+    def remove_instruction(self, id: str):
+        with self.lock:
+            self.instructions.pop(id, None)
+
+    def clear_instructions(self):
+        with self.lock:
+            self.instructions.clear()
+
+    def forget_plan(self):
+        """ The plan must not be resent after an emergency stop """
+        with self.lock:
+            self.state.pop("DriveMission", None)
+            self.instructions.clear()
+
+    def attempt_connect(self):
+        socket().connect()
+        self.timeout_timer.start(int(CONNECT_TIMEOUT * 1000))
+
+    def on_timeout(self):
+        backend_signals().log_msg.emit("ERROR", "Connection timed out")
+        socket().requests.abort.emit()
+
+    def on_connection_changed(self, connected: bool):
+        now = perf_counter()
+        if connected:
+            self.timeout_timer.stop()
+            self.connected = True
+            self.connections += 1
+            self.connected_at = now
+            self.attempt = 0
+            if self.disconnected_at is not None:
+                self.reconnect_latency = now - self.disconnected_at
+                backend_signals().log_msg.emit(
+                    "INFO", "Reconnected after {:.1f} s".format(
+                        self.reconnect_latency))
+                self.disconnected_at = None
+            return
+
+        if self.connected:
+            self.connected = False
+            self.connected_time += now - self.connected_at
+            if self.enabled:
+                self.disconnected_at = now
+
+        self.timeout_timer.stop()
+        if self.enabled and not self.reconnect_timer.isActive():
+            delay = self.backoff_delay()
+            self.attempt += 1
+            backend_signals().log_msg.emit(
+                "INFO", "Reconnecting in {:.1f} s".format(delay))
+            self.reconnect_timer.start(int(delay * 1000))
+
+    def backoff_delay(self) -> float:
+        """ Seconds until next attempt, doubled per failed attempt and jittered
+        so clients don't retry in step """
+        delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2**self.attempt)
+        return uniform(delay / 2, delay)
+
+    def resync(self, connected: bool):
+        """ Resends state the car lost with the connection, ahead of messages
+        queued while disconnected, which may depend on it """
+        if not connected:
+            return
+
+        with self.lock:
+            messages = [self.state[type_name]
+                        for type_name in self.RESYNC_TYPES
+                        if type_name in self.state]
+            messages += self.instructions.values()
+        if messages:
+            socket().log("Resyncing {} messages".format(len(messages)))
+            socket().send_first(messages)
+
+    @property
+    def uptime(self) -> float:
+        """ Seconds connected in total """
+        if self.connected:
+            return self.connected_time + perf_counter() - self.connected_at
+        return self.connected_time
+
+
+def connection_manager():
+    """ Returns instance of the current ConnectionManager """
+    if ConnectionManager._instance is None:
+        ConnectionManager._instance = ConnectionManager(
+            QApplication.instance())
+    return ConnectionManager._instance
+
+
+class DriveDataCoalescer(QObject):
+    """ A singleton class, which keeps all drive data recieved and passes only the
+    latest sample on to be displayed, at DISPLAY_RATE """
+
+    # Maintain only one instance
+    _instance = None
+
+    def __init__(self, parent, rate: float = DISPLAY_RATE):
+        super().__init__(parent)
+        self.history = TelemetryStore()
+        self.latest: DriveData = None  # Sample not yet displayed
+
+        self.samples_recieved = 0
+        self.samples_displayed = 0
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.flush)
+        self.set_rate(rate)
+
+        backend_signals().new_drive_data.connect(self.add_sample)
+
+    def set_rate(self, rate: float):
+        """ Sets how many times per second drive data is displayed """
+        self.timer.start(int(1000 / rate))
+
+    def add_sample(self, data: DriveData):
+        """ Stores sample in history and marks it for display """
+        self.history.append(data)
+        self.latest = data
+        self.samples_recieved += 1
+
+    def flush(self):
+        """ Displays the latest sample, if any new has arrived """
+        if self.latest is None:
+            return
+
+        self.samples_displayed += 1
+        backend_signals().display_drive_data.emit(self.latest)
+        self.latest = None
+
+
+def drive_data_coalescer():
+    """ Returns instance of the current DriveDataCoalescer """
+    if DriveDataCoalescer._instance is None:
+        DriveDataCoalescer._instance = DriveDataCoalescer(
+            QApplication.instance())
+    return DriveDataCoalescer._instance
+
+
+class MainThreadMonitor(QObject):
+    """ Measures how long the GUI thread is blocked, from the delay of a periodic timer """
+
+    INTERVAL = 10
+    """ Timer interval (ms) """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.on_timeout)
+
+        self.last_tick = perf_counter()
+        self.period_start = self.last_tick
+        self.blocked = 0.0  # Seconds blocked in current period
+
+    def start(self):
+        self.last_tick = self.period_start = perf_counter()
+        self.blocked = 0.0
+        self.timer.start(self.INTERVAL)
+
+    def stop(self):
+        self.timer.stop()
+
+    def on_timeout(self):
+        now = perf_counter()
+        delay = now - self.last_tick - self.INTERVAL / 1000
+        if delay > 0:
+            self.blocked += delay  # Timer was late, thread was busy
+        self.last_tick = now
+
+        period = now - self.period_start
+        if period >= 1:
+            backend_signals().main_thread_blocked.emit(
+                self.blocked / period * 1000)
+            self.period_start = now
+            self.blocked = 0.0
+
+
 def send_message(socket: Socket):
     # test method
     socket.connect()
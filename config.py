@@ -8,9 +8,63 @@ GUI_HEIGHT = 720
 DATA_PATH = "data/"
 """ Path to folder where the csv-files will be saved """
 
+EXPORT_FORMAT = "csv"
+""" Format drive data is saved in, "csv" or the columnar "binary" """
+
+EXPORT_CHUNK_SIZE = 4096
+""" Number of samples written to file at a time when saving drive data """
+
 DEFAULT_MAP_PATH = "map/map.json"
 """ The default path to load map from """
 
+TELEMETRY_CAPACITY = 100 * 60 * 60
+""" Number of drive data samples kept in memory, one hour at 100 Hz """
+
+DISPLAY_RATE = 30
+""" Max rate (Hz) at which recieved drive data is redrawn """
+
+PLOT_WINDOWS = [10, 60]
+""" Time windows (s) that can be plotted, besides all drive data """
+
+RECORD_SESSIONS = True
+""" Record every frame recieved from the car to a session log """
+
+RECORD_PATH = "data/sessions/"
+""" Path to folder where session logs are written, one per connection """
+
+RECORD_BATCH_SIZE = 1 << 16
+""" Bytes of recorded frames buffered before they are written to file """
+
+RECORD_FLUSH_INTERVAL = 0.5
+""" Max time (s) a recorded frame is buffered before written to file """
+
+RECORD_FSYNC_INTERVAL = 2
+""" Time (s) between syncing session log to disk """
+
+RECORD_INDEX_INTERVAL = 1000
+""" Elapsed time (ms) between session log index entries """
+
+LOG_CAPACITY = 10000
+""" Log entries kept in memory, older entries are only in the log file """
+
+LOG_MAX_BLOCKS = 2000
+""" Max number of lines shown in the log widget """
+
+LOG_UPDATE_INTERVAL = 0.1
+""" Time (s) between adding new log entries to the log widget """
+
+LOG_TO_FILE = True
+""" Write every log entry to a log file, in the background """
+
+LOG_PATH = "data/logs/"
+""" Path to folder where the log file is written """
+
+LOG_FILE_SIZE = 1 << 20
+""" Bytes written to the log file before it is rotated """
+
+LOG_FILE_COUNT = 5
+""" Number of rotated log files kept """
+
 # Backend configuration
 PORT = 1234
 """ Port the socket will try to connect to """
@@ -18,6 +72,56 @@ PORT = 1234
 SERVER_IP = "192.168.1.32"
 """ IP-address to the server """
 
+BINARY_PROTOCOL = False
+""" Ask the car to send drive data as binary frames instead of JSON """
+
+SOCKET_THREADED = False
+""" Read and decode messages from the car in a worker thread, not the GUI thread """
+
+CONNECT_TIMEOUT = 3
+""" Time (s) to wait for a connection attempt before aborting it """
+
+RECONNECT_MIN_DELAY = 0.5
+""" Max delay (s) before the first reconnect attempt, doubled per failed attempt """
+
+RECONNECT_MAX_DELAY = 10
+""" Upper limit of the reconnect delay (s) """
+
+KEEPALIVE_IDLE = 2
+""" Idle time (s) before the first keepalive probe is sent """
+
+KEEPALIVE_INTERVAL = 1
+""" Time (s) between keepalive probes """
+
+KEEPALIVE_COUNT = 3
+""" Unanswered keepalive probes before the connection is dropped """
+
+SEND_QUEUE_SIZE = 100
+""" Max messages queued while waiting to be sent, the oldest is dropped when full """
+
+SEND_BATCH_SIZE = 1 << 16
+""" Max bytes of queued messages written in one call """
+
+SEND_BUFFER_LIMIT = 1 << 16
+""" Queued messages wait while more bytes than this are unsent by the socket """
+
+LATENCY_PROBES = False
+""" Measure round trip time and clock offset with Ping probes, which the car
+must answer with Pong """
+
+LATENCY_PROBE_INTERVAL = 1
+""" Time (s) between latency probes sent to the car """
+
+LATENCY_WINDOW = 60
+""" Latest latency probes used for round trip statistics and clock offset """
+
+DATA_AGE_WINDOW = 1000
+""" Latest drive data samples used for data age statistics """
+
+UNKNOWN_WARNING_INTERVAL = 5
+""" Min time (s) between warnings about unknown or invalid messages of the
+same type """
+
 # Manual mode constants
 CAR_ACC = 100
 """ Throttle sent when driving """
@@ -28,8 +132,51 @@ FULL_STEER = 280
 HALF_STEER = 100
 """ Steer angle sent when user presses diagonal turn key """
 
-MAX_SEND_RATE = 1/10
-""" Max rate at which manual instructions will be sent """
+CONTROL_RATE = 10
+""" Max rate (Hz) at which the manual drive state is sent """
+
+CONTROL_REPEAT_INTERVAL = 0.5
+""" Time (s) between resending an unchanged manual drive state """
+
+CONTROL_THRESHOLD = 5
+""" Least change in throttle or steering that is sent before it is repeated """
+
+GAMEPAD_THROTTLE_AXIS = "ABS_Y"
+""" evdev axis used for throttle, left stick up and down """
+
+GAMEPAD_STEERING_AXIS = "ABS_RX"
+""" evdev axis used for steering, right stick left and right """
+
+GAMEPAD_DEADZONE = 0.1
+""" Part of the axis range around center that counts as centered """
+
+GAMEPAD_SMOOTHING = 0.5
+""" Part of the change in an axis applied per control tick, 1 disables smoothing """
+
+# Auto mode constants
+ROUTE_CACHE_NODES = 1000
+""" Maps with up to this many lane nodes have all shortest paths computed when
+loaded, larger maps have them computed from this many nodes as needed """
+
+ROUTE_EXACT_STOPS = 8
+""" Missions with up to this many stops are reordered to the shortest order,
+longer missions to a short order found heuristically """
+
+WEIGHT_TIME = 1.0
+""" Estimated time (s) for the car to drive one unit of edge weight """
+
+# Map creator constants
+MAP_LARGE_NODES = 500
+""" Maps with more nodes are drawn by the map creator with a spatial index """
+
+MAP_DETAIL_SCALE = 0.5
+""" Zoom below which the map creator leaves out text, such as edge labels """
+
+MAP_OVERVIEW_SCALE = 0.05
+""" Zoom below which the map creator draws large maps as an outline """
+
+MAP_VALIDATE_DELAY = 0.3
+""" Time (s) without edits before the map creator checks the edited map """
 
 # Default regulation control paramters
 STEER_KP = 100
@@ -0,0 +1,95 @@
+from time import perf_counter
+
+from PySide6.QtCore import QObject, QTimer
+from PySide6.QtWidgets import QApplication
+
+from backend import SendPriority, socket
+from config import CONTROL_RATE, CONTROL_REPEAT_INTERVAL, CONTROL_THRESHOLD
+from data import ManualDriveInstruction
+
+
+class ManualControl(QObject):
+    """ A singleton class, which streams the manual drive state to the car.
+
+    A changed state is sent at once, or at the next tick if a state was sent
+    less than 1 / CONTROL_RATE s ago, so the latest state is never dropped.
+    Changes smaller than CONTROL_THRESHOLD, except to or from standing still,
+    count as unchanged. An unchanged state is only resent every
+    CONTROL_REPEAT_INTERVAL. """
+
+    # Maintain only one instance
+    _instance = None
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.throttle = 0
+        self.steering = 0
+        self.sent: tuple = None  # Last state sent, None if it must be resent
+        self.last_send = 0.0
+
+        self.frames_sent = 0
+        self.frames_skipped = 0  # Ticks where the state was unchanged
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update)
+
+    def start(self):
+        """ Starts streaming, the current state is sent at once """
+        self.sent = None
+        self.timer.start(int(1000 / CONTROL_RATE))
+        self.update()
+
+    def stop(self):
+        """ Stops streaming, and stops the car if it was told to drive """
+        self.timer.stop()
+        self.throttle = 0
+        self.steering = 0
+        if self.sent not in (None, (0, 0)) and socket().is_connected:
+            self.send(perf_counter())
+
+    def set_state(self, throttle, steering):
+        """ Sets state to send """
+        self.throttle = throttle
+        self.steering = steering
+        self.update()
+
+    def update(self):
+        """ Sends state if it has changed, or is due to be repeated, and the
+        rate allows """
+        now = perf_counter()
+        if (not self.has_changed() and
+                now - self.last_send < CONTROL_REPEAT_INTERVAL):
+            self.frames_skipped += 1
+            return
+        if now - self.last_send < 1 / CONTROL_RATE:
+            return  # Sent on next tick
+
+        if not socket().is_connected:
+            self.sent = None  # Send when connected
+            return
+        self.send(now)
+
+    def has_changed(self) -> bool:
+        """ Returns True if state differs enough from the state sent """
+        if self.sent is None:
+            return True
+        throttle, steering = self.sent
+        if (self.throttle == self.steering == 0) != (throttle == steering == 0):
+            return True
+        return (abs(self.throttle - throttle) >= CONTROL_THRESHOLD or
+                abs(self.steering - steering) >= CONTROL_THRESHOLD)
+
+    def send(self, now: float):
+        state = (self.throttle, self.steering)
+        socket().send_message(ManualDriveInstruction(*state).to_json(),
+                              SendPriority.CONTROL)
+        self.sent = state
+        self.last_send = now
+        self.frames_sent += 1
+
+
+def manual_control():
+    """ Returns instance of the current ManualControl """
+    if ManualControl._instance is None:
+        ManualControl._instance = ManualControl(QApplication.instance())
+    return ManualControl._instance
@@ -1,12 +1,49 @@
 import json
+import struct
+from array import array
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter
 from uuid import uuid4
 
 from config import DEFAULT_MAP_PATH
 
 
+def encode_value(value) -> str:
+    """ Encodes a single value as JSON """
+    type_ = type(value)
+    if type_ is int:
+        return int.__repr__(value)
+    if type_ is str:
+        return encode_basestring_ascii(value)
+    return json.dumps(value, sort_keys=True)
+
+
+class Serializer:
+    """ Precompiled JSON encoder for a message type. Key order and the text
+    around the values are built once, so encoding is a single pass. """
+
+    def __init__(self, type_name: str, keys: list[str]):
+        self.keys = sorted(keys)
+        fields = ", ".join('"{}": %s'.format(key.replace("%", "%%"))
+                           for key in self.keys)
+        self.template = ('{"' + type_name + '": { ' + fields + '}}'
+                         if self.keys else '{"' + type_name + '": {}}')
+
+        getter = attrgetter(*self.keys) if self.keys else lambda _: ()
+        self.get_values = (getter if len(self.keys) != 1
+                           else lambda message: (getter(message),))
+
+    def encode(self, message) -> str:
+        """ Returns message as JSON, wrapped with its type name """
+        return self.template % tuple(map(encode_value,
+                                         self.get_values(message)))
+
+
 class JSONSerializable:
     """ Enables a simple dataclass to be serialized with JSON """
 
+    __slots__ = ()
+
     def wrap_json(self, type_name: str, body: str):
         """ Wraps body with key, json formatted """
 
@@ -15,44 +52,207 @@ class JSONSerializable:
         body = body.replace("'", r'"')  # Car can't handle symbol '
         return "{" + "\"{}\": {}".format(type_name, body) + "}"
 
-    def to_json(self, type_name: str) -> str:
+
+class MessageError(ValueError):
+    """ Raised when a recieved message doesn't match its schema """
+
+
+class Field:
+    """ A field in a message schema """
+
+    def __init__(self, name: str, type=int, default=0, factory=None):
+        self.name = name
+        self.types = type if isinstance(type, tuple) else (type,)
+        self.default = default
+        self.factory = factory  # Called for default value, if given
+
+
+NUMBER = (int, float)
+""" Field type accepting both integers and decimals """
+
+MESSAGE_TYPES: dict[str, type] = {}
+""" Message classes by type name, get_type_and_data decodes these """
+
+
+def compile_init(fields: list[Field], local: tuple[str] = ()):
+    """ Generates an __init__ taking the fields as arguments, in order. Local
+    attributes are set to None. """
+    namespace = {}
+    arguments = []
+    lines = ["self.{} = None".format(name) for name in local]
+    for field in fields:
+        name = field.name
+        if field.factory is not None:
+            namespace["factory_" + name] = field.factory
+            arguments.append(name + "=None")
+            lines.append("self.{0} = factory_{0}() if {0} is None else {0}"
+                         .format(name))
+        else:
+            namespace["default_" + name] = field.default
+            arguments.append("{0}=default_{0}".format(name))
+            lines.append("self.{0} = {0}".format(name))
+
+    source = "def __init__(self, {}):\n    {}".format(
+        ", ".join(arguments), "\n    ".join(lines))
+    exec(source, namespace)
+    return namespace["__init__"]
+
+
+def compile_decoder(cls: type, fields: list[Field], local: tuple[str] = ()):
+    """ Generates a from_json that checks every field is present and has the
+    right type, before creating an instance of cls. The instance is filled in
+    directly rather than through __init__, which saves a call per message. """
+    namespace = {"cls": cls, "new": object.__new__,
+                 "MessageError": MessageError, "describe_error": describe_error}
+    names = [field.name for field in fields]
+    checks = []
+    for field in fields:
+        if len(field.types) == 1:
+            namespace["type_" + field.name] = field.types[0]
+            checks.append("type({0}) is not type_{0}".format(field.name))
+        else:
+            namespace["types_" + field.name] = field.types
+            checks.append("type({0}) not in types_{0}".format(field.name))
+
+    source = """def from_json(json):
+    try:
+        {gets}
+    except (KeyError, TypeError):
+        raise MessageError(describe_error(cls, json)) from None
+    if {checks}:
+        raise MessageError(describe_error(cls, json))
+    self = new(cls)
+    {sets}
+    return self""".format(
+        gets="\n        ".join("{0} = json[{0!r}]".format(name)
+                                for name in names),
+        checks=" or ".join(checks),
+        sets="\n    ".join(["self.{0} = {0}".format(name) for name in names] +
+                            ["self.{} = None".format(name) for name in local]))
+    exec(source, namespace)
+    return namespace["from_json"]
+
+
+def describe_error(cls: type, json) -> str:
+    """ Describes why json isn't a valid message of type cls """
+    if not isinstance(json, dict):
+        return "{} must be an object, got {!r}".format(cls.TYPE_NAME, json)
+
+    for field in cls.FIELDS:
+        if field.name not in json:
+            return "{} is missing \"{}\"".format(cls.TYPE_NAME, field.name)
+        if type(json[field.name]) not in field.types:
+            return "{}.{} must be {}, got {!r}".format(
+                cls.TYPE_NAME, field.name,
+                " or ".join(type.__name__ for type in field.types),
+                json[field.name])
+    return "Invalid " + cls.TYPE_NAME
+
+
+class MessageMeta(type):
+    """ Builds a message class from its schema. FIELDS gives the class its
+    __slots__, constructor, validating from_json and precompiled to_json,
+    and the class is registered in MESSAGE_TYPES under TYPE_NAME. Names in
+    LOCAL get slots too, but are not part of the message. """
+
+    def __new__(meta, name, bases, namespace):
+        fields = namespace.get("FIELDS")
+        if fields is None:
+            return super().__new__(meta, name, bases, namespace)
+
+        local = namespace.get("LOCAL", ())
+        namespace["__slots__"] = tuple(field.name for field in fields) + local
+        cls = super().__new__(meta, name, bases, namespace)
+        cls.__init__ = compile_init(fields, local)
+        cls.from_json = staticmethod(compile_decoder(cls, fields, local))
+        cls.serializer = Serializer(cls.TYPE_NAME,
+                                    [field.name for field in fields])
+        MESSAGE_TYPES[cls.TYPE_NAME] = cls
+        return cls
+
+
+class Message(JSONSerializable, metaclass=MessageMeta):
+    """ A message described by a schema: TYPE_NAME and a list of FIELDS """
+
+    __slots__ = ()
+
+    TYPE_NAME: str
+    FIELDS: list[Field]
+    LOCAL: tuple[str] = ()
+
+    def to_json(self) -> str:
         """ Creates a JSON-object from instance, with the type as top level key """
-        payload = json.dumps(self, default=lambda o: o.__dict__,
-                             sort_keys=True, indent=1)
+        return self.serializer.encode(self)
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            "{}={!r}".format(field.name, getattr(self, field.name))
+            for field in self.FIELDS))
 
-        return self.wrap_json(type_name, payload)
 
+BINARY_MARKER = 0x02
+""" First byte of a binary frame, JSON frames always start with '{' """
 
-class DriveData(JSONSerializable):
+BINARY_HEADER = struct.Struct("<BBH")
+""" Marker, type tag and length of the payload that follows """
+
+
+class BinaryMode(Message):
+    """ Request for the car to send telemetry as binary frames. The car
+    acknowledges by sending the same message back. """
+
+    VERSION = 1
+
+    TYPE_NAME = "BinaryMode"
+    FIELDS = [Field("version", default=VERSION)]
+
+
+class DriveData(Message):
     """ Simple dataclass to represent the car's drive data """
 
-    def __init__(self,
-                 elapsed_time: int = 0,
-                 throttle: int = 0,
-                 steering: int = 0,
-                 speed: int = 0,
-                 driving_distance: int = 0,
-                 obstacle_distance: int = 0,
-                 lateral_position: int = 0,
-                 angle: int = 0):
-        self.elapsed_time = elapsed_time
-        self.throttle = throttle
-        self.steering = steering
-        self.speed = speed
-        self.driving_distance = driving_distance
-        self.obstacle_distance = obstacle_distance
-        self.lateral_position = lateral_position
-        self.angle = angle
-
-    def from_json(json: dict):
-        """ Returns instance from json """
-        return DriveData(json["elapsed_time"], json["throttle"],
-                         json["steering"], json["speed"],
-                         json["driving_distance"], json["obstacle_distance"],
-                         json["lateral_position"], json["angle"])
+    TYPE_NAME = "DriveData"
+    FIELDS = [Field("elapsed_time"), Field("throttle"), Field("steering"),
+              Field("speed"), Field("driving_distance"),
+              Field("obstacle_distance"), Field("lateral_position"),
+              Field("angle")]
+    LOCAL = ("recieved",)
+    """ Time (s since epoch) the message was recieved """
+
+    BINARY_TAG = 1
+    """ Type tag of binary drive data frames """
+
+    BINARY_FORMAT = struct.Struct("<I7i")
+    """ elapsed_time, then the other fields in FIELDS order """
+
+    def from_binary(payload: bytes):
+        """ Returns instance from a binary frame's payload """
+        return DriveData(*DriveData.BINARY_FORMAT.unpack(payload))
+
+    def to_binary(self) -> bytes:
+        """ Returns a binary frame, with header """
+        return BINARY_HEADER.pack(BINARY_MARKER, self.BINARY_TAG,
+                                  self.BINARY_FORMAT.size) + \
+            self.BINARY_FORMAT.pack(
+                self.elapsed_time, self.throttle, self.steering, self.speed,
+                self.driving_distance, self.obstacle_distance,
+                self.lateral_position, self.angle)
 
-    def to_json(self) -> str:
-        return super().to_json("DriveData")
+
+class Ping(Message):
+    """ Latency probe, echoed by the car as Pong. Sent is the local time (us
+    since epoch) the probe was sent. """
+
+    TYPE_NAME = "Ping"
+    FIELDS = [Field("id"), Field("sent")]
+
+
+class Pong(Message):
+    """ The car's reply to Ping. Recieved and replied are the car's clock (us,
+    same origin as DriveData.elapsed_time) when the probe arrived and the
+    reply was sent. """
+
+    TYPE_NAME = "Pong"
+    FIELDS = [Field("id"), Field("sent"), Field("recieved"), Field("replied")]
 
 
 class DrivingMode:
@@ -62,19 +262,11 @@ class DrivingMode:
     AUTO = 2
 
 
-class ManualDriveInstruction(JSONSerializable):
+class ManualDriveInstruction(Message):
     """ Simple dataclass to represent a drive instruction for the car """
 
-    def __init__(self, throttle: int = 0, steering: int = 0):
-        self.throttle = throttle
-        self.steering = steering
-
-    def from_json(json: dict):
-        """ Returns instance from json """
-        return ManualDriveInstruction(json["throttle"], json["steering"])
-
-    def to_json(self) -> str:
-        return super().to_json("ManualDriveInstruction")
+    TYPE_NAME = "ManualDriveInstruction"
+    FIELDS = [Field("throttle", NUMBER), Field("steering", NUMBER)]
 
 
 class Direction:
@@ -84,26 +276,22 @@ class Direction:
     RIGHT = 2
 
 
-class SemiDriveInstruction(JSONSerializable):
+class SemiDriveInstruction(Message):
     """ Simple dataclass to represent a semi-autonomous drive instruction for the car """
 
-    def __init__(self, direction: Direction = Direction.FWRD):
-        self.direction = direction
-        self.id = str(uuid4())  # Assign unique id to instruction
-
-    def from_json(json: dict):
-        """ Returns instance from json """
-        return SemiDriveInstruction(json["direction"], json["id"])
-
-    def to_json(self) -> str:
-        return super().to_json("SemiDriveInstruction")
+    TYPE_NAME = "SemiDriveInstruction"
+    FIELDS = [Field("direction", default=Direction.FWRD),
+              # Assign unique id to new instructions
+              Field("id", str, factory=lambda: str(uuid4()))]
 
 
 class DriveMission(JSONSerializable):
     """ Simple dataclass to represent a fully-autonomous drive mission for the car """
 
-    def __init__(self, destination: list[str] = []):
-        self.destinations = destination
+    __slots__ = ("destinations",)
+
+    def __init__(self, destination: list[str] = None):
+        self.destinations = [] if destination is None else destination
 
     def clear(self):
         """ Clears all destinations from mission """
@@ -115,39 +303,144 @@ class DriveMission(JSONSerializable):
 
     def from_json(json: list[str]):
         """ Returns instance from json """
+        if not (isinstance(json, list) and
+                all(isinstance(dest, str) for dest in json)):
+            raise MessageError(
+                "DriveMission must be a list of names, got {!r}".format(json))
         return DriveMission(json)
 
     def to_json(self) -> str:
-        return super().wrap_json("DriveMission", str(self.destinations))
+        return '{"DriveMission": ' + json.dumps(self.destinations) + "}"
 
 
-class ParameterConfiguration(JSONSerializable):
-    """ Simple dataclass to represent a parameter configuration for the car """
+MESSAGE_TYPES["DriveMission"] = DriveMission
 
-    def __init__(self, steering_kp=0, steering_kd=0, speed_kp=0,
-                 speed_ki=0, turn_kd=0, angle_offset=0):
-        self.steering_kp = steering_kp
-        self.steering_kd = steering_kd
-        self.speed_kp = speed_kp
-        self.speed_ki = speed_ki
-        self.turn_kd = turn_kd
-        self.angle_offset = angle_offset
 
-    def from_json(json: dict):
-        """ Returns instance from json """
-        return ParameterConfiguration(json["steering_kp"], json["steering_kd"],
-                                      json["speed_kp"], json["speed_ki"],
-                                      json["turn_kd"], json["angle_offset"])
+class ParameterConfiguration(Message):
+    """ Simple dataclass to represent a parameter configuration for the car """
 
-    def to_json(self) -> str:
-        return super().to_json("ParameterConfiguration")
+    TYPE_NAME = "ParameterConfiguration"
+    FIELDS = [Field("steering_kp"), Field("steering_kd"), Field("speed_kp"),
+              Field("speed_ki"), Field("turn_kd"), Field("angle_offset")]
+
+
+class MapGraph:
+    """ A map compiled for fast queries. Node names are interned to integer ids,
+    nodes with edges of their own first, and the edges are stored compressed
+    (CSR): the edges of node n are number offsets[n] to offsets[n + 1] in
+    targets and weights, in map order, so the left edge comes first. Edges
+    without an integer weight, such as the null weights compiled for
+    intersection nodes without an edge between them, can't be driven and
+    are kept apart in invalid, to be reported by errors. """
+
+    def __init__(self, map: dict[str, list[dict[str, int]]]):
+        self.names: list[str] = list(map)
+        self.ids: dict[str, int] = {name: id for id, name in enumerate(self.names)}
+        self.sources = len(self.names)  # Nodes that are keys in map
+        self.offsets = array("l", [0])
+        self.targets = array("l")
+        self.weights = array("l")
+        self.edge_index: dict[tuple[int, int], int] = {}  # Edge number by ids
+        # Target ids and weights of edges without integer weight, by source id
+        self.invalid: dict[int, list[tuple[int, object]]] = {}
+
+        for id, name in enumerate(self.names):
+            for edge in map[name]:
+                for target, weight in edge.items():
+                    target_id = self.intern(target)
+                    if type(weight) is not int:
+                        self.invalid.setdefault(id, []).append(
+                            (target_id, weight))
+                        continue
+                    self.edge_index.setdefault((id, target_id),
+                                               len(self.targets))
+                    self.targets.append(target_id)
+                    self.weights.append(weight)
+            self.offsets.append(len(self.targets))
+
+        # Nodes only reached by edges have none of their own
+        self.offsets.extend([len(self.targets)] *
+                            (len(self.names) - self.sources))
+
+    def intern(self, name: str) -> int:
+        """ Returns id of name, adding it if new """
+        id = self.ids.get(name)
+        if id is None:
+            id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return id
+
+    def __len__(self):
+        return len(self.names)
+
+    def degree(self, id: int) -> int:
+        return self.offsets[id + 1] - self.offsets[id]
+
+    def edges(self, id: int) -> range:
+        """ Edge numbers of the edges from id, left first """
+        return range(self.offsets[id], self.offsets[id + 1])
+
+    def neighbours(self, id: int) -> list[tuple[int, int]]:
+        """ Ids and weights of the nodes reached from id, left first """
+        start, stop = self.offsets[id], self.offsets[id + 1]
+        return list(zip(self.targets[start:stop], self.weights[start:stop]))
+
+    def has_edge(self, source: str, target: str) -> bool:
+        return (self.ids.get(source), self.ids.get(target)) in self.edge_index
+
+    def weight(self, source: str, target: str) -> int:
+        """ Weight of the edge from source to target, None if not connected """
+        edge = self.edge_index.get((self.ids.get(source), self.ids.get(target)))
+        return None if edge is None else self.weights[edge]
+
+    def is_left(self, source: str, target: str) -> bool:
+        """ True if the edge from source to target is the left of two, None if
+        not connected """
+        id = self.ids.get(source)
+        edge = self.edge_index.get((id, self.ids.get(target)))
+        if edge is None:
+            return None
+        return self.degree(id) > 1 and edge == self.offsets[id]
+
+    def errors(self) -> list[str]:
+        """ Returns what makes the map incomplete, empty if it is complete """
+        errors = []
+        for id in range(self.sources):
+            edges = self.neighbours(id) + self.invalid.get(id, [])
+            if len(edges) == 0:
+                errors.append("Orphaned node: \"{}\"".format(self.names[id]))
+            elif len(edges) > 2:
+                errors.append("Too many connecting nodes for \"{}\": {}".format(
+                    self.names[id], [{self.names[target]: weight}
+                                     for target, weight in edges]))
+            for target, weight in self.invalid.get(id, []):
+                errors.append("Invalid weight from \"{}\" to \"{}\": {}".format(
+                    self.names[id], self.names[target], weight))
+        return errors
 
 
 class MapData(JSONSerializable):
-    """ A graph representation of a map """
+    """ A graph representation of a map. map is kept in the JSON format, a dict
+    of lists of {neighbour: weight}, left first. graph is compiled from it on
+    first use, call changed after editing map other than through this class. """
 
     def __init__(self, map: dict):
         self.map = map
+        self.changed()
+
+    @property
+    def graph(self) -> MapGraph:
+        if self._graph is None:
+            self._graph = MapGraph(self.map)
+        return self._graph
+
+    def changed(self):
+        """ Recompiles graph on next use, after map was edited directly """
+        # Edges as (node, neighbour, weight), to check for existing edges
+        self.edges = {(node, neighbour, weight)
+                      for node, edges in self.map.items()
+                      for edge in edges for neighbour, weight in edge.items()}
+        self._graph: MapGraph = None
 
     def add_node(self, node: str):
         """ Adds a unconnected node to the map """
@@ -156,39 +449,28 @@ class MapData(JSONSerializable):
             return
 
         self.map[node] = []
+        self._graph = None
 
     def connect_node(self, node_1: str, node_2: str, weight: int, is_left=True):
         """ Connects node_1 to node_2 with weight. Adds nodes if not already in map. """
         if node_1 not in self.map:
-            self.add_node(node_1)
+            self.map[node_1] = []
 
         if node_2 not in self.map:
-            self.add_node(node_2)
+            self.map[node_2] = []
 
         index = 0 if is_left else 1
-        edge = {node_2: weight}
-        if edge not in self.map[node_1]:
-            print("Connecting " + node_1 + " -> " + node_2)
-            self.map[node_1].insert(index, edge)
+        if (node_1, node_2, weight) not in self.edges:
+            self.map[node_1].insert(index, {node_2: weight})
+            self.edges.add((node_1, node_2, weight))
+            self._graph = None
 
     def verify_complete_map(self):
         """ Returns 'True' if if map is complete """
-        is_complete = True  # Assume complete
-
-        # Check each node in map is valid
-        for key in self.map.keys():
-            # Check if any orphaned nodes
-            if len(self.map[key]) == 0:
-                print("ERROR: Orphaned node: \"{}\"".format(key))
-                is_complete = False
-
-            # Check if too many connecting nodes
-            if len(self.map[key]) > 2:
-                print("ERROR: Too many connecting nodes for \"{}\": {}".format(
-                    key, self.map[key]))
-                is_complete = False
-
-        return is_complete
+        errors = self.graph.errors()
+        for error in errors:
+            print("ERROR: " + error)
+        return not errors
 
     def load_from_file(self, path: str = DEFAULT_MAP_PATH):
         """ Load a JSON-object map from file at path """
@@ -211,13 +493,29 @@ class MapData(JSONSerializable):
         return self.wrap_json("MapData", json.dumps(self.map))
 
 
+BINARY_TYPES = {DriveData.BINARY_TAG: ("DriveData", DriveData.from_binary)}
+""" Name and decoder of binary frames, by type tag """
+
+
 def get_type_and_data(json_str):
-    """ Returns the data type and json data """
+    """ Returns the data type and data. Data of types in MESSAGE_TYPES is
+    decoded to an instance, other data is returned as json. Invalid messages
+    have type "Error" and the reason as data. """
     try:
         json_data = json.loads(json_str)
     except json.JSONDecodeError as e:
-        print(e.msg)
-        return "Error", {}
+        return "Error", e.msg
+    if not isinstance(json_data, dict) or not json_data:
+        return "Error", "Message is not an object"
+
     data_type = next(iter(json_data))  # Returns name of first key
+    data = json_data[data_type]
+
+    message_type = MESSAGE_TYPES.get(data_type)
+    if message_type is not None:
+        try:
+            data = message_type.from_json(data)
+        except MessageError as e:
+            return "Error", str(e)
 
-    return data_type, json_data[data_type]
+    return data_type, data
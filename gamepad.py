@@ -0,0 +1,172 @@
+from abc import ABC, abstractmethod
+from math import copysign
+
+from PySide6.QtCore import QObject, QSocketNotifier, QTimer
+
+from backend import backend_signals
+from config import (CAR_ACC, CONTROL_RATE, FULL_STEER, GAMEPAD_DEADZONE,
+                    GAMEPAD_SMOOTHING, GAMEPAD_STEERING_AXIS,
+                    GAMEPAD_THROTTLE_AXIS)
+from control import manual_control
+
+try:
+    import evdev  # Only on Linux, gamepads are not supported without it
+except ImportError:
+    evdev = None
+
+
+class InputSource(ABC):
+    """ A source of analog throttle and steering, both from -1 to 1 """
+
+    name = "Input"
+
+    @abstractmethod
+    def read(self) -> tuple[float, float]:
+        """ Returns current throttle and steering """
+
+    def close(self):
+        pass
+
+
+class SyntheticInput(InputSource):
+    """ Input set from code, for testing without a gamepad. If function is
+    given it is called with no arguments on each read instead. """
+
+    name = "Synthetic input"
+
+    def __init__(self, function=None):
+        self.function = function
+        self.throttle = 0.0
+        self.steering = 0.0
+
+    def set(self, throttle: float, steering: float):
+        self.throttle = throttle
+        self.steering = steering
+
+    def read(self) -> tuple[float, float]:
+        if self.function is not None:
+            return self.function()
+        return self.throttle, self.steering
+
+
+class EvdevInput(InputSource):
+    """ Joystick axes of an evdev device, read as events arrive """
+
+    def __init__(self, device, parent=None):
+        self.device = device
+        self.name = device.name
+        self.throttle_code = evdev.ecodes.ecodes[GAMEPAD_THROTTLE_AXIS]
+        self.steering_code = evdev.ecodes.ecodes[GAMEPAD_STEERING_AXIS]
+        self.ranges = {code: (info.min, info.max) for code, info in
+                       device.capabilities()[evdev.ecodes.EV_ABS]}
+        self.values = {code: 0.0 for code in self.ranges}
+
+        self.notifier = QSocketNotifier(device.fd, QSocketNotifier.Read,
+                                        parent)
+        self.notifier.activated.connect(self.on_readable)
+
+    def on_readable(self):
+        try:
+            for event in self.device.read():
+                if event.type == evdev.ecodes.EV_ABS and event.code in self.ranges:
+                    low, high = self.ranges[event.code]
+                    self.values[event.code] = \
+                        2 * (event.value - low) / (high - low) - 1
+        except OSError as e:
+            print("Gamepad lost:", e)  # Unplugged
+            self.close()
+
+    def read(self) -> tuple[float, float]:
+        # Stick is negative upwards
+        return (-self.values.get(self.throttle_code, 0.0),
+                self.values.get(self.steering_code, 0.0))
+
+    def close(self):
+        self.notifier.setEnabled(False)
+        self.values = {code: 0.0 for code in self.ranges}
+        try:
+            self.device.close()
+        except OSError:
+            pass
+
+
+def find_gamepad() -> InputSource:
+    """ Returns the first input device with the configured axes, or None """
+    if evdev is None:
+        return None
+
+    axes = {evdev.ecodes.ecodes[GAMEPAD_THROTTLE_AXIS],
+            evdev.ecodes.ecodes[GAMEPAD_STEERING_AXIS]}
+    for path in evdev.list_devices():
+        try:
+            device = evdev.InputDevice(path)
+        except OSError:
+            continue  # No permission
+        codes = {code for code, _ in
+                 device.capabilities().get(evdev.ecodes.EV_ABS, [])}
+        if axes <= codes:
+            return EvdevInput(device)
+        device.close()
+    return None
+
+
+def apply_deadzone(value: float, deadzone: float = GAMEPAD_DEADZONE) -> float:
+    """ Zero within deadzone, outside it rescaled to still reach -1 and 1 """
+    if abs(value) <= deadzone:
+        return 0.0
+    return copysign(min(1.0, (abs(value) - deadzone) / (1 - deadzone)), value)
+
+
+class AnalogControl(QObject):
+    """ Reads an InputSource at CONTROL_RATE and sets the manual drive state
+    from it, after deadzone and exponential smoothing. An axis returning to
+    its deadzone is zero at once, so letting go stops the car without delay.
+    While the input rests the state is left to other controls, such as keys.
+    After an emergency stop the input is ignored until it has been at rest. """
+
+    def __init__(self, source: InputSource, parent=None):
+        super().__init__(parent)
+        self.source = source
+        self.throttle = 0.0  # Smoothed, from -1 to 1
+        self.steering = 0.0
+        self.engaged = False  # Input has set the drive state
+        self.stopped = False  # Emergency stopped, input not yet at rest
+
+        backend_signals().emergency_stop.connect(self.on_emergency_stop)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.tick)
+
+    def start(self):
+        self.timer.start(int(1000 / CONTROL_RATE))
+
+    def stop(self):
+        self.timer.stop()
+        self.throttle = self.steering = 0.0
+        self.engaged = False
+
+    def on_emergency_stop(self):
+        self.stopped = True
+        self.engaged = False
+
+    def tick(self):
+        throttle, steering = self.source.read()
+        self.throttle = self.smooth(self.throttle, apply_deadzone(throttle))
+        self.steering = self.smooth(self.steering, apply_deadzone(steering))
+
+        if self.throttle == 0 and self.steering == 0:
+            self.stopped = False
+            if self.engaged:
+                manual_control().set_state(0, 0)  # Returned to rest
+                self.engaged = False
+            return
+        if self.stopped:
+            return
+
+        self.engaged = True
+        manual_control().set_state(round(max(0.0, self.throttle) * CAR_ACC),
+                                   round(self.steering * FULL_STEER))
+
+    def smooth(self, current: float, target: float) -> float:
+        if target == 0:
+            return 0.0
+        return current + GAMEPAD_SMOOTHING * (target - current)
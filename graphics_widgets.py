@@ -1,20 +1,27 @@
-from time import localtime, time
-
-from PySide6.QtCore import QSize, Qt
-from PySide6.QtGui import QIcon, QKeySequence, QPixmap, QShortcut
-from PySide6.QtWidgets import (QFormLayout, QFrame, QGridLayout, QHBoxLayout,
-                               QLabel, QLineEdit, QPlainTextEdit, QPushButton,
-                               QScrollArea, QSizePolicy, QStackedWidget,
-                               QStyle, QTabWidget, QToolButton, QVBoxLayout,
-                               QWidget)
-
-from backend import backend_signals, socket
-from config import (ANGLE_OFFSET, CAR_ACC, DATA_PATH, FULL_STEER, HALF_STEER,
-                    MAX_SEND_RATE, SPEED_KI, SPEED_KP, STEER_KD, STEER_KP,
-                    TURN_KD)
+import os
+from collections import deque
+from time import strftime
+
+from PySide6.QtCore import QEvent, QSize, Qt
+from PySide6.QtGui import QIcon, QPixmap, QTextCursor
+from PySide6.QtWidgets import (QApplication, QFormLayout, QFrame, QGridLayout,
+                               QHBoxLayout, QLabel, QLineEdit, QPlainTextEdit,
+                               QPushButton, QScrollArea, QSizePolicy,
+                               QStackedWidget, QStyle, QTabBar, QToolButton,
+                               QVBoxLayout, QWidget)
+
+from backend import (backend_signals, connection_manager,
+                     drive_data_coalescer, socket)
+from config import (ANGLE_OFFSET, CAR_ACC, DATA_PATH, EXPORT_FORMAT,
+                    FULL_STEER, HALF_STEER, LOG_MAX_BLOCKS, SPEED_KI,
+                    SPEED_KP, STEER_KD, STEER_KP, TURN_KD, WEIGHT_TIME)
+from control import manual_control
 from data import (Direction, DriveData, DriveMission, DrivingMode,
-                  ManualDriveInstruction, ParameterConfiguration,
-                  SemiDriveInstruction)
+                  ParameterConfiguration, SemiDriveInstruction)
+from gamepad import AnalogControl, InputSource, find_gamepad
+from log import SEVERITIES, LogEntry, log_buffer
+from routing import router
+from telemetry import TelemetryExporter
 
 
 def LOG(severity: str, message: str):
@@ -77,7 +84,8 @@ class DataWidget(QFrame):
 
     def __init__(self):
         super().__init__()
-        self.all_data: list[DriveData] = []
+        self.all_data = drive_data_coalescer().history
+        self.exporter: TelemetryExporter = None
 
         self.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Expanding)
         self.setMinimumWidth(250)
@@ -120,7 +128,7 @@ class DataWidget(QFrame):
         self.setStyleSheet("border: 1px solid grey")
 
         # Automatically update data when it arrives from socket
-        backend_signals().new_drive_data.connect(self.update_data)
+        backend_signals().display_drive_data.connect(self.update_data)
 
     def update_data(self, data: DriveData):
         self.labels[0].update_data(int(data.elapsed_time / 1000))  # ms-> s
@@ -131,44 +139,30 @@ class DataWidget(QFrame):
         self.labels[5].update_data(data.obstacle_distance)
         self.labels[6].update_data(data.lateral_position)
         self.labels[7].update_data(data.angle)
-        self.all_data.append(data)  # Add data to history
 
     def save_data(self):
-        """ Save all drive signals as csv files """
-
-        self.save_signal("throttle",
-                         [str(data.throttle) for data in self.all_data])
-
-        self.save_signal("steering",
-                         [str(data.steering) for data in self.all_data])
-
-        self.save_signal("speed",
-                         [str(data.speed) for data in self.all_data])
-
-        self.save_signal("driving_distance",
-                         [str(data.driving_distance) for data in self.all_data])
-
-        self.save_signal("obstacle_distance",
-                         [str(data.obstacle_distance) for data in self.all_data])
-
-        self.save_signal("lateral_position",
-                         [str(data.lateral_position) for data in self.all_data])
+        """ Save all drive data to file, in the background """
+        if self.exporter is not None and self.exporter.isRunning():
+            LOG("WARN", "Drive data is already being saved")
+            return
 
-        self.save_signal("angle",
-                         [str(data.angle) for data in self.all_data])
+        os.makedirs(DATA_PATH, exist_ok=True)
+        extension = ".csv" if EXPORT_FORMAT == "csv" else ".bin"
+        fname = DATA_PATH + strftime("drive_data_%Y%m%d_%H%M%S") + extension
 
-        LOG("INFO", "Saved all drive data to folder \"{}\"".format(DATA_PATH))
+        self.exporter = TelemetryExporter(self.all_data, fname, EXPORT_FORMAT,
+                                          self)
+        self.exporter.exported.connect(self.on_saved)
+        self.exporter.failed.connect(self.on_save_failed)
+        self.exporter.start()
 
-    def save_signal(self, name, data_list):
-        """ Saves list of strings as csv-file with name """
-        fname = DATA_PATH + name + ".csv"
+    def on_saved(self, fname: str, samples: int):
+        LOG("INFO", "Saved {} drive data samples to \"{}\"".format(
+            samples, fname))
 
-        with open(fname, "w") as file:
-            file.write(",".join(data_list) + "\n")
-            file.write(",".join([str(data.elapsed_time)
-                       for data in self.all_data]))
-            file.close()
-        print("Saved " + name + " data to: " + fname)
+    def on_save_failed(self, fname: str, error: str):
+        LOG("ERROR", "Could not save drive data to \"{}\": {}".format(
+            fname, error))
 
 
 class PlanWidget(QWidget):
@@ -313,10 +307,19 @@ class AutoPlanWidget(QScrollArea):
             font = self.font()
             font.setPointSize(30)
             self.setFont(font)
+            self.dest_name = dest_name
             self.setText(dest_name)
 
             self.set_status(AutoPlanWidget.DestinationStatus.NOT_ACTIVE)
 
+        def set_eta(self, eta: float):
+            """ Shows estimated time (s) until arrival, None for no estimate """
+            if eta is None:
+                self.setText(self.dest_name)
+            else:
+                self.setText('{}<br><span style="font-size: 12pt">'
+                             'ETA {:.0f} s</span>'.format(self.dest_name, eta))
+
         def set_status(self, status: int):
             print("Updating destination status to ", status)
             if status == AutoPlanWidget.DestinationStatus.COMPLETED:
@@ -375,6 +378,20 @@ class AutoPlanWidget(QScrollArea):
             self.next_dest_index = 1
             self.dest_labels[self.current_pos_index].set_status(
                 AutoPlanWidget.DestinationStatus.COMPLETED)
+            self.update_etas(mission.destinations[0])
+
+    def update_etas(self, position: str, extra: float = 0):
+        """ Updates estimated arrival at the remaining destinations, driving
+        from position after extra time (s) """
+        eta = extra
+        for index in range(self.next_dest_index, len(self.dest_labels)):
+            leg = router().distance(position, self.mission.destinations[index])
+            if leg is None:
+                eta = None  # Unknown from here on
+            elif eta is not None:
+                eta += leg * WEIGHT_TIME
+            self.dest_labels[index].set_eta(eta)
+            position = self.mission.destinations[index]
 
     def update_destinations(self, position: str):
         """ Updates list of destinations based on position data from car """
@@ -384,6 +401,12 @@ class AutoPlanWidget(QScrollArea):
             print("Is on edge:", position)
             self.dest_labels[self.next_dest_index].set_status(
                 AutoPlanWidget.DestinationStatus.ACTIVE)
+
+            # Estimate from the node the car is driving to
+            current, next = position.split("->", 1)
+            weight = router().distance(current, next)
+            self.update_etas(next, None if weight is None
+                             else weight * WEIGHT_TIME)
         else:
             # Car is stopped at node
             print("Is at node:", position)
@@ -392,6 +415,7 @@ class AutoPlanWidget(QScrollArea):
 
                 self.dest_labels[self.next_dest_index].set_status(
                     AutoPlanWidget.DestinationStatus.COMPLETED)
+                self.dest_labels[self.next_dest_index].set_eta(None)
 
                 self.next_dest_index += 1
 
@@ -401,29 +425,82 @@ class AutoPlanWidget(QScrollArea):
                     AutoPlanWidget.DestinationStatus.COMPLETED)
 
 
-class LogWidget(QTabWidget):
-    """ A log that displays log data from backend """
+class LogWidget(QWidget):
+    """ A log that displays log entries from backend, filtered by severity and
+    search text. New entries are added in batches, and only the latest
+    LOG_MAX_BLOCKS matching entries are shown. """
+
+    FILTERS = [("Allt", SEVERITIES),
+               ("Varningar", ("WARN", "ERROR")),
+               ("Fel", ("ERROR",))]
+    """ Label and shown severities of each filter tab """
 
     def __init__(self):
         super().__init__()
         self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.severities = self.FILTERS[0][1]
+        self.search_text = ""
 
-        self.logger = QPlainTextEdit(self)
-        self.logger.setReadOnly(True)
-        self.text = ""
-        backend_signals().log_msg.connect(self.add_log)  # Add a log from backend
+        self.filter_tabs = QTabBar()
+        for label, _ in self.FILTERS:
+            self.filter_tabs.addTab(label)
+        self.filter_tabs.currentChanged.connect(self.set_filter)
 
-        self.addTab(self.logger, "Logg")
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("Sök")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.set_search)
 
-    def add_log(self, severity, message):
-        """ Adds message with severity and timestamp to the log widget on GUI """
-        current_time = \
-            str(localtime().tm_hour).zfill(2) + ":" + \
-            str(localtime().tm_min).zfill(2) + ":" + \
-            str(localtime().tm_sec).zfill(2)
+        self.logger = QPlainTextEdit()
+        self.logger.setReadOnly(True)
+        self.logger.setUndoRedoEnabled(False)
+        self.logger.setMaximumBlockCount(LOG_MAX_BLOCKS)
 
-        entry = "[" + current_time + " - " + severity + "]\t" + message
-        self.logger.appendPlainText(entry)
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(self.filter_tabs)
+        top_layout.addStretch()
+        top_layout.addWidget(self.search_box)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(top_layout)
+        layout.addWidget(self.logger)
+
+        log_buffer().new_entries.connect(self.add_entries)
+        self.refresh()
+
+    def set_filter(self, index: int):
+        self.severities = self.FILTERS[index][1]
+        self.refresh()
+
+    def set_search(self, text: str):
+        self.search_text = text.lower()
+        self.refresh()
+
+    def matches(self, entry: LogEntry) -> bool:
+        return entry.severity in self.severities and (
+            not self.search_text or self.search_text in entry.message.lower())
+
+    def add_entries(self, entries: list[LogEntry]):
+        """ Adds a batch of new entries to the log widget on GUI """
+        lines = [str(entry) for entry in entries if self.matches(entry)]
+        if lines:
+            self.logger.appendPlainText("\n".join(lines[-LOG_MAX_BLOCKS:]))
+        self.update_tab_labels()
+
+    def refresh(self):
+        """ Shows the latest entries matching the filter and search text """
+        lines = deque((str(entry) for entry in log_buffer().entries
+                       if self.matches(entry)), maxlen=LOG_MAX_BLOCKS)
+        self.logger.setPlainText("\n".join(lines))
+        self.logger.moveCursor(QTextCursor.End)
+        self.update_tab_labels()
+
+    def update_tab_labels(self):
+        counts = log_buffer().counts
+        for index, (label, severities) in enumerate(self.FILTERS[1:], 1):
+            count = sum(counts[severity] for severity in severities)
+            self.filter_tabs.setTabText(
+                index, "{} ({})".format(label, count) if count else label)
 
 
 class ParameterWidget(QWidget):
@@ -473,7 +550,8 @@ class ParameterWidget(QWidget):
         self.params.turn_kd = int(self.turn_kd_textbox.text())
         self.params.angle_offset = int(self.angle_offset_textbox.text())
 
-        socket().send_message(self.params.to_json())
+        connection_manager().send_state("ParameterConfiguration",
+                                        self.params.to_json())
         self.close_popup()
 
     def close_popup(self):
@@ -554,12 +632,20 @@ class ControlsWidget(QWidget):
 
 
 class ManualMode(QWidget):
-    """ The buttons needed for manual driving """
+    """ The buttons needed for manual driving. The held WASD/QE keys and
+    buttons are combined into one drive state, streamed by ManualControl. """
+
+    KEY_STEERING = {Qt.Key_W: 0, Qt.Key_A: -FULL_STEER, Qt.Key_D: FULL_STEER,
+                    Qt.Key_Q: -HALF_STEER, Qt.Key_E: HALF_STEER}
+    """ Steering of each key that drives forward """
+
+    STOP_KEY = Qt.Key_S
+    """ Key which stops the car while held """
 
     class DriveButton(QToolButton):
-        """ A button for steering the car in manual mode"""
+        """ A button for steering the car in manual mode, held like a key """
 
-        def __init__(self, action, arrow):
+        def __init__(self, key, arrow, mode):
             super().__init__()
 
             size_policy = QSizePolicy()
@@ -567,9 +653,8 @@ class ManualMode(QWidget):
             size_policy.setVerticalPolicy(QSizePolicy.Expanding)
             size_policy.setWidthForHeight(True)  # Ensure square button
 
-            self.clicked.connect(action)
-            self.setAutoRepeat(True)
-            self.setAutoRepeatInterval(MAX_SEND_RATE * 250)
+            self.pressed.connect(lambda: mode.press(key))
+            self.released.connect(lambda: mode.release(key))
             self.setArrowType(arrow)
             self.setSizePolicy(size_policy)
             self.setStyleSheet("border: 1px solid grey")
@@ -578,83 +663,106 @@ class ManualMode(QWidget):
         super().__init__()
         self.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
 
+        self.held: set[int] = set()  # Drive keys and buttons held down
         self.create_drive_buttons()
-        self.setup_keyboard_shortcuts()
 
-        self.timer = time()
+        # Key releases can't be seen with QShortcut, filter all key events
+        QApplication.instance().installEventFilter(self)
+        backend_signals().emergency_stop.connect(self.release_all)
+
+        self.analog: AnalogControl = None
+        gamepad = find_gamepad()
+        if gamepad is not None:
+            self.set_input_source(gamepad)
+
+    def set_input_source(self, source: InputSource):
+        """ Drives with analog source, in addition to keys """
+        if self.analog is not None:
+            self.analog.stop()
+            self.analog.source.close()
+        self.analog = AnalogControl(source, self)
+        if self.isVisible():
+            self.analog.start()
+        LOG("INFO", "Using \"{}\" for manual driving".format(source.name))
 
     def create_drive_buttons(self):
         """ Adds drive buttons in a 3x2 grid """
         layout = QGridLayout(self)
 
-        fwrd = self.DriveButton(self.send_fwrd, Qt.UpArrow)
+        fwrd = self.DriveButton(Qt.Key_W, Qt.UpArrow, self)
         layout.addWidget(fwrd, 0, 1)
 
-        bwrd = self.DriveButton(self.send_bwrd, Qt.DownArrow)
+        bwrd = self.DriveButton(Qt.Key_S, Qt.DownArrow, self)
         layout.addWidget(bwrd, 1, 1)
 
-        left = self.DriveButton(self.send_left, Qt.LeftArrow)
+        left = self.DriveButton(Qt.Key_A, Qt.LeftArrow, self)
         layout.addWidget(left, 1, 0)
 
-        right = self.DriveButton(self.send_right, Qt.RightArrow)
+        right = self.DriveButton(Qt.Key_D, Qt.RightArrow, self)
         layout.addWidget(right, 1, 2)
 
-        fwrd_right = self.DriveButton(self.send_fwrd_right, Qt.NoArrow)
+        fwrd_right = self.DriveButton(Qt.Key_E, Qt.NoArrow, self)
         layout.addWidget(fwrd_right, 0, 2)
 
-        fwrd_left = self.DriveButton(self.send_fwrd_left, Qt.NoArrow)
+        fwrd_left = self.DriveButton(Qt.Key_Q, Qt.NoArrow, self)
         layout.addWidget(fwrd_left, 0, 0)
 
         self.setLayout(layout)
 
-    def setup_keyboard_shortcuts(self):
-        """ Create WASD keybord shortcuts """
-        shortcut_fwrd = QShortcut(QKeySequence("w"), self)
-        shortcut_fwrd.activated.connect(self.send_fwrd)
-
-        shortcut_bwrd = QShortcut(QKeySequence("s"), self)
-        shortcut_bwrd.activated.connect(self.send_bwrd)
-
-        shortcut_right = QShortcut(QKeySequence("d"), self)
-        shortcut_right.activated.connect(self.send_right)
-
-        shortcut_left = QShortcut(QKeySequence("a"), self)
-        shortcut_left.activated.connect(self.send_left)
-
-        shortcut_fwrd_right = QShortcut(QKeySequence("e"), self)
-        shortcut_fwrd_right.activated.connect(self.send_fwrd_right)
-
-        shortcut_fwrd_left = QShortcut(QKeySequence("q"), self)
-        shortcut_fwrd_left.activated.connect(self.send_fwrd_left)
-
-    def send_fwrd(self):
-        self.send_drive_instruction(ManualDriveInstruction(CAR_ACC, 0))
-
-    def send_bwrd(self):
-        self.send_drive_instruction(ManualDriveInstruction(0, 0))
-
-    def send_right(self):
-        self.send_drive_instruction(
-            ManualDriveInstruction(CAR_ACC, FULL_STEER))
-
-    def send_left(self):
-        self.send_drive_instruction(
-            ManualDriveInstruction(CAR_ACC, -FULL_STEER))
+    def eventFilter(self, watched, event) -> bool:
+        """ Tracks drive keys pressed in this window, events are not consumed """
+        type = event.type()
+        if type in (QEvent.KeyPress, QEvent.KeyRelease):
+            # Each key event passes the window first, then the focused widget
+            if (watched.isWindowType() and not event.isAutoRepeat() and
+                    self.isVisible() and
+                    watched is self.window().windowHandle()):
+                key = event.key()
+                if type == QEvent.KeyRelease:
+                    self.release(key)
+                elif not isinstance(QApplication.focusWidget(),
+                                    (QLineEdit, QPlainTextEdit)):
+                    self.press(key)
+        elif type == QEvent.WindowDeactivate and watched is self.window():
+            self.release_all()  # Releases won't be seen
+        return False
+
+    def press(self, key):
+        if key in self.KEY_STEERING or key == self.STOP_KEY:
+            self.held.add(key)
+            self.update_state()
+
+    def release(self, key):
+        if key in self.held:
+            self.held.discard(key)
+            self.update_state()
+
+    def release_all(self):
+        self.held.clear()
+        self.update_state()
+
+    def update_state(self):
+        """ Combines held keys into throttle and steering """
+        if not self.held or self.STOP_KEY in self.held:
+            manual_control().set_state(0, 0)
+            return
 
-    def send_fwrd_right(self):
-        self.send_drive_instruction(
-            ManualDriveInstruction(CAR_ACC, HALF_STEER))
+        steering = sum(self.KEY_STEERING[key] for key in self.held)
+        manual_control().set_state(
+            CAR_ACC, max(-FULL_STEER, min(FULL_STEER, steering)))
 
-    def send_fwrd_left(self):
-        self.send_drive_instruction(
-            ManualDriveInstruction(CAR_ACC, -HALF_STEER))
+    def showEvent(self, event):
+        super().showEvent(event)
+        manual_control().start()
+        if self.analog is not None:
+            self.analog.start()
 
-    def send_drive_instruction(self, drive_instruction: ManualDriveInstruction):
-        """ Sends drive intruction at approximately MAX_SEND_RATE (Hz) """
-        new_time = time()
-        if new_time - self.timer > MAX_SEND_RATE:
-            socket().send_message(drive_instruction.to_json())
-            self.timer = new_time  # Reset timer
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.held.clear()
+        if self.analog is not None:
+            self.analog.stop()
+        manual_control().stop()
 
 
 class SemiMode(QWidget):
@@ -742,6 +850,12 @@ class AutoMode(QWidget):
         clear_btn.clicked.connect(self.clear_mission)
         btn_layout.addWidget(clear_btn)
 
+        # Reorder mission to shortest button
+        optimize_btn = QPushButton("Optimize")
+        optimize_btn.setFixedSize(100, 50)
+        optimize_btn.clicked.connect(self.optimize_mission)
+        btn_layout.addWidget(optimize_btn)
+
         # Start mission button
         start_btn = QPushButton("Start")
         start_btn.setFixedSize(100, 50)
@@ -766,6 +880,11 @@ class AutoMode(QWidget):
             LOG("ERROR", "Can't drive to self, destination " + new_dest)
             return
 
+        errors = router().errors(self.auto.destinations[-1:] + [new_dest])
+        if errors:
+            LOG("ERROR", ", ".join(errors))
+            return
+
         print("Adding new destination", new_dest)
 
         self.auto.add_destination(new_dest)
@@ -773,10 +892,28 @@ class AutoMode(QWidget):
         backend_signals().update_drive_mission.emit(self.auto)
         print(self.auto.to_json())
 
+    def optimize_mission(self):
+        """ Reorders destinations after the first to the shortest mission """
+        destinations = router().plan(self.auto.destinations)
+        if destinations is None:
+            LOG("ERROR", "No drivable order of destinations")
+            return
+
+        before = router().length(self.auto.destinations)
+        self.auto.destinations = destinations
+        backend_signals().update_drive_mission.emit(self.auto)
+        LOG("INFO", "Mission reordered, length {} (was {})".format(
+            router().length(destinations), before))
+
     def send_mission(self):
         """ Send current drive mission to car """
+        errors = router().errors(self.auto.destinations)
+        if errors:
+            LOG("ERROR", "Mission not sent: " + ", ".join(errors))
+            return
+
         LOG("INFO", "Sending driving mission")
-        socket().send_message(self.auto.to_json())
+        connection_manager().send_state("DriveMission", self.auto.to_json())
 
 
 class ButtonsWidget(QWidget):
@@ -0,0 +1,115 @@
+from collections import deque
+from itertools import count
+from time import time
+
+from PySide6.QtCore import QObject, QTimer, Signal
+from PySide6.QtWidgets import QApplication
+
+from backend import backend_signals, message_dispatcher, socket
+from config import (DATA_AGE_WINDOW, LATENCY_PROBE_INTERVAL, LATENCY_PROBES,
+                    LATENCY_WINDOW)
+from data import DriveData, Ping, Pong
+
+
+def percentiles(samples, *fractions) -> list[float]:
+    """ Returns the given percentiles (0 to 1) of samples, None if empty """
+    samples = sorted(samples)
+    if not samples:
+        return [None for _ in fractions]
+    return [samples[min(int(len(samples) * fraction), len(samples) - 1)]
+            for fraction in fractions]
+
+
+class LatencyMonitor(QObject):
+    """ A singleton class, which measures the round trip time to the car with
+    Ping probes, and estimates the offset between the car's clock and local
+    time NTP-style. With the offset, the age of each DriveData when it was
+    recieved is known. Probes are only sent if LATENCY_PROBES is set. """
+
+    # Maintain only one instance
+    _instance = None
+
+    MAX_PENDING = 16
+    """ Unanswered probes remembered, older are considered lost """
+
+    pong_recieved = Signal(Pong, float)
+    """ Pong and time (s since epoch) it was recieved, emitted in the socket's
+    thread and handled in the GUI thread """
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.ids = count()
+        self.pending: dict[int, float] = {}  # Send time of probes by id
+        # Round trip delay and clock offset (s) of the latest probes
+        self.probes: deque[tuple[float, float]] = deque(maxlen=LATENCY_WINDOW)
+        self.ages: deque[float] = deque(maxlen=DATA_AGE_WINDOW)
+        self.offset: float = None  # Car clock minus local clock (s)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.send_probe)
+
+        self.pong_recieved.connect(self.on_pong)
+        message_dispatcher().register(
+            "Pong", lambda pong: self.pong_recieved.emit(
+                pong, message_dispatcher().recieved))
+        backend_signals().new_drive_data.connect(self.on_drive_data)
+        backend_signals().connection_changed.connect(self.on_connection_changed)
+
+    def on_connection_changed(self, connected: bool):
+        if not connected:
+            # Probes can't be answered, and replayed data must not get ages
+            self.pending.clear()
+            self.offset = None
+        if not connected or not LATENCY_PROBES:
+            self.timer.stop()
+            return
+
+        # The car's clock may have restarted
+        self.pending.clear()
+        self.probes.clear()
+        self.ages.clear()
+        self.offset = None
+        self.send_probe()
+        self.timer.start(int(LATENCY_PROBE_INTERVAL * 1000))
+
+    def send_probe(self):
+        id = next(self.ids)
+        sent = time()
+        self.pending[id] = sent
+        while len(self.pending) > self.MAX_PENDING:
+            del self.pending[next(iter(self.pending))]  # Lost
+        socket().send_message(Ping(id, int(sent * 1e6)).to_json())
+
+    def on_pong(self, pong: Pong, recieved: float):
+        sent = self.pending.pop(pong.id, None)
+        if sent is None:
+            return  # Unknown or lost probe
+
+        car_recieved = pong.recieved / 1e6
+        car_replied = pong.replied / 1e6
+        delay = (recieved - sent) - (car_replied - car_recieved)
+        offset = ((car_recieved - sent) + (car_replied - recieved)) / 2
+        self.probes.append((delay, offset))
+
+        # Probe with the least delay has the least asymmetry, trust its offset
+        self.offset = min(self.probes)[1]
+
+    def on_drive_data(self, data: DriveData):
+        if self.offset is None or data.recieved is None:
+            return
+        self.ages.append(data.recieved - (data.elapsed_time / 1000 - self.offset))
+
+    def round_trip(self) -> list[float]:
+        """ Median and 99th percentile of round trip time (s) """
+        return percentiles([delay for delay, _ in self.probes], 0.5, 0.99)
+
+    def data_age(self) -> list[float]:
+        """ Median and 99th percentile of drive data age (s) when recieved """
+        return percentiles(self.ages, 0.5, 0.99)
+
+
+def latency_monitor():
+    """ Returns instance of the current LatencyMonitor """
+    if LatencyMonitor._instance is None:
+        LatencyMonitor._instance = LatencyMonitor(QApplication.instance())
+    return LatencyMonitor._instance
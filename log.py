@@ -0,0 +1,175 @@
+import os
+from collections import deque
+from functools import lru_cache
+from queue import Empty, SimpleQueue
+from threading import Thread
+from time import localtime, strftime, time
+
+from PySide6.QtCore import QObject, QTimer, Signal
+from PySide6.QtWidgets import QApplication
+
+from backend import backend_signals
+from config import (LOG_CAPACITY, LOG_FILE_COUNT, LOG_FILE_SIZE, LOG_PATH,
+                    LOG_TO_FILE, LOG_UPDATE_INTERVAL)
+
+SEVERITIES = ("INFO", "WARN", "ERROR")
+""" Severities used in the log, least severe first """
+
+
+@lru_cache(maxsize=16)
+def format_second(second: int, format: str = "%H:%M:%S") -> str:
+    """ Local time of second since epoch, formatted with strftime """
+    return strftime(format, localtime(second))
+
+
+class LogEntry:
+    """ A logged message, with the time (s since epoch) it was logged """
+
+    __slots__ = ("time", "severity", "message")
+
+    def __init__(self, time: float, severity: str, message: str):
+        self.time = time
+        self.severity = severity
+        self.message = message
+
+    def __str__(self):
+        return "[{} - {}]\t{}".format(format_second(int(self.time)),
+                                      self.severity, self.message)
+
+    def file_line(self) -> str:
+        """ The entry as a line in the log file, with date and milliseconds """
+        return "{}.{:03d} {} {}\n".format(
+            format_second(int(self.time), "%Y-%m-%d %H:%M:%S"),
+            int(self.time % 1 * 1000), self.severity, self.message)
+
+
+class LogFile:
+    """ Writes log entries to a file from a background thread, as many as are
+    queued at once. When the file has grown to LOG_FILE_SIZE it is renamed
+    path.1, and older files path.2 up to path.LOG_FILE_COUNT. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+        self.queue = SimpleQueue()
+        self.thread = Thread(target=self.run, name="LogFile", daemon=True)
+        self.thread.start()
+
+    def write(self, entry: LogEntry):
+        self.queue.put(entry)
+
+    def close(self):
+        """ Writes queued entries, then closes the file """
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            entries = [self.queue.get()]
+            try:
+                while True:
+                    entries.append(self.queue.get_nowait())
+            except Empty:
+                pass
+
+            try:
+                self.file.write("".join(entry.file_line() for entry in entries
+                                        if entry is not None))
+                self.file.flush()
+                if self.file.tell() >= LOG_FILE_SIZE:
+                    self.rotate()
+            except OSError as e:
+                print("Could not write log file:", e)
+            if None in entries:
+                self.file.close()
+                return
+
+    def rotate(self):
+        self.file.close()
+        for number in range(LOG_FILE_COUNT - 1, 0, -1):
+            name = "{}.{}".format(self.path, number)
+            if os.path.exists(name):
+                os.replace(name, "{}.{}".format(self.path, number + 1))
+        os.replace(self.path, self.path + ".1")
+        self.file = open(self.path, "w", encoding="utf-8")
+
+
+class LogBuffer(QObject):
+    """ A singleton class, which keeps the latest LOG_CAPACITY log entries.
+
+    New entries are passed on in batches, at most every LOG_UPDATE_INTERVAL,
+    so a flood of messages costs one update of the log widget per interval.
+    With LOG_TO_FILE every entry is also written to a rotating log file, by
+    a background thread. """
+
+    # Maintain only one instance
+    _instance = None
+
+    new_entries = Signal(list)
+    """ Entries logged since the last batch, oldest first """
+
+    def __init__(self, parent, path: str = LOG_PATH):
+        super().__init__(parent)
+        self.entries: deque[LogEntry] = deque(maxlen=LOG_CAPACITY)
+        self.pending: list[LogEntry] = []
+        self.counts = dict.fromkeys(SEVERITIES, 0)  # Entries since start
+        self.total = 0
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+        self.file: LogFile = None
+        if LOG_TO_FILE:
+            self.start_file(path)
+
+        backend_signals().log_msg.connect(self.add)
+
+    def start_file(self, path: str):
+        """ Starts writing entries to log.txt in folder path """
+        try:
+            os.makedirs(path, exist_ok=True)
+            self.file = LogFile(path + "log.txt")
+        except OSError as e:
+            print("Could not open log file:", e)
+            return
+        QApplication.instance().aboutToQuit.connect(self.stop_file)
+
+    def stop_file(self):
+        """ Writes remaining entries to file and closes it """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def add(self, severity: str, message: str):
+        """ Adds an entry, which is passed on with the next batch """
+        entry = LogEntry(time(), severity, message)
+        self.entries.append(entry)
+        self.pending.append(entry)
+        self.counts[severity] = self.counts.get(severity, 0) + 1
+        self.total += 1
+
+        if self.file is not None:
+            self.file.write(entry)
+        if not self.timer.isActive():
+            self.timer.start(int(LOG_UPDATE_INTERVAL * 1000))
+
+    def flush(self):
+        """ Emits the entries added since the last batch """
+        if self.pending:
+            # Only the latest LOG_CAPACITY entries are kept, in batches too
+            batch = self.pending[-LOG_CAPACITY:]
+            self.pending = []
+            self.new_entries.emit(batch)
+
+    @property
+    def evicted(self) -> int:
+        """ Number of entries no longer kept in memory """
+        return self.total - len(self.entries)
+
+
+def log_buffer():
+    """ Returns instance of the current LogBuffer """
+    if LogBuffer._instance is None:
+        LogBuffer._instance = LogBuffer(QApplication.instance())
+    return LogBuffer._instance
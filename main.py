@@ -1,12 +1,24 @@
 from PySide6.QtGui import QAction
-from PySide6.QtWidgets import (QApplication, QHBoxLayout, QMainWindow, QMenu,
+from PySide6.QtWidgets import (QApplication, QFileDialog, QHBoxLayout,
+                               QInputDialog, QMainWindow, QMenu, QTabWidget,
                                QVBoxLayout, QWidget)
 
-from backend import backend_signals, socket
-from config import GUI_HEIGHT, GUI_WIDTH
+from backend import (MainThreadMonitor, backend_signals, connection_manager,
+                     drive_data_coalescer, message_dispatcher, socket)
+from config import DATA_PATH, GUI_HEIGHT, GUI_WIDTH
 from graphics_widgets import (ButtonsWidget, ControlsWidget, DataWidget,
                               LogWidget, MapWidget, PlanWidget)
+from latency import latency_monitor
 from map_creator import MapCreatorWindow
+from plots import PlotWidget
+from replay import replay_source
+from routing import current_map_path, router
+
+
+def format_ms(seconds: list[float]) -> str:
+    """ Formats times (s) as ms, separated by / """
+    return "/".join("-" if time is None else "{:.1f}".format(time * 1000)
+                    for time in seconds)
 
 
 class MainWindow(QMainWindow):
@@ -25,6 +37,15 @@ class MainWindow(QMainWindow):
         self.create_grid()
 
         socket()  # Init socket
+        connection_manager()
+        latency_monitor()
+        router()
+        replay_source().finished.connect(self.on_replay_finished)
+
+        # Show how long the GUI thread is blocked, once per second
+        self.monitor = MainThreadMonitor(self)
+        backend_signals().main_thread_blocked.connect(self.update_status)
+        self.monitor.start()
 
     def create_menu(self):
         menu_bar = self.menuBar()
@@ -33,6 +54,15 @@ class MainWindow(QMainWindow):
         connect_action = QAction("Connect to car", file_menu)
         connect_action.triggered.connect(self.connect_to_car)
         file_menu.addAction(connect_action)
+        disconnect_action = QAction("Disconnect from car", file_menu)
+        disconnect_action.triggered.connect(self.disconnect_from_car)
+        file_menu.addAction(disconnect_action)
+        replay_action = QAction("Replay recording", file_menu)
+        replay_action.triggered.connect(self.replay_recording)
+        file_menu.addAction(replay_action)
+        stats_action = QAction("Message statistics", file_menu)
+        stats_action.triggered.connect(self.log_message_stats)
+        file_menu.addAction(stats_action)
         clear_action = QAction("Clear plan", file_menu)
         clear_action.triggered.connect(self.clear_instructions)
         file_menu.addAction(clear_action)
@@ -59,8 +89,13 @@ class MainWindow(QMainWindow):
         controls_widget = ControlsWidget()
         buttons_widget = ButtonsWidget()
 
+        # Map and plots share space, in tabs
+        view_tabs = QTabWidget()
+        view_tabs.addTab(self.map_widget, "Karta")
+        view_tabs.addTab(PlotWidget(), "Grafer")
+
         layout_vert_l_top = QHBoxLayout()
-        layout_vert_l_top.addWidget(self.map_widget)
+        layout_vert_l_top.addWidget(view_tabs)
         layout_vert_l_top.addWidget(data_widget)
         layout_vert_l.addLayout(layout_vert_l_top, 65)
         layout_vert_l.addWidget(logg_widget, 35)
@@ -78,24 +113,76 @@ class MainWindow(QMainWindow):
         self.map_creator.show()
 
     def connect_to_car(self):
-        socket().connect()
+        connection_manager().start()
+
+    def disconnect_from_car(self):
+        connection_manager().stop()
+
+    def replay_recording(self):
+        """ Replays a recorded session or saved drive data, in place of the car """
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Replay recording", DATA_PATH,
+            "Recordings (*.rec *.csv *.bin)")
+        if path == "":
+            return
+
+        speed, ok = QInputDialog.getDouble(
+            self, "Replay speed", "Speed (0 = as fast as possible)",
+            1.0, 0, 1000, 1)
+        if not ok:
+            return
+
+        replay = replay_source()
+        try:
+            messages = replay.load(path)
+        except (OSError, ValueError) as e:
+            backend_signals().log_msg.emit("ERROR", "Could not replay: " + str(e))
+            return
+
+        if replay.start(speed):
+            backend_signals().log_msg.emit(
+                "INFO", "Replaying {} messages from \"{}\"".format(messages, path))
+
+    def on_replay_finished(self, messages: int, seconds: float):
+        backend_signals().log_msg.emit(
+            "INFO", "Replayed {} messages in {:.2f} s ({:.0f} messages/s)".format(
+                messages, seconds, messages / max(seconds, 1e-9)))
+
+    def update_status(self, blocked_ms: float):
+        """ Shows GUI load and drive data statistics in status bar """
+        coalescer = drive_data_coalescer()
+        send_stats = socket().send_stats
+        connection = connection_manager()
+        self.statusBar().showMessage(
+            "GUI blocked: {:.0f} ms/s    Drive data recieved: {}, displayed: {}"
+            "    Send queue: {}, latency: {:.1f} ms"
+            "    Connected: {:.0f} s, reconnects: {}, last took {:.1f} s"
+            "    Round trip p50/p99: {} ms, data age p50/p99: {} ms".format(
+                blocked_ms, coalescer.samples_recieved,
+                coalescer.samples_displayed, socket().queue_depth,
+                send_stats.latency_mean * 1000, connection.uptime,
+                max(connection.connections - 1, 0),
+                connection.reconnect_latency,
+                format_ms(latency_monitor().round_trip()),
+                format_ms(latency_monitor().data_age())))
+
+    def log_message_stats(self):
+        """ Logs message counters and decode times per type """
+        summary = message_dispatcher().summary()
+        backend_signals().log_msg.emit(
+            "INFO", "Messages recieved:\n" + (summary or "None"))
 
     def clear_instructions(self):
         backend_signals().clear_semi_instructions.emit()
 
     def send_map(self):
         """ Sends map to car """
-        map: str
-        try:
-            with open("map/new_map.json", "r") as file:
-                map = file.read()
-        except:
-            with open("map/default_map.json", "r") as file:
-                map = file.read()
+        with open(current_map_path(), "r") as file:
+            map = file.read()
 
         map = map.rstrip().replace("\n", "").replace("  ", "")
         backend_signals().log_msg.emit("INFO", "Sending map to car")
-        socket().send_message(map)
+        connection_manager().send_state("MapData", map)
 
 
 if __name__ == "__main__":
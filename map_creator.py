@@ -1,13 +1,23 @@
-from PySide6.QtCore import QLineF, QPointF, QRectF, QSizeF, Qt
-from PySide6.QtGui import QColor, QKeyEvent, QPainter, QPen
-from PySide6.QtWidgets import (QApplication, QGraphicsItem, QGraphicsScene,
+import json
+import math
+import os
+
+from PySide6.QtCore import QLineF, QPointF, QRectF, Qt, QTimer, Signal
+from PySide6.QtGui import (QColor, QFont, QFontMetricsF, QKeyEvent, QPainter,
+                           QPainterPath, QPen, QStaticText, QTransform,
+                           QWheelEvent)
+from PySide6.QtWidgets import (QApplication, QFileDialog, QGraphicsItem,
+                               QGraphicsPathItem, QGraphicsScene,
                                QGraphicsSceneMouseEvent, QGraphicsView,
                                QHBoxLayout, QLabel, QLineEdit, QMainWindow,
                                QPushButton, QSizePolicy, QStackedWidget,
-                               QVBoxLayout, QWidget)
+                               QStyleOptionGraphicsItem, QVBoxLayout, QWidget)
 
 from backend import backend_signals
+from config import (MAP_DETAIL_SCALE, MAP_LARGE_NODES, MAP_OVERVIEW_SCALE,
+                    MAP_VALIDATE_DELAY)
 from data import MapData
+from routing import current_map_path
 
 
 class Node(QGraphicsItem):
@@ -16,15 +26,18 @@ class Node(QGraphicsItem):
     RADIUS = 60
     BORDER = QPen(Qt.black, 2)  # Color and thickness
     FILL_COLOR = QColor("blue").lighter(150)
+    BOUNDS = QRectF(-RADIUS/2 - 20, -RADIUS/2 - 20, RADIUS + 40, RADIUS + 40)
+    """ Area drawn, the circle and direction labels around it """
+    DIRECTION_FONT = QFont()
+    DIRECTION_FONT.setPixelSize(25)
 
     def __init__(self, parent, name: str):
         super().__init__()
         self.graph: MapCreatorWidget = parent
 
         self.setZValue(0)
-        self.setFlag(self.ItemIsMovable)
-        self.setFlag(self.ItemSendsGeometryChanges)
-        self.setCacheMode(self.DeviceCoordinateCache)
+        self.setFlag(QGraphicsItem.ItemIsMovable)
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
 
         self.name = name
         self.fill_color = self.FILL_COLOR
@@ -48,6 +61,7 @@ class Node(QGraphicsItem):
     def set_name(self, new_name):
         """ Updates node's name """
         print("New name: " + str(new_name))
+        old_name = self.name
         self.name = str(new_name)
 
         for edge in self.edge_list:
@@ -55,6 +69,8 @@ class Node(QGraphicsItem):
 
         # TODO: Check if name already is in use
 
+        if self.graph is not None:
+            self.graph.node_renamed(self, old_name)
         self.update()
 
     def disconnect_edge(self, edge_rm):
@@ -64,7 +80,6 @@ class Node(QGraphicsItem):
     def addEdge(self, edge: 'Edge'):
         """ Adds an edge to this node """
         self.edge_list.append(edge)
-        edge.adjust()
 
     def mouseDoubleClickEvent(self, event: QGraphicsSceneMouseEvent):
         """ If user double clicks on two nodes, connect them """
@@ -91,32 +106,32 @@ class Node(QGraphicsItem):
         self.graph.scene().update()
         return super().mouseDoubleClickEvent(event)
 
-    def itemChange(self, change: QGraphicsItem.GraphicsItemChange, value):
-        # Runs when this node has been changed
-        if change == QGraphicsItem.GraphicsItemChange.ItemPositionHasChanged:
-            # Check if user moved this node
-            for edge in self.edge_list:
-                edge.adjust()  # Adjust edges to new node position
-
-        return super().itemChange(change, value)
+    def mouseMoveEvent(self, event: QGraphicsSceneMouseEvent):
+        # Nodes are moved by dragging, and placed before they have edges, so
+        # edges follow here instead of in an itemChange override, which
+        # would run for every change of every node
+        super().mouseMoveEvent(event)
+        for edge in self.edge_list:
+            edge.adjust()  # Adjust edges to new node position
+        self.graph.node_moved()
 
     def boundingRect(self):
-        offset = 40
-        return QRectF(-self.RADIUS/2-offset/2, -self.RADIUS/2-offset/2,
-                      self.RADIUS+offset, self.RADIUS+offset)
+        return self.BOUNDS
 
-    def paint(self, painter: QPainter, _option, _widget):
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem,
+              _widget):
         # Draws filled circle with a border
         painter.setBrush(self.fill_color)
         painter.setPen(self.BORDER)
         painter.drawEllipse(-self.RADIUS/2, -self.RADIUS/2,
                             self.RADIUS, self.RADIUS)
+        if option.levelOfDetailFromTransform(
+                painter.worldTransform()) < MAP_DETAIL_SCALE:
+            return  # Text is too small to read
         painter.drawText(-4, 5, self.name)
 
         if self.direction is not None:
-            font = painter.font()
-            font.setPixelSize(25)
-            painter.setFont(font)
+            painter.setFont(self.DIRECTION_FONT)
             painter.setPen(Qt.green)
             normal = self.direction.normalVector()
             normal.setLength(40)
@@ -125,12 +140,10 @@ class Node(QGraphicsItem):
             painter.drawText(normal.p2(), "2")
 
     def set_direction(self, previous, next_nodes, reversed=False):
-        print([node.name for node in next_nodes])
         pos = (self.pos()-previous.pos())
         for node in next_nodes:
             pos += (node.pos()-self.pos())
 
-        print(self.name, pos)
         self.direction = QLineF(QPointF(0, 0), pos)
         if reversed:
             self.direction.setLength(-1)
@@ -140,7 +153,13 @@ class Node(QGraphicsItem):
 
 
 class Edge(QGraphicsItem):
-    """ Represents an edge connecting two Nodes """
+    """ Represents an edge connecting two Nodes. The label and the area drawn
+    are laid out when the edge changes, not each time it is drawn. """
+
+    PEN = QPen(Qt.black, 5, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
+    LABEL_FONT = QFont()
+    LABEL_FONT.setPixelSize(20)
+    label_ascent: float = None  # Of LABEL_FONT, known once there is an app
 
     def __init__(self, start_node: Node, end_node: Node, weight: int = 1):
         super().__init__()
@@ -149,15 +168,16 @@ class Edge(QGraphicsItem):
         self.line = QLineF()
         self.start = start_node
         self.end = end_node
+        self.label = QStaticText()
+        self.label_pos = QPointF()
+        self.bounds = QRectF()
 
-        self.update_name()
         self.weight = weight
+        self.update_name()
 
         self.start.addEdge(self)
         self.end.addEdge(self)
 
-        self.adjust()
-
     def get_other_node(self, node: Node):
         """ Returns the other node this edge is connected to """
         if node != self.start and node != self.end:
@@ -178,22 +198,56 @@ class Edge(QGraphicsItem):
     def adjust(self):
         self.prepareGeometryChange()
 
-        self.line.setP1(self.start.pos())
-        self.line.setP2(self.end.pos())
+        start, end = self.start.pos(), self.end.pos()
+        self.line.setPoints(start, end)
+        x1, y1, x2, y2 = start.x(), start.y(), end.x(), end.y()
+
+        # Label beside the middle of the edge, text drawn from its top left
+        label_x, label_y = (x1 + x2) / 2 - 15, (y1 + y2) / 2 + 5
+        length = self.line.length()
+        if length > 0:
+            label_x += (y2 - y1) / length * 15
+            label_y -= (x2 - x1) / length * 15
+        label_y -= self.label_ascent
+        self.label_pos = QPointF(label_x, label_y)
+
+        width = self.PEN.widthF() / 2
+        left = min(x1, x2, label_x + width) - width
+        top = min(y1, y2, label_y + width) - width
+        right = max(x1, x2, label_x + self.label_size.width() - width) + width
+        bottom = max(y1, y2,
+                     label_y + self.label_size.height() - width) + width
+        self.bounds = QRectF(left, top, right - left, bottom - top)
 
     def update_name(self):
         """ Sets edge's name as combination of connecting nodes """
         self.name = self.start.name + self.end.name
+        self.update_label()
+
+    def update_label(self):
+        if Edge.label_ascent is None:
+            Edge.label_ascent = QFontMetricsF(self.LABEL_FONT).ascent()
+        self.label.setText("{}: {}".format(self.name, self.weight))
+        self.label.prepare(QTransform(), self.LABEL_FONT)
+        self.label_size = self.label.size()
+        self.adjust()  # Label size changed
 
     def set_weight(self, new_weight):
         """ Updates edge's weight, or deletes it if it was 0 """
         # print("New weight: " + str(new_weight))
         self.weight = abs(int(new_weight))  # No negative or non-int weights
 
+        graph = self.start.graph
         if self.weight == 0:
             # Edge weight 0 means delete edge
             # print("Deleting edge " + self.name)
             self.delete()
+            if graph is not None:
+                graph.graph_changed()
+        else:
+            self.update_label()
+            if graph is not None:
+                graph.edge_changed(self)
 
     def mouseDoubleClickEvent(self, event: QGraphicsSceneMouseEvent):
         """ Opens popup on double click where user can change weight """
@@ -205,31 +259,20 @@ class Edge(QGraphicsItem):
         return super().mouseDoubleClickEvent(event)
 
     def boundingRect(self):
-        start = self.line.p1()
-        end = self.line.p2()
-
-        rect = QRectF(start, QSizeF(end.x() - start.x(), end.y() - start.y()))
-        return rect.normalized()
-
-    def paint(self, painter: QPainter, _option, _widget):
-        painter.setPen(QPen(Qt.black, 5, Qt.SolidLine,
-                       Qt.RoundCap, Qt.RoundJoin))
+        return self.bounds
 
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem,
+              _widget):
         # Draw edge
+        painter.setPen(self.PEN)
         painter.drawLine(self.line)
 
-        # Calculate where to put edge label
-        offset_x = self.line.normalVector().dx() / self.line.length() * 15 - 15
-        offset_y = self.line.normalVector().dy() / self.line.length() * 15 + 5
-        text_pos = QPointF(self.line.center().x() + offset_x,
-                           self.line.center().y() + offset_y)
-
-        # Draw edge label
-        font = painter.font()
-        font.setPixelSize(20)
-        painter.setFont(font)
-        painter.setPen(Qt.white)
-        painter.drawText(text_pos, "{}: {}".format(self.name, self.weight))
+        # Draw edge label, if large enough to read
+        if option.levelOfDetailFromTransform(
+                painter.worldTransform()) >= MAP_DETAIL_SCALE:
+            painter.setFont(self.LABEL_FONT)
+            painter.setPen(Qt.white)
+            painter.drawStaticText(self.label_pos, self.label)
 
 
 class SetPropertyWidget(QWidget):
@@ -256,10 +299,15 @@ class MapCreatorWidget(QGraphicsView):
     """ A widget for creating maps, represented as an undirected weighted graph """
 
     SCENESIZE = 800
+    ZOOM_STEP = 1.15
+    """ Zoom per step of the mouse wheel """
 
     # Remeber which node was clicked on last
     selected_node: Node = None
 
+    validated = Signal(list)
+    """ What makes the edited map incomplete, empty if it is complete """
+
     def __init__(self):
         super().__init__()
 
@@ -276,50 +324,48 @@ class MapCreatorWidget(QGraphicsView):
         self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
 
         self.nodes: list[Node] = []
-        self.draw_nodes()
-
-    def draw_nodes(self):
-        scene = self.scene()
-        self.nodes = [Node(self, "A"), Node(self, "B"), Node(self, "C"),
-                      Node(self, "D"), Node(self, "E"), Node(self, "F"),
-                      Node(self, "G"), Node(self, "H"), Node(self, "I"),
-                      Node(self, "J"), Node(self, "K"), Node(self, "L"),
-                      Node(self, "M")]
+        self.large = False  # Map has more than MAP_LARGE_NODES nodes
+        self.overview: QGraphicsPathItem = None  # Shown instead of items
+        self.compiler = IncrementalCompiler()
+
+        # Validate when edits pause, not for every step of a drag
+        self.validate_timer = QTimer(self)
+        self.validate_timer.setSingleShot(True)
+        self.validate_timer.setInterval(int(MAP_VALIDATE_DELAY * 1000))
+        self.validate_timer.timeout.connect(self.validate)
+
+        self.open_map(current_map_path())
+
+    def wheelEvent(self, event: QWheelEvent):
+        """ Zoom in or out around the mouse """
+        self.zoom(self.ZOOM_STEP ** (event.angleDelta().y() / 120))
+
+    def zoom(self, factor: float):
+        """ Scales the view by factor. Zoomed out below MAP_OVERVIEW_SCALE, a
+        large map is drawn as one outline of its edges instead of an item
+        per node and edge. """
+        self.scale(factor, factor)
+        self.set_overview(self.large and
+                          self.transform().m11() < MAP_OVERVIEW_SCALE)
+
+    def set_overview(self, overview: bool):
+        """ Shows the outline of the map in place of its nodes and edges """
+        if overview == (self.overview is not None):
+            return
 
-        for node in self.nodes:
-            scene.addItem(node)
+        edges = {edge for node in self.nodes for edge in node.edge_list}
+        if overview:
+            path = QPainterPath()
+            for edge in edges:
+                path.moveTo(edge.line.p1())
+                path.lineTo(edge.line.p2())
+            self.overview = self.scene().addPath(path, QPen(Qt.black, 0))
+        else:
+            self.scene().removeItem(self.overview)
+            self.overview = None
 
-        scene.addItem(Edge(self.nodes[0], self.nodes[1], 1))
-        scene.addItem(Edge(self.nodes[0], self.nodes[10], 5))
-        scene.addItem(Edge(self.nodes[1], self.nodes[2], 2))
-        scene.addItem(Edge(self.nodes[1], self.nodes[11], 2))
-        scene.addItem(Edge(self.nodes[2], self.nodes[3], 1))
-        scene.addItem(Edge(self.nodes[2], self.nodes[11], 2))
-        scene.addItem(Edge(self.nodes[3], self.nodes[4], 1))
-        scene.addItem(Edge(self.nodes[4], self.nodes[5], 2))
-        scene.addItem(Edge(self.nodes[5], self.nodes[6], 3))
-        scene.addItem(Edge(self.nodes[6], self.nodes[7], 1))
-        scene.addItem(Edge(self.nodes[7], self.nodes[8], 2))
-        scene.addItem(Edge(self.nodes[7], self.nodes[12], 2))
-        scene.addItem(Edge(self.nodes[8], self.nodes[9], 1))
-        scene.addItem(Edge(self.nodes[8], self.nodes[12], 2))
-        scene.addItem(Edge(self.nodes[9], self.nodes[10], 1))
-        scene.addItem(Edge(self.nodes[11], self.nodes[12], 1))
-
-        space_const = Node.RADIUS * 1.5
-        self.nodes[0].setPos(-2*space_const, 2*space_const)
-        self.nodes[1].setPos(-space_const, 2*space_const)
-        self.nodes[2].setPos(space_const, 2*space_const)
-        self.nodes[3].setPos(2*space_const, 2*space_const)
-        self.nodes[4].setPos(3*space_const, 2*space_const)
-        self.nodes[5].setPos(4*space_const, 0)
-        self.nodes[6].setPos(3*space_const, -2*space_const)
-        self.nodes[7].setPos(space_const, -2*space_const)
-        self.nodes[8].setPos(-space_const, -2*space_const)
-        self.nodes[9].setPos(-2*space_const, -2*space_const)
-        self.nodes[10].setPos(-3*space_const, -2*space_const)
-        self.nodes[11].setPos(0, space_const)
-        self.nodes[12].setPos(0, -space_const)
+        for item in self.nodes + list(edges):
+            item.setVisible(not overview)
 
     def keyReleaseEvent(self, event: QKeyEvent):
         """ Delete selected node when user presses delete """
@@ -333,16 +379,52 @@ class MapCreatorWidget(QGraphicsView):
         self.nodes.append(node)
         self.scene().addItem(node)
         node.setPos(15, 15)
+        self.graph_changed()
 
     def add_edge(self, node1, node2):
         """ Connect two nodes with an edge """
         edge = Edge(node1, node2)
         self.scene().addItem(edge)
+        self.graph_changed()
 
     def delete_node(self, node: Node):
         """ Deletes node from widget """
         node.remove_from_scene(self.scene())
         self.nodes = [n for n in self.nodes if n != node]
+        self.graph_changed()
+
+    def node_renamed(self, node: Node, old_name: str):
+        self.compiler.node_renamed(node, old_name)
+        self.validate_timer.start()
+
+    def edge_changed(self, edge: 'Edge'):
+        """ Call when the weight of edge has changed """
+        self.compiler.edge_changed(edge)
+        self.validate_timer.start()
+
+    def node_moved(self):
+        """ Call when a node was moved, left and right may have changed """
+        if not self.compiler.loaded:
+            self.graph_changed()
+
+    def graph_changed(self):
+        """ Call when nodes or edges were added, removed or moved """
+        self.compiler.graph_changed()
+        self.validate_timer.start()
+
+    def validate(self):
+        """ Compiles the edited map and emits what makes it incomplete """
+        try:
+            map = self.get_map()
+        except (IndexError, KeyError, ValueError, TypeError,
+                StopIteration) as e:
+            self.validated.emit(["Could not compile map: {!r}".format(e)])
+            return
+
+        # Nodes not reached from the first node are left out of the map
+        errors = ["Node not connected to map: \"{}\"".format(node.name)
+                  for node in self.nodes if node.name + "1" not in map.map]
+        self.validated.emit(errors + map.graph.errors())
 
     def delete_selected_node(self):
         """ Deletes selected node from widget """
@@ -360,18 +442,98 @@ class MapCreatorWidget(QGraphicsView):
     def drawBackground(self, painter: QPainter, _):
         painter.fillRect(self.sceneRect(), Qt.gray)
 
-    def load_map(map_data: MapData):
-        """ Populates graph from a MapData instance """
-        pass
+    def open_map(self, path: str):
+        """ Loads the map saved at path, with its layout if there is one """
+        try:
+            map_data = MapData({}).load_from_file(path)
+        except (OSError, ValueError, KeyError) as e:
+            print("Could not open map:", e)
+            return
+        self.load_map(map_data, load_layout(path))
+
+    def load_map(self, map_data: MapData, positions: dict = None):
+        """ Populates graph from a MapData instance, where lane nodes X1 and X2
+        become node X. Nodes are placed at positions, [x, y] by node name, or
+        laid out automatically if positions is missing any node. Lanes are
+        ordered by the geometry of the nodes when compiled, which an automatic
+        layout doesn't keep, so map_data is then kept as the compiled map
+        until nodes or edges are added or deleted. """
+        self.setUpdatesEnabled(False)  # Draw once, when all items are added
+        scene = self.scene()
+        scene.clear()
+        self.selected_node = None
+        self.overview = None  # Cleared with the scene
+
+        nodes: dict[str, Node] = {}
+        for lane in map_data.map:
+            if lane[0:-1] not in nodes:
+                nodes[lane[0:-1]] = Node(self, lane[0:-1])
+
+        # One edge per connected node pair. Lane 2 is read first, so the first
+        # edge of the first node is the direction it was compiled from.
+        edges: dict[frozenset, tuple[str, str, int]] = {}
+        for lane in sorted(map_data.map, key=lambda lane: lane[-1:] != "2"):
+            for neighbours in map_data.map[lane]:
+                for neighbour, weight in neighbours.items():
+                    start, end = lane[0:-1], neighbour[0:-1]
+                    if start != end and end in nodes and weight is not None:
+                        edges.setdefault(frozenset((start, end)),
+                                         (start, end, weight))
+
+        # Items added to the spatial index are indexed together on first use
+        self.set_large_map(len(nodes) > MAP_LARGE_NODES)
+        laid_out = positions is None or \
+            not all(name in positions for name in nodes)
+        if laid_out:
+            positions = layout_nodes(list(nodes), list(edges.values()))
+        for name, node in nodes.items():
+            node.setPos(*positions[name])  # Before edges, adjusted once
+            scene.addItem(node)
+        for start, end, weight in edges.values():
+            scene.addItem(Edge(nodes[start], nodes[end], weight))
+
+        self.nodes = list(nodes.values())
+        self.zoom(1)  # Overview of the new map, if zoomed out
+        if self.nodes:
+            xs = [positions[name][0] for name in nodes]
+            ys = [positions[name][1] for name in nodes]
+            bounds = QRectF(min(xs), min(ys), max(xs) - min(xs),
+                            max(ys) - min(ys))
+            scene.setSceneRect(scene.sceneRect().united(bounds.adjusted(
+                -Node.RADIUS, -Node.RADIUS, Node.RADIUS, Node.RADIUS)))
+        self.setUpdatesEnabled(True)
+        print("Loaded map with {} nodes".format(len(self.nodes)))
+        self.graph_changed()
+        if laid_out:
+            self.compiler.set_map(map_data)
+
+    def set_large_map(self, large: bool):
+        """ Large maps keep items in a spatial index, so drawing and clicking
+        only looks at items in view, and only the areas of moved items are
+        redrawn. Small maps draw faster without. Set before adding items,
+        items already in the scene are not all found by a new index. """
+        self.large = large
+        self.scene().setItemIndexMethod(
+            QGraphicsScene.BspTreeIndex if large else QGraphicsScene.NoIndex)
+        self.setViewportUpdateMode(
+            QGraphicsView.SmartViewportUpdate if large
+            else QGraphicsView.BoundingRectViewportUpdate)
+
+    def get_layout(self) -> dict:
+        """ Returns positions of nodes, [x, y] by node name """
+        return {node.name: [node.x(), node.y()] for node in self.nodes}
 
     def get_map(self) -> MapData:
-        """ Returns a MapData instance from current graph """
-        return create_map_from_graph(self.nodes)
+        """ Returns a MapData instance from current graph, compiled as little
+        as the edits since last call allow. It is kept up to date by later
+        edits, so don't change it. """
+        return self.compiler.compile(self.nodes)
 
 
 class MapCreatorWindow(QStackedWidget):
 
     WINDOW_SIZE = 800
+    ERRORS_SHOWN = 10
 
     def __init__(self):
         super().__init__()
@@ -385,10 +547,27 @@ class MapCreatorWindow(QStackedWidget):
         self.addWidget(self.creator_widget)
         self.create_buttons()
 
+        # Result of checking the map while it is edited, below the buttons
+        self.errors_label = QLabel(self)
+        self.errors_label.move(10, 160)
+        self.creator_widget.validated.connect(self.show_errors)
+
+    def show_errors(self, errors: list[str]):
+        if not errors:
+            self.errors_label.setText("Map is complete")
+            self.errors_label.setStyleSheet("color: darkgreen")
+        else:
+            shown = errors[:self.ERRORS_SHOWN]
+            if len(errors) > len(shown):
+                shown.append("... and {} more".format(len(errors) - len(shown)))
+            self.errors_label.setText("\n".join(shown))
+            self.errors_label.setStyleSheet("color: darkred")
+        self.errors_label.adjustSize()
+
     def create_buttons(self):
         """ Create add and delete node buttons """
         buttons = QWidget(self)
-        buttons.setFixedSize(120, 120)
+        buttons.setFixedSize(120, 150)
         btn_layout = QVBoxLayout()
 
         add_node_btn = QPushButton("Add node")
@@ -404,27 +583,82 @@ class MapCreatorWindow(QStackedWidget):
             self.creator_widget.change_selected_node_name)
         btn_layout.addWidget(name_node_btn)
 
+        open_graph_btn = QPushButton("Open map")
+        open_graph_btn.clicked.connect(self.open_map)
+        btn_layout.addWidget(open_graph_btn)
+
         save_graph_btn = QPushButton("Save map")
         save_graph_btn.clicked.connect(self.save_map)
         btn_layout.addWidget(save_graph_btn)
 
         buttons.setLayout(btn_layout)
 
+    def open_map(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open map", "map",
+                                              "Maps (*.json)")
+        if path != "":
+            self.creator_widget.open_map(path)
+
     def save_map(self):
-        """ Saves the map as json and updates saved map image """
+        """ Saves the map and its layout as json and updates saved map image """
         with open("map/new_map.json", "w") as file:
             file.write(self.creator_widget.get_map().to_json())
+        with open(layout_path("map/new_map.json"), "w") as file:
+            json.dump(self.creator_widget.get_layout(), file)
 
         self.creator_widget.grab().save("res/map.png")
         backend_signals().new_map.emit()
         # self.close()
 
 
+def layout_path(map_path: str) -> str:
+    """ Path of the node positions of the map saved at map_path """
+    return os.path.splitext(map_path)[0] + "_layout.json"
+
+
+def load_layout(map_path: str) -> dict:
+    """ Returns node positions of the map saved at map_path, None if there
+    are none """
+    try:
+        with open(layout_path(map_path), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def layout_nodes(names: list[str], edges: list[tuple]) -> dict:
+    """ Places nodes on a circle in depth first order from the first node,
+    so a track is drawn as a loop. edges are (start, end, weight). Returns
+    [x, y] by node name. """
+    neighbours = {name: [] for name in names}
+    for start, end, _ in edges:
+        neighbours[start].append(end)
+        neighbours[end].append(start)
+
+    order = []
+    visited = set()
+    for root in names:  # Every part of the map, if it is not connected
+        stack = [root]
+        while stack:
+            name = stack.pop()
+            if name not in visited:
+                visited.add(name)
+                order.append(name)
+                stack.extend(reversed(neighbours[name]))
+
+    spacing = Node.RADIUS * 1.5
+    radius = max(spacing, len(order) * spacing / (2 * math.pi))
+    positions = {}
+    for i, name in enumerate(order):
+        angle = 2 * math.pi * i / len(order)
+        positions[name] = [round(radius * math.cos(angle)),
+                           round(radius * math.sin(angle))]
+    return positions
+
+
 def get_sorted_next_nodes(prev: Node, curr: Node):
     """ Returns the next nodes sorted right to left, relative to prev->curr direction """
     next_nodes = [edge.get_other_node(curr) for edge in curr.edge_list]
-    print("Prev", prev.name, "Curr", curr.name,
-          "Nexts", [n.name for n in next_nodes])
     next_nodes.remove(prev)  # Dont return previous node
 
     # Sorts next nodes based on cross product with the vector prev -> curr.
@@ -435,184 +669,268 @@ def get_sorted_next_nodes(prev: Node, curr: Node):
     return next_nodes
 
 
-def edge_weight_str(node_list: list[Node], node_str1: str, node_str2: str):
-    node1: Node
-    node2: Node
-
-    for node in node_list:
-        if node.name == node_str1[0:-1]:
-            node1 = node
-        elif node.name == node_str2[0:-1]:
-            node2 = node
-
-    return edge_weight(node1, node2)
-
-
-def edge_weight(node1: Node, node2: Node):
-    for edge in node1.edge_list:
-        if edge.get_other_node(node1).name == node2.name:
-            return edge.weight
-
-    print("No edge found between", node1.name, "and", node2.name)
-    return None
-
-
-def connect_node_pair(map: MapData, previous: Node, current: Node,
-                      visited: list[str], intersections: list[list[Node]],
-                      reversed=False):
+class MapCompiler:
+    """ Compiles the undirected graph of the map creator to the directed
+    MapData sent to the car, where node X is split into lane nodes X1 and X2.
+
+    Nodes and edge weights are indexed by name once, and the graph is walked
+    with explicit stacks instead of recursion, so compiling takes O(V + E)
+    and works for maps of any size. """
+
+    def __init__(self, nodes: list[Node]):
+        self.nodes = nodes
+        self.by_name: dict[str, Node] = {}
+        self.weights: dict[tuple[Node, str], int] = {}  # By node and neighbour
+        for node in nodes:
+            self.by_name.setdefault(node.name, node)
+            for edge in node.edge_list:
+                self.weights.setdefault(
+                    (node, edge.get_other_node(node).name), edge.weight)
+
+    def node(self, lane: str) -> Node:
+        """ Returns the node of a lane node name """
+        return self.by_name.get(lane[0:-1])
+
+    def weight(self, node1: Node, node2: Node) -> int:
+        weight = self.weights.get((node1, node2.name))
+        if weight is None:
+            print("No edge found between", node1.name, "and", node2.name)
+        return weight
+
+    def compile(self) -> MapData:
+        map = MapData({})
+        prev_node = self.nodes[0]
+        start_node = prev_node.edge_list[0].get_other_node(prev_node)
+        map.connect_node(prev_node.name+"2", start_node.name +
+                         "2", self.weight(prev_node, start_node))
+        map.connect_node(start_node.name+"1", prev_node.name +
+                         "1", self.weight(prev_node, start_node))
+
+        intersections = self.connect_lanes(map, prev_node, start_node)
+
+        for intersection in intersections:
+            self.connect_intersection(map, intersection)
+
+        self.sort_next_nodes(map.map)
+        self.set_directions(map.map, start_node, prev_node.name + "1")
+        map.changed()  # Lanes were reordered in place
+        return map
+
+    def connect_lanes(self, map: MapData, previous: Node,
+                      current: Node) -> list[list[Node]]:
+        """ Connects the lanes of each node to the next nodes, depth first
+        from previous -> current. The direction swaps for each branch taken.
+        Returns the intersections passed, each as its nodes. """
+        visited: set[str] = set()
+        intersections: list[list[Node]] = []
+        in_intersection: set[Node] = set()
+        stack = []  # Next nodes left and direction of each node being visited
+
+        def visit(previous: Node, current: Node, reversed: bool):
+            next_nodes = get_sorted_next_nodes(previous, current)
+            if len(current.edge_list) == 3 and current not in in_intersection:
+                # Node is in intersection, and not already added to list
+                intersections.append(next_nodes + [current])
+                in_intersection.update(intersections[-1])
+
+            current1 = current.name + "1"
+            current2 = current.name + "2"
+            if current1 in visited or current2 in visited:
+                return  # Node probably already connected
+            visited.update((current1, current2))
+            stack.append([current, iter(next_nodes), reversed])
+
+        visit(previous, current, False)
+        while stack:
+            frame = stack[-1]
+            current, next_nodes, reversed = frame
+            for next in next_nodes:
+                next1 = next.name + "1"
+                next2 = next.name + "2"
+                if next1 in visited or next2 in visited:
+                    continue  # Node probably already connected
+
+                current1 = current.name + "1"
+                current2 = current.name + "2"
+                if reversed:
+                    map.connect_node(current1, next1, self.weight(current, next))
+                    map.connect_node(next2, current2, self.weight(next, current))
+                else:
+                    map.connect_node(next1, current1, self.weight(next, current))
+                    map.connect_node(current2, next2, self.weight(current, next))
+
+                # Connect next node pair, then continue here with swapped
+                # direction
+                frame[2] = not reversed
+                visit(current, next, reversed)
+                break
+            else:
+                stack.pop()  # All next nodes connected
+
+        return intersections
+
+    def connect_intersection(self, map: MapData, intersec_nodes: list[Node]):
+        """ Connects every entry lane of an intersection to every exit lane,
+        except the opposite lane of the same node """
+        node_names = [node.name + "1" for node in intersec_nodes] + \
+                     [node.name + "2" for node in intersec_nodes]
+        by_name = {node.name: node for node in intersec_nodes}
+
+        exit_nodes = set()
+        for node in node_names:
+            for neighbours in map.map[node]:
+                for neighbour in neighbours:
+                    # Check if node is an exit node
+                    if neighbour not in node_names:
+                        exit_nodes.add(node)
+
+        entry_nodes = set(node_names) - exit_nodes
+
+        for entry in entry_nodes:
+            for exit in exit_nodes:
+                if exit[0:-1] != entry[0:-1]:
+                    # Connect all entries to exits, except on the same side (eg L1 and L2)
+                    weight = self.weight(by_name[entry[0:-1]],
+                                         by_name[exit[0:-1]])
+                    map.connect_node(entry, exit, weight)
+
+    def sort_next_nodes(self, map: dict):
+        """ Orders the lanes leaving each lane node right first """
+        for current, nexts in map.items():
+            if len(nexts) < 2:
+                continue
+
+            # Find previous node, from the opposite lane
+            current_node = self.node(current)
+            previous = next(
+                iter(map[current_node.name + ("1" if current[-1:] == "2" else "2")][0]))
+            previous_node = self.node(previous)
+
+            next_nodes = get_sorted_next_nodes(previous_node, current_node)
+            right_most = next(iter(nexts[0].keys()))
+            if right_most[0:-1] == next_nodes[0].name:
+                nexts.reverse()
+
+    def set_directions(self, map: dict, previous_node: Node, lane: str):
+        """ Shows the lane directions on each node, depth first along lane 1
+        from previous_node -> lane """
+        visited: set[str] = set()
+        stack = []  # Node and lane 1 next nodes left of each node being visited
+
+        def visit(previous_node: Node, lane: str):
+            current_node = self.node(lane)
+            next_lanes = [next(iter(node))
+                          for node in map[lane] if next(iter(node))[-1:] == "1"]
+            current_node.set_direction(
+                previous_node, [self.node(node) for node in next_lanes], True)
+            visited.add(lane)
+            stack.append((current_node, iter(next_lanes)))
+
+        visit(previous_node, lane)
+        while stack:
+            current_node, next_lanes = stack[-1]
+            for next_lane in next_lanes:
+                if next_lane not in visited:
+                    visit(current_node, next_lane)
+                    break
+            else:
+                stack.pop()
+
+
+class IncrementalCompiler:
+    """ Keeps the MapData of the map creator graph up to date while it is
+    edited. Renamed nodes and changed edge weights are tracked and patched
+    into the last compiled map, without walking the graph again. Adding,
+    deleting or moving nodes and edges compiles the whole graph, since the
+    lane directions after a change depend on the walk through the graph
+    up to it. """
 
-    print("Visiting " + current.name)
-    next_nodes = get_sorted_next_nodes(previous, current)
-
-    if (len(current.edge_list) == 3 and
-            not any(current in intersection for intersection in intersections)):
-        # Node is in intersection, and not already added to list
-        print("Intersection node", current.name)
-        intersections.append(next_nodes + [current])
-
-    current1 = current.name + "1"
-    current2 = current.name + "2"
-
-    if current1 in visited or current2 in visited:
-        # Node probably already connected
-        print("Return from " + current.name)
-        return
-
-    visited.extend([current1, current2])
-
-    for next in next_nodes:
-        next1 = next.name + "1"
-        next2 = next.name + "2"
-
-        if next1 in visited or next2 in visited:
-            # Node probably already connected
-            print("Skipping " + next.name)
-            continue
-
-        if reversed:
-            map.connect_node(current1, next1, edge_weight(current, next))
-            map.connect_node(next2, current2, edge_weight(next, current))
+    def __init__(self):
+        self.map: MapData = None  # Last compiled, None to compile from scratch
+        self.loaded = False  # map was loaded, not compiled from the geometry
+        self.renamed: dict[Node, str] = {}  # Compiled name of renamed nodes
+        self.edges: set[Edge] = set()  # Edges with changed weight
+
+    def graph_changed(self):
+        self.map = None
+        self.loaded = False
+
+    def set_map(self, map: MapData):
+        """ Uses a copy of map as the compiled graph, for a graph loaded from
+        it without the geometry it was compiled from """
+        self.map = MapData({lane: [dict(neighbours) for neighbours in lanes]
+                            for lane, lanes in map.map.items()})
+        self.loaded = True
+        self.renamed = {}
+        self.edges = set()
+
+    def node_renamed(self, node: Node, old_name: str):
+        self.renamed.setdefault(node, old_name)
+
+    def edge_changed(self, edge: Edge):
+        self.edges.add(edge)
+
+    def compile(self, nodes: list[Node]) -> MapData:
+        """ Returns the MapData of the graph of nodes """
+        # Nodes with the same name are told apart by the walk, compile them
+        unique = len({node.name for node in nodes}) == len(nodes)
+        if self.map is not None and unique and self.patch():
+            map = self.map
         else:
-            map.connect_node(next1, current1, edge_weight(next, current))
-            map.connect_node(current2, next2, edge_weight(current, next))
-
-        # Connect next node pair
-        connect_node_pair(map, current, next, visited, intersections, reversed)
-
-        # Loop direction swaps
-        print("Direction swap")
-        reversed = not reversed
-
-    print("Return from", current.name)
+            map = create_map_from_graph(nodes)
+            self.map = map if unique else None  # Else compile again next time
+            self.loaded = False
+        self.renamed = {}
+        self.edges = set()
+        return map
+
+    def patch(self) -> bool:
+        """ Applies renames and weights to the compiled map, returns False if
+        it has to be compiled from scratch instead """
+        for edge in self.edges:
+            if sum(other.get_other_node(edge.start) is edge.end
+                   for other in edge.start.edge_list) > 1:
+                return False  # Several edges between the nodes, first is used
+
+        map = self.map.map
+        names = {old_name: node.name for node, old_name in self.renamed.items()
+                 if node.name != old_name}
+        if not names and not self.edges:
+            return True  # Nothing changed
+        if names:
+            # Lanes keep their order, as if compiled with the new names
+            self.map.map = map = {
+                names[lane[0:-1]] + lane[-1:] if lane[0:-1] in names else lane:
+                lanes for lane, lanes in map.items()}
+
+            # Lanes lead to nodes at most two edges away, across intersections
+            nearby = set(self.renamed)
+            for _ in range(2):
+                nearby.update([edge.get_other_node(node)
+                               for node in nearby for edge in node.edge_list])
+            for node in nearby:
+                for lane in (node.name + "1", node.name + "2"):
+                    lanes = map.get(lane, [])
+                    for index, neighbours in enumerate(lanes):
+                        lanes[index] = {
+                            names[neighbour[0:-1]] + neighbour[-1:]
+                            if neighbour[0:-1] in names else neighbour: weight
+                            for neighbour, weight in neighbours.items()}
+
+        for edge in self.edges:
+            for node, other in ((edge.start, edge.end), (edge.end, edge.start)):
+                for lane in (node.name + "1", node.name + "2"):
+                    for neighbours in map.get(lane, []):
+                        for neighbour in neighbours:
+                            if neighbour[0:-1] == other.name:
+                                neighbours[neighbour] = edge.weight
+        self.map.changed()
+        return True
 
 
 def create_map_from_graph(nodes: list[Node]) -> MapData:
-    map = MapData({})
-    print(map.map)
-    visited = []
-    intersections = []  # Remember nodes in intersections for more processing
-
-    prev_node = nodes[0]
-    start_node = prev_node.edge_list[0].get_other_node(prev_node)
-    map.connect_node(prev_node.name+"2", start_node.name +
-                     "2", edge_weight(prev_node, start_node))
-    map.connect_node(start_node.name+"1", prev_node.name +
-                     "1", edge_weight(prev_node, start_node))
-
-    connect_node_pair(map, prev_node, start_node, visited, intersections)
-
-    print("Intersections: ", len(intersections))
-    for intersection in intersections:
-        print([node.name for node in intersection])
-        connect_intersection(map, intersection)
-
-    sort_next_nodes(nodes, map.map)
-    new_visited = set()
-    set_direction(nodes, map.map, start_node,
-                  prev_node.name + "1", new_visited)
-
-    return map
-
-
-def connect_intersection(map: MapData, intersec_nodes: list[Node]):
-    entry_nodes = set()
-    exit_nodes = set()
-    node_names = [node.name + "1" for node in intersec_nodes] + \
-                 [node.name + "2" for node in intersec_nodes]
-
-    for node in node_names:
-        for neighbours in map.map[node]:
-            for neighbour in neighbours:
-                # Check if node is an exit node
-                if neighbour not in node_names:
-                    # Node is an exit node
-                    exit_nodes.add(node)
-
-        print(node, map.map[node])
-
-    print("Exit nodes", exit_nodes)
-    # Assume exit nodes are labeled correctly, remove duplicates from entry
-    for node in entry_nodes.intersection(exit_nodes):
-        entry_nodes.remove(node)
-
-    entry_nodes = set(node_names) - exit_nodes
-
-    print("Entry nodes", entry_nodes)
-
-    for entry in entry_nodes:
-        for exit in exit_nodes:
-            if exit[0:-1] != entry[0:-1]:
-                # Connect all entries to exits, except on the same side (eg L1 and L2)
-                weight = edge_weight_str(intersec_nodes, entry, exit)
-                map.connect_node(entry, exit, weight)
-
-    print(map.to_json())
-
-
-def sort_next_nodes(nodes: list[Node], map: dict):
-    for current, nexts in map.items():
-        if len(nexts) < 2:
-            continue
-
-        # Find current node
-        current_node = get_node(nodes, current)
-
-        # Find previous node
-        previous = next(
-            iter(map[current_node.name + ("1" if current[-1:] == "2" else "2")][0]))
-        previous = previous[0:-1] + ("1" if previous[-1:] == "2" else "2")
-        print(previous, current)
-        previous_node = get_node(nodes, previous)
-
-        next_nodes = get_sorted_next_nodes(previous_node, current_node)
-        right_most = next(iter(nexts[0].keys()))
-        if right_most[0:-1] == next_nodes[0].name:
-            map[current].reverse()
-            print("Reversed", current)
-
-        print(previous_node.name, current, nexts,
-              next_nodes[0].name, right_most)
-
-
-def get_node(nodes: list[Node], name: str):
-    for node in nodes:
-        if node.name == name[0:-1]:
-            return node
-
-
-def set_direction(nodes: list[Node], map: dict, previous_node: Node, curr: str,
-                  visited: set):
-    print("Visiting: ", curr, "From: ", previous_node.name)
-    current_node = get_node(nodes, curr)
-    next_nodes = [next(iter(node))
-                  for node in map[curr] if next(iter(node))[-1:] == "1"]
-    current_node.set_direction(
-        previous_node, [get_node(nodes, node) for node in next_nodes], True)
-
-    visited.add(curr)
-    for next_node in next_nodes:
-        if next_node not in visited:
-            set_direction(nodes, map, current_node, next_node, visited)
+    """ Returns the directed MapData of the graph of nodes """
+    return MapCompiler(nodes).compile()
 
 
 if __name__ == "__main__":
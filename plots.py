@@ -0,0 +1,218 @@
+from array import array
+
+from PySide6.QtCore import QPointF, QRectF, Qt
+from PySide6.QtGui import QColor, QPainter, QPen
+from PySide6.QtWidgets import QComboBox, QVBoxLayout, QWidget
+
+from backend import backend_signals, drive_data_coalescer
+from config import PLOT_WINDOWS
+from telemetry import TelemetryStore
+
+
+class MinMaxIndex:
+    """ Min and max of every BLOCK samples of some TelemetryStore columns. Kept
+    up to date as samples arrive, so a range of any length is decimated by
+    reading blocks instead of samples. """
+
+    BLOCK = 64
+    """ Samples summarized by each min and max """
+
+    def __init__(self, store: TelemetryStore, names: list[str]):
+        self.store = store
+        self.capacity = store.capacity // self.BLOCK + 2  # Blocks kept
+        self.mins = {name: array("q", bytes(8 * self.capacity)) for name in names}
+        self.maxs = {name: array("q", bytes(8 * self.capacity)) for name in names}
+        self.done = 0  # Sample number where the first incomplete block starts
+        self.total = 0  # store.total at last update, to detect clear
+
+    def update(self):
+        """ Summarizes blocks completed since last update """
+        store = self.store
+        if store.total < self.total:
+            self.done = 0  # Store was cleared
+        self.total = store.total
+
+        span = store.span()
+        block = -(-max(self.done, span.start) // self.BLOCK)  # Round up
+        while (block + 1) * self.BLOCK <= span.stop:
+            start = block * self.BLOCK
+            index = block % self.capacity
+            for name in self.mins:
+                values = store.read(name, start, start + self.BLOCK)
+                self.mins[name][index] = min(values)
+                self.maxs[name][index] = max(values)
+            block += 1
+        self.done = max(self.done, block * self.BLOCK)
+
+    def blocks(self, name: str, first: int, last: int) -> tuple[array, array]:
+        """ Mins and maxs of blocks first to last """
+        begin = first % self.capacity
+        end = begin + last - first
+        mins, maxs = self.mins[name], self.maxs[name]
+        if end <= self.capacity:
+            return mins[begin:end], maxs[begin:end]
+        end -= self.capacity  # Wraps
+        return mins[begin:] + mins[:end], maxs[begin:] + maxs[:end]
+
+    def decimate(self, name: str, start: int, stop: int, width: int):
+        """ Returns lists of min and max values per pixel, for sample numbers
+        start to stop drawn width pixels wide. Ranges shorter than two samples
+        per pixel are returned as the samples themselves, twice. """
+        count = stop - start
+        if count <= 2 * width:
+            values = self.store.read(name, start, stop).tolist()
+            return values, values
+
+        per_pixel = count / width
+        mins = []
+        maxs = []
+        if per_pixel < 2 * self.BLOCK or stop - self.done > per_pixel / 2:
+            # Few samples per pixel, or mostly not summarized yet
+            values = self.store.read(name, start, stop)
+            for pixel in range(width):
+                segment = values[int(pixel * per_pixel):
+                                 int((pixel + 1) * per_pixel)]
+                mins.append(min(segment))
+                maxs.append(max(segment))
+            return mins, maxs
+
+        # Pixel edges are snapped to blocks, an error below half a pixel. The
+        # samples before the first and after the last complete block are read.
+        first_block = -(-start // self.BLOCK)  # Round up
+        block_mins, block_maxs = self.blocks(name, first_block,
+                                             self.done // self.BLOCK)
+        offset = (start - first_block * self.BLOCK) / self.BLOCK
+        per_pixel /= self.BLOCK
+        edges = [max(0, int(pixel * per_pixel + offset))
+                 for pixel in range(width + 1)]
+        edges[-1] = len(block_mins)
+        for first, last in zip(edges, edges[1:]):
+            mins.append(min(block_mins[first:last]))
+            maxs.append(max(block_maxs[first:last]))
+
+        for begin, end, pixel in ((start, first_block * self.BLOCK, 0),
+                                  (self.done, stop, -1)):
+            if begin < end:
+                segment = self.store.read(name, begin, end)
+                mins[pixel] = min(mins[pixel], min(segment))
+                maxs[pixel] = max(maxs[pixel], max(segment))
+        return mins, maxs
+
+
+class PlotWidget(QWidget):
+    """ Scrolling plots of drive data, one lane per signal. The plotted window
+    is decimated to one min and max per pixel, so drawing takes the same time
+    however many samples there are. """
+
+    SIGNALS = [("speed", "Hastighet", "#1f77b4"),
+               ("steering", "Styrutslag", "#d62728"),
+               ("lateral_position", "Lateral", "#2ca02c"),
+               ("angle", "Vinkelavvikelse", "#9467bd")]
+    """ Column, label and color of each plotted signal """
+
+    MARGIN = 4
+    LABEL_HEIGHT = 14
+
+    def __init__(self, store: TelemetryStore = None):
+        super().__init__()
+        self.store = drive_data_coalescer().history if store is None else store
+        self.index = MinMaxIndex(self.store,
+                                 [name for name, _, _ in self.SIGNALS])
+        self.window = None  # Seconds plotted, None for all samples
+
+        self.pens = {name: QPen(QColor(color), 1)
+                     for name, _, color in self.SIGNALS}
+        self.grid_pen = QPen(QColor("#C0C0C0"), 1)
+
+        layout = QVBoxLayout(self)
+        layout.setAlignment(Qt.AlignTop | Qt.AlignRight)
+        self.window_box = QComboBox()
+        for seconds in PLOT_WINDOWS:
+            self.window_box.addItem("{} s".format(seconds), seconds)
+        self.window_box.addItem("Allt", None)
+        self.window_box.currentIndexChanged.connect(self.set_window)
+        layout.addWidget(self.window_box)
+        self.set_window(0)
+
+        # Redraw at the rate drive data is displayed
+        backend_signals().display_drive_data.connect(self.on_drive_data)
+
+    def set_window(self, index: int):
+        self.window = self.window_box.itemData(index)
+        self.update()
+
+    def on_drive_data(self, _):
+        if self.isVisible():
+            self.update()
+
+    def visible_span(self) -> range:
+        """ Sample numbers within the plotted window """
+        span = self.store.span()
+        if self.window is None or not span:
+            return span
+
+        # Samples are ordered by elapsed_time, binary search for window start
+        column = self.store.columns["elapsed_time"]
+        capacity = self.store.capacity
+        first_time = column[(span.stop - 1) % capacity] - self.window * 1000
+        low, high = span.start, span.stop - 1
+        while low < high:
+            middle = (low + high) // 2
+            if column[middle % capacity] < first_time:
+                low = middle + 1
+            else:
+                high = middle
+        return range(low, span.stop)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+
+        self.index.update()
+        span = self.visible_span()
+        lane_height = (self.height() - self.window_box.height() -
+                       2 * self.MARGIN) / len(self.SIGNALS)
+        width = max(1, self.width() - 2 * self.MARGIN)
+
+        for lane, (name, label, _) in enumerate(self.SIGNALS):
+            rect = QRectF(self.MARGIN,
+                          self.window_box.height() + self.MARGIN +
+                          lane * lane_height, width, lane_height)
+            painter.setPen(self.grid_pen)
+            painter.drawRect(rect)
+
+            if len(span) > 0:
+                self.draw_signal(painter, rect, name, label, span)
+            else:
+                painter.setPen(Qt.black)
+                painter.drawText(rect.adjusted(4, 0, 0, 0), label)
+        painter.end()
+
+    def draw_signal(self, painter: QPainter, rect: QRectF, name: str,
+                    label: str, span: range):
+        """ Draws column name in rect, scaled to its range within span """
+        width = int(rect.width())
+        mins, maxs = self.index.decimate(name, span.start, span.stop, width)
+        low = min(mins)
+        high = max(maxs)
+
+        top = rect.top() + self.LABEL_HEIGHT
+        scale = (rect.bottom() - top - 2) / ((high - low) or 1)
+        left = rect.left()
+        step = width / len(mins)
+        bottom = rect.bottom() - 1
+
+        # Vertical line from min to max per pixel, joined into one polyline
+        points = []
+        for pixel, (minimum, maximum) in enumerate(zip(mins, maxs)):
+            x = left + pixel * step
+            points.append(QPointF(x, bottom - (minimum - low) * scale))
+            if maximum != minimum:
+                points.append(QPointF(x, bottom - (maximum - low) * scale))
+        painter.setPen(self.pens[name])
+        painter.drawPolyline(points)
+
+        painter.setPen(Qt.black)
+        painter.drawText(rect.adjusted(4, 0, 0, 0), "{}: {} ({} - {})".format(
+            label, self.store.columns[name][(span.stop - 1) %
+                                            self.store.capacity], low, high))
@@ -0,0 +1,146 @@
+import os
+import struct
+from bisect import bisect_right
+from time import time
+
+from config import (RECORD_BATCH_SIZE, RECORD_FLUSH_INTERVAL,
+                    RECORD_FSYNC_INTERVAL, RECORD_INDEX_INTERVAL)
+from data import DriveData
+
+MAGIC = b"TSRC"
+""" First bytes of a session recording """
+
+VERSION = 1
+
+FILE_HEADER = struct.Struct("<4sH")
+""" Magic and version """
+
+RECORD_HEADER = struct.Struct("<dI")
+""" Receive time (s since epoch) and length of the frame that follows """
+
+INDEX_ENTRY = struct.Struct("<qQ")
+""" Elapsed time (ms) of a DriveData frame and offset of its record """
+
+
+class SessionRecorder:
+    """ Appends every raw frame recieved from the car to a session log.
+
+    Records are buffered and written in batches, at least every
+    RECORD_FLUSH_INTERVAL seconds when flush is called by a timer, and the
+    file is synced to disk every RECORD_FSYNC_INTERVAL seconds. An index file next to the log
+    maps elapsed_time to record offsets, so a session can be seeked. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "wb")
+        self.index_file = open(path + ".idx", "wb")
+
+        self.buffer = bytearray(FILE_HEADER.pack(MAGIC, VERSION))
+        self.index_buffer = bytearray()
+        self.offset = len(self.buffer)  # File offset of next record
+        self.last_record = 0  # File offset of last record
+        self.last_indexed = None  # Elapsed time of last index entry
+
+        self.last_flush = time()
+        self.last_sync = self.last_flush
+        self.synced = True  # Nothing written since last sync
+        self.frames = 0
+
+    def record(self, frame: bytes):
+        """ Appends a raw frame to the log """
+        now = time()
+        buffer = self.buffer
+        buffer += RECORD_HEADER.pack(now, len(frame))
+        buffer += frame
+
+        self.last_record = self.offset
+        self.offset += RECORD_HEADER.size + len(frame)
+        self.frames += 1
+
+        if (len(buffer) >= RECORD_BATCH_SIZE or
+                now - self.last_flush >= RECORD_FLUSH_INTERVAL):
+            self.flush()
+
+    def index(self, data: DriveData):
+        """ Indexes the last recorded frame, which contained data. Must be
+        called directly after record. """
+        if (self.last_indexed is None or
+                data.elapsed_time - self.last_indexed >= RECORD_INDEX_INTERVAL):
+            self.index_buffer += INDEX_ENTRY.pack(data.elapsed_time,
+                                                  self.last_record)
+            self.last_indexed = data.elapsed_time
+
+    def flush(self):
+        """ Writes buffered records to file, and syncs if it is time to. Cheap
+        when nothing was recorded, so it can be called by a timer. """
+        now = time()
+        if self.buffer or self.index_buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer.clear()
+
+            # Index is written after log, it never points past the data on disk
+            self.index_file.write(self.index_buffer)
+            self.index_file.flush()
+            self.index_buffer.clear()
+            self.synced = False
+        self.last_flush = now
+
+        if not self.synced and now - self.last_sync >= RECORD_FSYNC_INTERVAL:
+            os.fsync(self.file.fileno())
+            os.fsync(self.index_file.fileno())
+            self.last_sync = now
+            self.synced = True
+
+    def close(self):
+        """ Flushes, syncs and closes the log """
+        self.last_sync = 0.0  # Force sync
+        self.flush()
+        self.file.close()
+        self.index_file.close()
+
+
+class SessionReader:
+    """ Reads a log written by SessionRecorder, a truncated last record is ignored """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self.data = file.read()
+
+        magic, version = FILE_HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a session recording: " + path)
+
+        self.times: list[int] = []
+        self.offsets: list[int] = []
+        try:
+            with open(path + ".idx", "rb") as file:
+                index = file.read()
+        except FileNotFoundError:
+            index = b""
+
+        end = len(index) - len(index) % INDEX_ENTRY.size
+        for elapsed_time, offset in INDEX_ENTRY.iter_unpack(index[:end]):
+            if offset < len(self.data):
+                self.times.append(elapsed_time)
+                self.offsets.append(offset)
+
+    def seek(self, elapsed_time: int) -> int:
+        """ Returns offset of the last indexed record at or before elapsed_time """
+        position = bisect_right(self.times, elapsed_time) - 1
+        if position < 0:
+            return FILE_HEADER.size
+        return self.offsets[position]
+
+    def records(self, offset: int = FILE_HEADER.size):
+        """ Iterates over (receive time, frame) from offset """
+        data = self.data
+        while offset + RECORD_HEADER.size <= len(data):
+            timestamp, length = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > len(data):
+                break  # Record was not completely written
+
+            yield timestamp, data[offset:offset + length]
+            offset += length
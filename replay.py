@@ -0,0 +1,160 @@
+import csv
+from time import perf_counter
+
+from PySide6.QtCore import QObject, QTimer, Signal
+from PySide6.QtWidgets import QApplication
+
+from backend import (backend_signals, drive_data_coalescer, message_dispatcher,
+                     socket)
+from data import DriveData
+from recorder import SessionReader
+from telemetry import TelemetryStore, load_binary
+
+
+class ReplaySource(QObject):
+    """ A singleton class, which replays recorded drive data through the backend
+    signals in place of Socket. Reads session logs (.rec) and files saved by
+    DataWidget (.csv and .bin).
+
+    Replayed and live data must not mix, so replay is refused while connected
+    and stopped on connecting, and the drive data history is cleared before
+    a replay and again when connecting after one. """
+
+    # Maintain only one instance
+    _instance = None
+
+    BATCH_SIZE = 1000
+    """ Messages emitted per event loop iteration when replaying as fast as possible """
+
+    finished = Signal(int, float)
+    """ Number of messages replayed and time it took (s) """
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        # Time (s) and either a raw frame or DriveData, in replay order
+        self.events: list[tuple[float, object]] = []
+        self.position = 0
+        self.speed = 1.0
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.step)
+
+        self.start_time = 0.0
+        self.replayed = False  # History holds replayed data
+
+        backend_signals().connection_changed.connect(self.on_connection_changed)
+
+    def load(self, path: str) -> int:
+        """ Loads a recording from path, returns number of messages """
+        self.stop()
+        if path.endswith(".rec"):
+            self.events = self.read_session(path)
+        elif path.endswith(".csv"):
+            self.events = self.read_csv(path)
+        elif path.endswith(".bin"):
+            self.events = self.read_binary(path)
+        else:
+            raise ValueError("Unknown recording format: " + path)
+
+        self.position = 0
+        return len(self.events)
+
+    def read_session(self, path: str) -> list[tuple[float, object]]:
+        """ Raw frames with their receive times, from a session log """
+        return list(SessionReader(path).records())
+
+    def read_csv(self, path: str) -> list[tuple[float, object]]:
+        """ Drive data timed by elapsed_time, from csv with a header row """
+        with open(path, "r", newline="") as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            columns = [header.index(name) for name in TelemetryStore.FIELDS]
+            recieved = header.index("recieved") if "recieved" in header else None
+            events = []
+            for row in reader:
+                data = DriveData(*[int(row[column]) for column in columns])
+                if recieved is not None and int(row[recieved]):
+                    data.recieved = int(row[recieved]) / 1e6
+                events.append((data.elapsed_time / 1000, data))
+        return events
+
+    def read_binary(self, path: str) -> list[tuple[float, object]]:
+        """ Drive data timed by elapsed_time, from a columnar binary file """
+        columns = load_binary(path)
+        names = [name for name in TelemetryStore.FIELDS if name in columns]
+        events = [(values[0] / 1000, DriveData(*values))
+                  for values in zip(*[columns[name] for name in names])]
+        if "recieved" in columns:
+            for (_, data), recieved in zip(events, columns["recieved"]):
+                if recieved:
+                    data.recieved = recieved / 1e6
+        return events
+
+    def start(self, speed: float = 1.0) -> bool:
+        """ Starts replay from the beginning, at speed times the original rate.
+        Speed 0 replays as fast as possible. Returns False if refused. """
+        if not self.events:
+            return False
+        if socket().is_connected:
+            backend_signals().log_msg.emit(
+                "ERROR", "Disconnect from the car before replaying")
+            return False
+
+        drive_data_coalescer().history.clear()
+        self.replayed = True
+        self.speed = speed
+        self.position = 0
+        self.start_time = perf_counter()
+        self.timer.start(0)
+        return True
+
+    def stop(self):
+        self.timer.stop()
+
+    def on_connection_changed(self, connected: bool):
+        if not connected or not self.replayed:
+            return
+        self.stop()
+        drive_data_coalescer().history.clear()
+        self.replayed = False
+
+    def is_running(self) -> bool:
+        return self.timer.isActive()
+
+    def step(self):
+        """ Emits all messages that are due, then waits for the next """
+        events = self.events
+        position = self.position
+
+        if self.speed == 0:
+            end = min(position + self.BATCH_SIZE, len(events))
+        else:
+            now = events[0][0] + (perf_counter() - self.start_time) * self.speed
+            end = position
+            while end < len(events) and events[end][0] <= now:
+                end += 1
+
+        dispatcher = message_dispatcher()
+        for recieved, event in events[position:end]:
+            if isinstance(event, DriveData):
+                backend_signals().new_drive_data.emit(event)
+            else:
+                dispatcher.recieved = recieved  # Time recorded in session log
+                dispatcher.dispatch(event)
+        self.position = end
+
+        if end == len(events):
+            self.finished.emit(len(events), perf_counter() - self.start_time)
+        elif self.speed == 0:
+            self.timer.start(0)
+        else:
+            delay = (events[end][0] - now) / self.speed
+            self.timer.start(max(0, int(delay * 1000)))
+
+
+def replay_source():
+    """ Returns instance of the current ReplaySource """
+    if ReplaySource._instance is None:
+        ReplaySource._instance = ReplaySource(QApplication.instance())
+    return ReplaySource._instance
@@ -0,0 +1,240 @@
+import os
+from array import array
+from heapq import heappop, heappush
+
+from PySide6.QtCore import QObject
+from PySide6.QtWidgets import QApplication
+
+from backend import backend_signals
+from config import ROUTE_CACHE_NODES, ROUTE_EXACT_STOPS
+from data import MapData, MapGraph
+
+UNREACHABLE = 1 << 62
+""" Distance to nodes that can't be reached """
+
+
+def current_map_path() -> str:
+    """ Path of the map sent to the car, the one saved by the map creator if
+    there is one """
+    if os.path.exists("map/new_map.json"):
+        return "map/new_map.json"
+    return "map/default_map.json"
+
+
+def shortest_paths(graph: MapGraph, source: int) -> tuple[array, array]:
+    """ Dijkstra from node id source. Returns the distance to every node,
+    UNREACHABLE if it can't be reached, and the previous node on the way
+    there, -1 for source and unreachable nodes. """
+    distances = array("q", [UNREACHABLE]) * len(graph)
+    previous = array("l", [-1]) * len(graph)
+    distances[source] = 0
+
+    offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+    queue = [(0, source)]
+    while queue:
+        distance, node = heappop(queue)
+        if distance > distances[node]:
+            continue  # Already reached shorter
+        for edge in range(offsets[node], offsets[node + 1]):
+            target = targets[edge]
+            new_distance = distance + weights[edge]
+            if new_distance < distances[target]:
+                distances[target] = new_distance
+                previous[target] = node
+                heappush(queue, (new_distance, target))
+    return distances, previous
+
+
+def order_length(matrix: list[list[int]], order: list[int]) -> int:
+    """ Length of visiting points in order, by distances in matrix """
+    return sum(matrix[a][b] for a, b in zip(order, order[1:]))
+
+
+def shortest_order(matrix: list[list[int]], fixed_end=False) -> list[int]:
+    """ Order that visits every point in matrix from point 0 with the least
+    total distance (Held-Karp), ending at the last point if fixed_end.
+    Exponential, for a few points only. """
+    count = len(matrix)
+    full = (1 << count) - 2  # Every point but 0 visited
+    # Shortest distance ending at last, and point before, by visited points
+    lengths = [[UNREACHABLE] * count for _ in range(full + 1)]
+    befores = [[0] * count for _ in range(full + 1)]
+    for point in range(1, count):
+        lengths[1 << point][point] = matrix[0][point]
+
+    for visited in range(2, full + 1, 2):
+        row = lengths[visited]
+        points = [point for point in range(1, count) if visited >> point & 1]
+        if len(points) < 2:
+            continue
+        for last in points:
+            rest = lengths[visited & ~(1 << last)]
+            row[last], befores[visited][last] = min(
+                (rest[before] + matrix[before][last], before)
+                for before in points if before != last)
+
+    if fixed_end:
+        last = count - 1
+    else:
+        last = min(range(1, count), key=lengths[full].__getitem__)
+    visited = full
+    order = []
+    while last:
+        order.append(last)
+        visited, last = visited & ~(1 << last), befores[visited][last]
+    return [0] + order[::-1]
+
+
+def short_order(matrix: list[list[int]], fixed_end=False) -> list[int]:
+    """ A short order visiting every point in matrix from point 0, ending at
+    the last point if fixed_end, by going to the nearest unvisited point and
+    then reversing parts of the order while it gets shorter (2-opt) """
+    end = len(matrix) - 1 if fixed_end else len(matrix)
+    order = [0]
+    left = set(range(1, end))
+    while left:
+        nearest = min(left, key=lambda point: matrix[order[-1]][point])
+        order.append(nearest)
+        left.remove(nearest)
+    order.extend(range(end, len(matrix)))
+
+    # Distances are directed, so each candidate is measured in full
+    length = order_length(matrix, order)
+    improved = True
+    while improved:
+        improved = False
+        for first in range(1, end - 1):
+            for last in range(first + 1, end):
+                candidate = (order[:first] + order[first:last + 1][::-1] +
+                             order[last + 1:])
+                candidate_length = order_length(matrix, candidate)
+                if candidate_length < length:
+                    order, length = candidate, candidate_length
+                    improved = True
+    return order
+
+
+class Router(QObject):
+    """ A singleton class, which finds shortest paths on the map sent to the
+    car. Shortest paths from every lane node are computed with Dijkstra when
+    the map changes, so checking and planning missions are table lookups.
+    Maps with more than ROUTE_CACHE_NODES lane nodes have paths computed from
+    a node when first needed, keeping the latest ROUTE_CACHE_NODES. """
+
+    # Maintain only one instance
+    _instance = None
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.map: MapData = None
+        self.graph: MapGraph = None
+        self.rows: dict[int, tuple[array, array]] = {}  # By source id
+
+        self.load_map()
+        backend_signals().new_map.connect(self.load_map)
+
+    def load_map(self):
+        """ Loads the map sent to the car """
+        try:
+            self.set_map(MapData({}).load_from_file(current_map_path()))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print("Could not load map for routing:", e)
+            self.set_map(None)
+
+    def set_map(self, map: MapData):
+        """ Routes on map, None for no map """
+        self.map = map
+        self.graph = None if map is None else map.graph
+        self.rows = {}
+        if self.graph is not None and len(self.graph) <= ROUTE_CACHE_NODES:
+            for source in range(len(self.graph)):
+                self.rows[source] = shortest_paths(self.graph, source)
+
+    def row(self, source: int) -> tuple[array, array]:
+        """ Distances and previous nodes from node id source """
+        row = self.rows.get(source)
+        if row is None:
+            if len(self.rows) >= ROUTE_CACHE_NODES:
+                del self.rows[next(iter(self.rows))]  # Oldest
+            row = self.rows[source] = shortest_paths(self.graph, source)
+        return row
+
+    def has_node(self, name: str) -> bool:
+        return self.graph is not None and name in self.graph.ids
+
+    def distance(self, start: str, goal: str) -> int:
+        """ Length of the shortest path from start to goal, None if goal can't
+        be reached or either is not in the map """
+        if not (self.has_node(start) and self.has_node(goal)):
+            return None
+        distance = self.row(self.graph.ids[start])[0][self.graph.ids[goal]]
+        return None if distance == UNREACHABLE else distance
+
+    def path(self, start: str, goal: str) -> list[str]:
+        """ Nodes on the shortest path from start to goal, None if goal can't
+        be reached """
+        if self.distance(start, goal) is None:
+            return None
+        previous = self.row(self.graph.ids[start])[1]
+        path = [self.graph.ids[goal]]
+        while path[-1] != self.graph.ids[start]:
+            path.append(previous[path[-1]])
+        return [self.graph.names[node] for node in reversed(path)]
+
+    def legs(self, destinations: list[str]) -> list[int]:
+        """ Length of each leg between destinations, None if not drivable """
+        return [self.distance(start, goal)
+                for start, goal in zip(destinations, destinations[1:])]
+
+    def length(self, destinations: list[str]) -> int:
+        """ Total length of driving to destinations, None if not drivable """
+        legs = self.legs(destinations)
+        return None if None in legs else sum(legs)
+
+    def errors(self, destinations: list[str]) -> list[str]:
+        """ Returns why a mission to destinations can't be driven, empty if it
+        can. A mission can't be checked without a map. """
+        if self.graph is None:
+            return []
+        errors = ["Destination {} is not in the map".format(destination)
+                  for destination in dict.fromkeys(destinations)
+                  if not self.has_node(destination)]
+        if errors:
+            return errors
+        return ["Can't drive from {} to {}".format(start, goal)
+                for (start, goal), length in
+                zip(zip(destinations, destinations[1:]),
+                    self.legs(destinations)) if length is None]
+
+    def plan(self, destinations: list[str]) -> list[str]:
+        """ Returns destinations reordered to the shortest total length, the
+        first destination is where the car starts and is kept first. A
+        mission ending where it starts is kept ending there, and destinations
+        listed more than once are visited as many times, but never twice in a
+        row. Returns None if there is no order where every leg can be
+        driven. """
+        if not all(self.has_node(destination) for destination in destinations):
+            return None
+        points = list(destinations)
+        round_trip = len(points) > 2 and points[-1] == points[0]
+        if len(points) - round_trip < 3:
+            return points
+
+        ids = [self.graph.ids[point] for point in points]
+        # Driving to the same destination again is not a leg, never order so
+        matrix = [[UNREACHABLE if start == goal else self.row(start)[0][goal]
+                   for goal in ids] for start in ids]
+        if len(points) - 1 <= ROUTE_EXACT_STOPS:
+            order = shortest_order(matrix, round_trip)
+        else:
+            order = short_order(matrix, round_trip)
+        if order_length(matrix, order) >= UNREACHABLE:
+            return None
+        return [points[point] for point in order]
+
+
+def router():
+    """ Returns instance of the current Router """
+    if Router._instance is None:
+        Router._instance = Router(QApplication.instance())
+    return Router._instance
@@ -0,0 +1,220 @@
+import struct
+from array import array
+from itertools import chain
+from operator import attrgetter
+
+from PySide6.QtCore import QThread, Signal
+
+from config import EXPORT_CHUNK_SIZE, TELEMETRY_CAPACITY
+from data import DriveData
+
+
+class TelemetryStore:
+    """ Drive data history stored as one preallocated column per field. When the
+    store is full the oldest samples are overwritten. """
+
+    FIELDS = ("elapsed_time", "throttle", "steering", "speed",
+              "driving_distance", "obstacle_distance", "lateral_position",
+              "angle")
+    """ DriveData fields stored, in column order """
+
+    COLUMNS = FIELDS + ("recieved",)
+    """ All columns, recieved is DriveData.recieved in us since epoch, 0 if not set """
+
+    TYPECODE = "q"
+    """ Array typecode of the columns, signed 64 bit integers """
+
+    get_fields = attrgetter(*FIELDS)
+
+    def __init__(self, capacity: int = TELEMETRY_CAPACITY):
+        self.capacity = capacity
+        self.columns: dict[str, array] = {}
+        for name in self.COLUMNS:
+            self.add_column(name)
+        self.field_columns = [self.columns[name] for name in self.FIELDS]
+        self.recieved_column = self.columns["recieved"]
+
+        self.head = 0  # Index of next sample to write
+        self.size = 0  # Number of samples stored
+        self.total = 0  # Number of samples appended since clear
+
+    def add_column(self, name: str, typecode: str = TYPECODE):
+        """ Adds a preallocated column, for values stored next to the drive data """
+        self.columns[name] = array(typecode, bytes(
+            array(typecode).itemsize * self.capacity))
+
+    def append(self, data: DriveData):
+        """ Stores a sample, overwriting the oldest if full """
+        index = self.head
+        for column, value in zip(self.field_columns, self.get_fields(data)):
+            column[index] = int(value)
+        recieved = data.recieved
+        self.recieved_column[index] = 0 if recieved is None \
+            else int(recieved * 1e6)
+
+        self.head = index + 1 if index + 1 < self.capacity else 0
+        if self.size < self.capacity:
+            self.size += 1
+        self.total += 1
+
+    def clear(self):
+        """ Forgets all samples, the columns are kept allocated """
+        self.head = 0
+        self.size = 0
+        self.total = 0
+
+    @property
+    def evicted(self) -> int:
+        """ Number of samples overwritten since clear """
+        return self.total - self.size
+
+    def __len__(self):
+        return self.size
+
+    def views(self, name: str) -> list[memoryview]:
+        """ Returns zero-copy views of column name, oldest samples first. The
+        views are only valid until the next append. """
+        column = memoryview(self.columns[name])
+        if self.size < self.capacity:
+            return [column[:self.size]]
+        return [column[self.head:], column[:self.head]]
+
+    def values(self, name: str):
+        """ Iterates over the values in column name, oldest first """
+        return chain.from_iterable(self.views(name))
+
+    def span(self) -> range:
+        """ Returns the sample numbers currently stored, counted since clear """
+        return range(self.total - self.size, self.total)
+
+    def read(self, name: str, start: int, stop: int) -> array:
+        """ Returns a copy of column name for sample numbers start to stop.
+        Raises IndexError if any of the samples has been overwritten. """
+        if start < self.total - self.size or stop > self.total:
+            raise IndexError("Samples no longer in TelemetryStore")
+
+        column = self.columns[name]
+        begin = start % self.capacity
+        end = begin + stop - start
+        if end <= self.capacity:
+            return column[begin:end]
+        return column[begin:] + column[:end - self.capacity]
+
+    def __getitem__(self, index: int) -> DriveData:
+        """ Returns sample at index as DriveData, index 0 is the oldest """
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("TelemetryStore index out of range")
+
+        index = (self.head - self.size + index) % self.capacity
+        return self.to_drive_data(
+            [self.columns[name][index] for name in self.COLUMNS])
+
+    def __iter__(self):
+        for values in zip(*[self.values(name) for name in self.COLUMNS]):
+            yield self.to_drive_data(values)
+
+    def to_drive_data(self, values) -> DriveData:
+        """ Creates DriveData from the values of a row, in COLUMNS order """
+        data = DriveData(*values[:-1])
+        if values[-1]:
+            data.recieved = values[-1] / 1e6
+        return data
+
+
+def export_csv(store: TelemetryStore, path: str, names=TelemetryStore.COLUMNS,
+               chunk_size: int = EXPORT_CHUNK_SIZE):
+    """ Writes the columns names as csv, one row per sample, in chunks of chunk_size """
+    span = store.span()
+    with open(path, "w") as file:
+        file.write(",".join(names) + "\n")
+
+        for start in range(span.start, span.stop, chunk_size):
+            stop = min(start + chunk_size, span.stop)
+            columns = [store.read(name, start, stop) for name in names]
+            file.write("".join(",".join(map(str, row)) + "\n"
+                               for row in zip(*columns)))
+
+    return len(span)
+
+
+BINARY_MAGIC = b"TSDD"
+""" First bytes of a binary drive data file """
+
+BINARY_VERSION = 1
+
+BINARY_HEADER = struct.Struct("<4sHHQ")
+""" Magic, version, number of columns and number of samples """
+
+
+def export_binary(store: TelemetryStore, path: str, names=TelemetryStore.COLUMNS,
+                  chunk_size: int = EXPORT_CHUNK_SIZE):
+    """ Writes the columns names in a compact columnar binary format. The header
+    is followed by a name and typecode per column, then each column's values
+    in native byte order. """
+    span = store.span()
+    with open(path, "wb") as file:
+        file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION,
+                                      len(names), len(span)))
+        for name in names:
+            encoded = name.encode("utf-8")
+            file.write(bytes([len(encoded)]) + encoded +
+                       store.columns[name].typecode.encode("ascii"))
+
+        for name in names:
+            for start in range(span.start, span.stop, chunk_size):
+                stop = min(start + chunk_size, span.stop)
+                file.write(store.read(name, start, stop))
+
+    return len(span)
+
+
+def load_binary(path: str) -> dict[str, array]:
+    """ Reads a file written by export_binary, returns the columns by name """
+    with open(path, "rb") as file:
+        magic, version, count, samples = BINARY_HEADER.unpack(
+            file.read(BINARY_HEADER.size))
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError("Not a drive data file: " + path)
+
+        layout = []
+        for _ in range(count):
+            length = file.read(1)[0]
+            name = file.read(length).decode("utf-8")
+            layout.append((name, file.read(1).decode("ascii")))
+
+        columns = {}
+        for name, typecode in layout:
+            column = array(typecode)
+            column.fromfile(file, samples)
+            columns[name] = column
+
+    return columns
+
+
+class TelemetryExporter(QThread):
+    """ Exports the samples in a TelemetryStore to file in a background thread """
+
+    FORMATS = {"csv": export_csv, "binary": export_binary}
+
+    exported = Signal(str, int)
+    """ Path and number of samples, when export is done """
+
+    failed = Signal(str, str)
+    """ Path and error message, if export failed """
+
+    def __init__(self, store: TelemetryStore, path: str, format: str = "csv",
+                 parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.path = path
+        self.export = self.FORMATS[format]
+
+    def run(self):
+        try:
+            samples = self.export(self.store, self.path)
+        except (OSError, IndexError) as e:
+            self.failed.emit(self.path, str(e))
+            return
+        self.exported.emit(self.path, samples)
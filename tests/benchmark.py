@@ -0,0 +1,987 @@
+# Körs med kommandot:
+#   python -m tests.benchmark [namn ...] [--output results.json]
+#
+# Prints each result and optionally writes all of them as JSON, so message
+# rates and per message times can be compared between versions.
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import random
+import socket as pysocket
+import statistics
+import subprocess
+import tempfile
+import threading
+import tracemalloc
+import types
+from contextlib import redirect_stdout
+from time import localtime, perf_counter, strftime
+
+from PySide6.QtCore import QByteArray, QPointF, QTimer
+from PySide6.QtGui import QImage, QPainter
+from PySide6.QtWidgets import QApplication, QPlainTextEdit
+
+from backend import (FrameDecoder, MessageDispatcher, SendPriority, Socket,
+                     backend_signals, dispatch_message)
+from config import CONTROL_RATE
+from data import (Direction, DriveData, DriveMission, ManualDriveInstruction,
+                  MapData, ParameterConfiguration, SemiDriveInstruction,
+                  get_type_and_data)
+from recorder import SessionRecorder
+from telemetry import TelemetryStore, export_binary, export_csv
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")  # Run without display
+
+FRAMES = 20000
+""" Number of frames used by the stream benchmarks """
+
+REPEAT = 20000
+""" Number of calls in each micro benchmark """
+
+RESULTS: list[dict] = []
+""" All reported results, in order """
+
+BASELINE = "234616a"
+""" Revision before the backlog of optimizations, compared against """
+
+
+def drive_data_stream(frames: int = FRAMES) -> bytes:
+    """ Returns a byte stream of newline terminated DriveData messages """
+    message = DriveData(123456, 100, -280, 1500, 250,
+                        40, -3, 12).to_json() + "\n"
+    return message.encode("utf-8") * frames
+
+
+def chunked(stream: bytes, size: int) -> list[bytes]:
+    """ Splits stream in chunks of size, as read from a socket """
+    return [stream[i:i+size] for i in range(0, len(stream), size)]
+
+
+def legacy_parse(chunks: list[bytes]) -> int:
+    """ The framing previously done in Socket.on_recieved """
+    overflow = ""
+    count = 0
+    for chunk in chunks:
+        recieved = str(chunk)[2:-1]
+        messages = recieved.split(r"\n")
+        messages[0] = overflow + messages[0]
+        count += len(messages) - 1
+        overflow = messages[-1]
+    return count
+
+
+def decoder_parse(chunks: list[bytes]) -> int:
+    """ Framing with FrameDecoder """
+    decoder = FrameDecoder()
+    count = 0
+    for chunk in chunks:
+        count += len(decoder.feed(chunk))
+    return count
+
+
+def report(name: str, value: float, unit: str):
+    """ Prints and stores a result """
+    RESULTS.append({"name": name, "value": value, "unit": unit})
+    print("{:<44} {:>14.2f} {}".format(name, value, unit))
+
+
+def report_rate(name: str, count: int, seconds: float, unit: str = "frames"):
+    """ Reports count per second and time per item """
+    report(name, count / seconds, unit + "/s")
+    report(name + "/time", seconds / count * 1e6, "us/" + unit[:-1])
+
+
+def time_calls(function, repeat: int = REPEAT) -> float:
+    """ Returns the best time (s) of three runs calling function repeat times """
+    best = float("inf")
+    for _ in range(3):
+        start = perf_counter()
+        for _ in range(repeat):
+            function()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def baseline_module(path: str):
+    """ Returns the module at path as it was in BASELINE, or None if it can't
+    be read from git. It imports the current versions of other modules. """
+    try:
+        source = subprocess.run(["git", "show", BASELINE + ":" + path],
+                                capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    module = types.ModuleType("baseline_" + path[:-3])
+    exec(compile(source, BASELINE + ":" + path, "exec"), module.__dict__)
+    return module
+
+
+def app() -> QApplication:
+    return QApplication.instance() or QApplication([])
+
+
+def bench_framing():
+    """ Frames per second, old string framing against FrameDecoder """
+    stream = drive_data_stream()
+    for size in (64, 1460, 65536):
+        chunks = chunked(stream, size)
+        for name, parse in (("legacy", legacy_parse),
+                            ("FrameDecoder", decoder_parse)):
+            start = perf_counter()
+            count = parse(chunks)
+            report_rate("framing/{}/{}B".format(name, size), count,
+                        perf_counter() - start)
+
+
+def bench_telemetry_memory():
+    """ Memory used by one hour of drive data at 100 Hz """
+    samples = 100 * 60 * 60
+
+    def measure(name, create, add):
+        tracemalloc.start()
+        history = create()
+        for i in range(samples):
+            add(history, DriveData(i * 10, 100, i % 560 - 280, 1500,
+                                   i // 100, 40, i % 7 - 3, i % 30))
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report("telemetry/" + name, size / 2**20, "MB")
+
+    measure("list[DriveData]", list, list.append)
+    measure("TelemetryStore", lambda: TelemetryStore(samples),
+            TelemetryStore.append)
+
+
+def filled_store(samples: int) -> TelemetryStore:
+    """ Returns a store filled with samples of drive data """
+    store = TelemetryStore(samples)
+    for i in range(samples):
+        store.append(DriveData(i * 10, 100, i % 560 - 280, 1500,
+                               i // 100, 40, i % 7 - 3, i % 30))
+    return store
+
+
+def legacy_export(store: TelemetryStore, directory: str):
+    """ The export previously done by DataWidget.save_data, one file per signal """
+    all_data = list(store)
+    for name in TelemetryStore.FIELDS[1:]:
+        data_list = [str(getattr(data, name)) for data in all_data]
+        with open(os.path.join(directory, name + ".csv"), "w") as file:
+            file.write(",".join(data_list) + "\n")
+            file.write(",".join([str(data.elapsed_time)
+                       for data in all_data]))
+
+
+def bench_export():
+    """ Time and peak memory when saving one hour of drive data at 100 Hz """
+    store = filled_store(100 * 60 * 60)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, export in (
+                ("legacy", lambda: legacy_export(store, directory)),
+                ("csv", lambda: export_csv(
+                    store, os.path.join(directory, "data.csv"))),
+                ("binary", lambda: export_binary(
+                    store, os.path.join(directory, "data.bin")))):
+            tracemalloc.start()
+            start = perf_counter()
+            export()
+            seconds = perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report("export/" + name, seconds, "s")
+            report("export/" + name + "/peak", peak / 2**20, "MB")
+
+
+def bench_recorder():
+    """ Per frame cost of recording, on top of framing and decoding """
+    chunks = chunked(drive_data_stream(), 1460)
+
+    def receive(recorder: SessionRecorder = None):
+        decoder = FrameDecoder()
+        count = 0
+        for chunk in chunks:
+            for frame in decoder.feed(chunk):
+                if recorder is not None:
+                    recorder.record(frame)
+                type, data = get_type_and_data(frame)
+                if recorder is not None:
+                    recorder.index(data)
+                count += 1
+        return count
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ("off", "on"):
+            recorder = None
+            if name == "on":
+                recorder = SessionRecorder(os.path.join(directory, "s.rec"))
+            start = perf_counter()
+            count = receive(recorder)
+            if recorder is not None:
+                recorder.close()
+            seconds = perf_counter() - start
+            report_rate("recorder/" + name, count, seconds)
+
+
+def bench_replay():
+    """ Throughput of the signal to widget pipeline, replaying a session as
+    fast as possible """
+    from graphics_widgets import DataWidget, LogWidget, PlanWidget
+    from replay import replay_source
+
+    application = app()
+    widgets = [DataWidget(), PlanWidget(), LogWidget()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.rec")
+        recorder = SessionRecorder(path)
+        for i in range(FRAMES):
+            recorder.record(DriveData(i * 10, 100, i % 560 - 280, 1500, i // 100,
+                                      40, i % 7 - 3, i % 30).to_json().encode())
+        recorder.close()
+
+        replay = replay_source()
+        replay.load(path)
+
+    results = []
+    replay.finished.connect(
+        lambda *result: (results.extend(result), application.quit()))
+    replay.start(0)
+    application.exec()
+
+    messages, seconds = results
+    report_rate("replay/signals->widgets", messages, seconds, "messages")
+    del widgets
+
+
+def message_instances() -> dict:
+    """ One instance of every message class sent to the car """
+    return {
+        "DriveData": DriveData(123456, 100, -280, 1500, 250, 40, -3, 12),
+        "ManualDriveInstruction": ManualDriveInstruction(100, -280),
+        "SemiDriveInstruction": SemiDriveInstruction(Direction.LEFT),
+        "DriveMission": DriveMission(["A1", "F2", "K1", "B2"]),
+        "ParameterConfiguration": ParameterConfiguration(100, 130, 2, 1,
+                                                         150, 1630),
+        "MapData": MapData({}).load_from_file("map/default_map.json"),
+    }
+
+
+def fields_of(message) -> dict:
+    """ The fields of a message as a dict, as __dict__ gave before __slots__ """
+    return {name: getattr(message, name) for name in message.__slots__}
+
+
+def legacy_to_json(message, type_name: str) -> str:
+    """ The serialization previously done by JSONSerializable.to_json """
+    payload = json.dumps(message, default=fields_of,
+                         sort_keys=True, indent=1)
+    return message.wrap_json(type_name, payload)
+
+
+def bench_encode():
+    """ Time to serialize every message class, against the previous
+    indent and replace serialization """
+    for name, message in message_instances().items():
+        seconds = time_calls(message.to_json)
+        report_rate("encode/to_json/" + name, REPEAT, seconds, "messages")
+
+        if name not in ("DriveMission", "MapData"):
+            seconds = time_calls(lambda: legacy_to_json(message, name))
+            report_rate("encode/legacy/" + name, REPEAT, seconds, "messages")
+
+    body = json.dumps(fields_of(ManualDriveInstruction(100, -280)),
+                      sort_keys=True, indent=1)
+    message = ManualDriveInstruction()
+    seconds = time_calls(
+        lambda: message.wrap_json("ManualDriveInstruction", body))
+    report_rate("encode/wrap_json", REPEAT, seconds, "messages")
+
+
+def bench_decode():
+    """ Time to decode recieved messages """
+    frame = drive_data_stream(1).rstrip(b"\n")
+    seconds = time_calls(lambda: get_type_and_data(frame))
+    report_rate("decode/get_type_and_data", REPEAT, seconds, "messages")
+
+    body = json.loads(frame)["DriveData"]
+    seconds = time_calls(lambda: DriveData.from_json(body))
+    report_rate("decode/DriveData.from_json", REPEAT, seconds, "messages")
+
+
+class LegacyDriveData:
+    """ DriveData as it was before the message schemas, without __slots__ """
+
+    def __init__(self, elapsed_time=0, throttle=0, steering=0, speed=0,
+                 driving_distance=0, obstacle_distance=0, lateral_position=0,
+                 angle=0):
+        self.elapsed_time = elapsed_time
+        self.throttle = throttle
+        self.steering = steering
+        self.speed = speed
+        self.driving_distance = driving_distance
+        self.obstacle_distance = obstacle_distance
+        self.lateral_position = lateral_position
+        self.angle = angle
+
+    def from_json(json: dict):
+        return LegacyDriveData(json["elapsed_time"], json["throttle"],
+                               json["steering"], json["speed"],
+                               json["driving_distance"],
+                               json["obstacle_distance"],
+                               json["lateral_position"], json["angle"])
+
+
+def bench_schema(count: int = 100000):
+    """ Memory per DriveData instance and decode time of the schema generated
+    class, against the previous unvalidated __dict__ class. The schema class
+    checks the type of every field, the extra decode time that costs is
+    reported as validation overhead. """
+    body = json.loads(drive_data_stream(1))["DriveData"]
+    times = {}
+    for name, cls in (("legacy", LegacyDriveData), ("schema", DriveData)):
+        tracemalloc.start()
+        instances = [cls.from_json(body) for _ in range(count)]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del instances
+        report("schema/{}/memory".format(name), size / count, "bytes/instance")
+
+        times[name] = time_calls(lambda: cls.from_json(body))
+        report_rate("schema/{}/from_json".format(name), REPEAT, times[name],
+                    "messages")
+    report("schema/validation_overhead",
+           (times["schema"] / times["legacy"] - 1) * 100, "%")
+
+
+def bench_dispatch():
+    """ Per message cost of the handler registry, for decoded and raw handlers
+    and for rate limited unknown types """
+    app()
+    frame = drive_data_stream(1).rstrip(b"\n")
+    dispatcher = MessageDispatcher()
+    dispatcher.register("DriveData", lambda data: None)
+    seconds = time_calls(lambda: dispatcher.dispatch(frame))
+    report_rate("dispatch/decoded", REPEAT, seconds, "messages")
+
+    dispatcher.register("DriveData", lambda message: None, raw=True)
+    seconds = time_calls(lambda: dispatcher.dispatch(frame))
+    report_rate("dispatch/raw", REPEAT, seconds, "messages")
+
+    unknown = b'{"LidarScan": {"ranges": [1, 2, 3]}}'
+    seconds = time_calls(lambda: dispatcher.dispatch(unknown))
+    report_rate("dispatch/unknown", REPEAT, seconds, "messages")
+
+
+class ChunkReader:
+    """ Stands in for QTcpSocket, readAll returns one chunk per call """
+
+    def __init__(self, chunks: list[bytes]):
+        self.chunks = [QByteArray(chunk) for chunk in chunks]
+        self.position = 0
+
+    def readAll(self) -> QByteArray:
+        self.position += 1
+        return self.chunks[self.position - 1]
+
+
+def bench_socket():
+    """ Socket.on_recieved with fragmented and coalesced reads, including
+    decoding and signal emission """
+    app()
+    stream = drive_data_stream()
+    socket = Socket(None)
+    for name, size in (("fragmented", 7), ("segment", 1460),
+                       ("coalesced", 65536)):
+        reader = ChunkReader(chunked(stream, size))
+        socket.pSocket = reader
+        socket.decoder.clear()
+
+        start = perf_counter()
+        for _ in reader.chunks:
+            socket.on_recieved()
+        report_rate("socket/on_recieved/{}/{}B".format(name, size), FRAMES,
+                    perf_counter() - start)
+
+
+def bench_binary():
+    """ Size and decode time of binary drive data frames against JSON """
+    data = DriveData(123456, 100, -280, 1500, 250, 40, -3, 12)
+    json_frame = data.to_json().encode("utf-8")
+    binary_frame = data.to_binary()
+    report("binary/json/size", len(json_frame) + 1, "bytes/frame")
+    report("binary/binary/size", len(binary_frame), "bytes/frame")
+
+    seconds = time_calls(lambda: get_type_and_data(json_frame))
+    report_rate("binary/json/decode", REPEAT, seconds, "messages")
+    seconds = time_calls(lambda: DriveData.from_binary(binary_frame[4:]))
+    report_rate("binary/binary/decode", REPEAT, seconds, "messages")
+
+    app()
+    for name, frame in (("json", json_frame), ("binary", binary_frame)):
+        seconds = time_calls(lambda: dispatch_message(frame))
+        report_rate("binary/{}/dispatch".format(name), REPEAT, seconds,
+                    "messages")
+
+    stream = binary_frame * FRAMES
+    start = perf_counter()
+    count = decoder_parse(chunked(stream, 1460))
+    report_rate("binary/binary/framing/1460B", count, perf_counter() - start)
+
+
+def start_echo_server() -> int:
+    """ Starts a line echo server in a background thread, returns its port """
+    started = threading.Event()
+    ports = []
+
+    async def echo(reader, writer):
+        while line := await reader.readline():
+            writer.write(line)
+        writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(echo, "127.0.0.1", 0)
+        ports.append(server.sockets[0].getsockname()[1])
+        started.set()
+        await server.serve_forever()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    started.wait()
+    return ports[0]
+
+
+def start_sink_server() -> int:
+    """ Starts a server in a background thread that reads and discards
+    everything, returns its port """
+    sink = pysocket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        connection, _ = sink.accept()
+        while connection.recv(1 << 16):
+            pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sink.getsockname()[1]
+
+
+def connected_socket() -> Socket:
+    """ Returns a Socket connected to a sink server """
+    socket = Socket(None)
+    socket.pSocket.connected.disconnect(socket.on_connected)  # Don't record
+    socket.pSocket.connectToHost("127.0.0.1", start_sink_server())
+    socket.pSocket.waitForConnected(1000)
+    socket.is_connected = True
+    return socket
+
+
+def bench_send(burst: int = 10):
+    """ Socket send path, writing each message against queueing bursts of
+    messages that are written once per event loop tick """
+    application = app()
+    socket = connected_socket()
+
+    message = (ManualDriveInstruction(100, -280).to_json() + "\n").encode()
+    start = perf_counter()
+    for _ in range(FRAMES):
+        socket.write([(message, perf_counter())])
+    report_rate("send/unbatched", FRAMES, perf_counter() - start, "messages")
+
+    socket.send_stats = stats = type(socket.send_stats)()
+    start = perf_counter()
+    for _ in range(FRAMES // burst):
+        for _ in range(burst):
+            socket.enqueue(message, SendPriority.NORMAL, perf_counter())
+        application.processEvents()
+    while socket.queue_depth:
+        application.processEvents()
+    report_rate("send/queued", FRAMES, perf_counter() - start, "messages")
+    report("send/queued/messages_per_write", stats.messages / stats.writes,
+           "messages")
+    report("send/queued/latency", stats.latency_mean * 1e6, "us")
+    socket.pSocket.abort()
+
+
+def bench_analog(seconds: float = 3.0):
+    """ Messages sent when driving with a noisy, slowly turning synthetic
+    stick, against the control tick rate """
+    import backend
+    from control import manual_control
+    from gamepad import AnalogControl, SyntheticInput
+
+    application = app()
+    backend.Socket._instance = connected_socket()
+    start = perf_counter()
+
+    def stick():
+        elapsed = perf_counter() - start
+        return (0.8 + random.uniform(-0.03, 0.03),
+                0.5 * math.sin(elapsed) + random.uniform(-0.03, 0.03))
+
+    control = manual_control()
+    analog = AnalogControl(SyntheticInput(stick))
+    control.start()
+    analog.start()
+    QTimer.singleShot(int(seconds * 1000), application.quit)
+    application.exec()
+    analog.stop()
+    control.stop()
+
+    report("analog/ticks", CONTROL_RATE, "ticks/s")
+    report("analog/sent", control.frames_sent / seconds, "messages/s")
+    report("analog/bandwidth", backend.Socket._instance.send_stats.bytes
+           / seconds, "bytes/s")
+
+
+def naive_plot(store: TelemetryStore, image: QImage):
+    """ Every sample of every signal drawn as one polyline, without decimation """
+    from plots import PlotWidget
+
+    painter = QPainter(image)
+    lane_height = image.height() / len(PlotWidget.SIGNALS)
+    step = image.width() / len(store)
+    for lane, (name, _, _) in enumerate(PlotWidget.SIGNALS):
+        values = list(store.values(name))
+        low, high = min(values), max(values)
+        scale = lane_height / ((high - low) or 1)
+        bottom = (lane + 1) * lane_height
+        painter.drawPolyline([QPointF(i * step, bottom - (value - low) * scale)
+                              for i, value in enumerate(values)])
+    painter.end()
+
+
+def bench_plot(samples: int = 1000000, frames: int = 20):
+    """ Frame time of the drive data plots with a full store, the first frame
+    includes building the min/max index """
+    from plots import PlotWidget
+
+    app()
+    store = filled_store(samples)
+    widget = PlotWidget(store)
+    widget.resize(1000, 600)
+    image = QImage(widget.size(), QImage.Format_ARGB32_Premultiplied)
+
+    start = perf_counter()
+    widget.render(image)
+    report("plot/first_frame", (perf_counter() - start) * 1000, "ms")
+
+    for index in range(widget.window_box.count()):
+        widget.window_box.setCurrentIndex(index)
+        name = widget.window_box.currentText().replace(" ", "")
+        seconds = time_calls(lambda: widget.render(image), frames)
+        report("plot/frame/" + name, seconds / frames * 1000, "ms")
+
+    start = perf_counter()
+    naive_plot(store, image)
+    report("plot/frame/undecimated", (perf_counter() - start) * 1000, "ms")
+
+
+def legacy_add_log(logger: QPlainTextEdit, severity: str, message: str):
+    """ The logging previously done by LogWidget.add_log """
+    current_time = \
+        str(localtime().tm_hour).zfill(2) + ":" + \
+        str(localtime().tm_min).zfill(2) + ":" + \
+        str(localtime().tm_sec).zfill(2)
+
+    entry = "[" + current_time + " - " + severity + "]\t" + message
+    logger.appendPlainText(entry)
+
+
+def bench_log(count: int = 50000, burst: int = 100):
+    """ Messages logged per second in bursts, with the event loop running
+    between bursts, against appending each message to the widget """
+    import log
+    from graphics_widgets import LogWidget
+
+    application = app()
+    message = "Unknown message type: Odometry"
+
+    legacy = QPlainTextEdit()
+    start = perf_counter()
+    for i in range(count):
+        legacy_add_log(legacy, "WARN", message)
+        if i % burst == 0:
+            application.processEvents()
+    report_rate("log/legacy", count, perf_counter() - start, "messages")
+    report("log/legacy/lines", legacy.blockCount(), "lines")
+
+    with tempfile.TemporaryDirectory() as directory:
+        log.LogBuffer._instance = log.LogBuffer(None, directory + "/")
+        widget = LogWidget()
+        signal = backend_signals().log_msg
+        start = perf_counter()
+        for i in range(count):
+            signal.emit("WARN", message)
+            if i % burst == 0:
+                application.processEvents()
+        log.log_buffer().flush()
+        report_rate("log/batched", count, perf_counter() - start, "messages")
+        report("log/batched/lines", widget.logger.blockCount(), "lines")
+
+        start = perf_counter()
+        widget.search_box.setText("odometry")
+        report("log/search", (perf_counter() - start) * 1000, "ms")
+        log.log_buffer().stop_file()
+
+
+def synthetic_map(count: int) -> dict:
+    """ A map of count physical nodes in a ring, driven clockwise on lane 2
+    and counter-clockwise on lane 1, with a shortcut from every tenth node """
+    map = {}
+    for i in range(count):
+        map["N{}1".format(i)] = [{"N{}1".format((i - 1) % count): 2}]
+        map["N{}2".format(i)] = [{"N{}2".format((i + 1) % count): 2}]
+        if i % 10 == 0:
+            map["N{}2".format(i)].insert(0, {"N{}2".format((i + 5) % count): 7})
+    return map
+
+
+def legacy_connect_node(map: dict, node_1: str, node_2: str, weight: int):
+    """ MapData.connect_node as it was before MapGraph """
+    map.setdefault(node_1, [])
+    map.setdefault(node_2, [])
+    edge = {node_2: weight}
+    if edge not in map[node_1]:
+        print("Connecting " + node_1 + " -> " + node_2)
+        map[node_1].insert(0, edge)
+
+
+def legacy_weight(map: dict, node_1: str, node_2: str) -> int:
+    """ Edge weight as consumers of MapData.map previously found it """
+    for edge in map[node_1]:
+        if next(iter(edge)) == node_2:
+            return edge[node_2]
+    return None
+
+
+def bench_map(count: int = 10000):
+    """ Building, compiling, validating and querying a map of count physical
+    nodes, against the dict of lists of dicts """
+    edges = [(node, neighbour, weight)
+             for node, node_edges in synthetic_map(count).items()
+             for edge in reversed(node_edges)
+             for neighbour, weight in edge.items()]
+
+    def build(connect, map):
+        start = perf_counter()
+        for edge in edges:
+            connect(map, *edge)
+        return perf_counter() - start
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        legacy_seconds = min(build(legacy_connect_node, {}) for _ in range(3))
+        seconds = min(build(MapData.connect_node, MapData({}))
+                      for _ in range(3))
+    report_rate("map/build/legacy", len(edges), legacy_seconds, "edges")
+    report_rate("map/build", len(edges), seconds, "edges")
+
+    map = synthetic_map(count)
+    map_data = MapData(synthetic_map(count))
+    start = perf_counter()
+    graph = map_data.graph
+    report("map/compile", (perf_counter() - start) * 1000, "ms")
+    start = perf_counter()
+    assert map_data.verify_complete_map()
+    report("map/validate", (perf_counter() - start) * 1000, "ms")
+
+    queries = [(node, neighbour) for node, neighbour, _ in edges[:1000]] + \
+        [(node, "N{}1".format(count - 1)) for node, _, _ in edges[:1000]]
+    seconds = time_calls(lambda: [legacy_weight(map, *query)
+                                  for query in queries], 100)
+    report_rate("map/weight/legacy", len(queries) * 100, seconds, "lookups")
+    seconds = time_calls(lambda: [graph.weight(*query)
+                                  for query in queries], 100)
+    report_rate("map/weight", len(queries) * 100, seconds, "lookups")
+
+    # The JSON format sent to the car is unchanged
+    assert json.loads(map_data.to_json())["MapData"] == map
+
+
+def bench_route(count: int = 500):
+    """ Rebuilding the shortest path cache, checking and planning missions on
+    the default map and a map of count physical nodes, against Dijkstra on
+    the dict of lists per leg """
+    from routing import Router
+    from tests.mock_server import shortest_path
+
+    app()
+    router = Router(None)
+    for name, map in (("default", MapData({}).load_from_file(
+            "map/default_map.json").map), ("synthetic", synthetic_map(count))):
+        map_data = MapData(map)
+        start = perf_counter()
+        router.set_map(map_data)
+        report("route/{}/rebuild".format(name),
+               (perf_counter() - start) * 1000, "ms")
+
+        random.seed(1)
+        nodes = list(map)
+        for stops in (4, 8):
+            mission = random.sample(nodes, stops + 1)
+            seconds = time_calls(lambda: router.errors(mission), 1000)
+            report("route/{}/check/{}".format(name, stops),
+                   seconds / 1000 * 1e6, "us")
+            seconds = time_calls(
+                lambda: [shortest_path(map, start, goal) for start, goal
+                         in zip(mission, mission[1:])], 10)
+            report("route/{}/check/{}/legacy".format(name, stops),
+                   seconds / 10 * 1e6, "us")
+            seconds = time_calls(lambda: router.plan(mission), 10)
+            report("route/{}/plan/{}".format(name, stops),
+                   seconds / 10 * 1e6, "us")
+
+
+def synthetic_track(count: int) -> list:
+    """ Map creator nodes of a track with count nodes in a circle, and a
+    detour outside the circle from every tenth node to the next. The first
+    node is not in an intersection, where compilation starts """
+    from map_creator import Edge, Node
+
+    nodes = []
+    radius = count * Node.RADIUS
+    for i in range(count):
+        node = Node(None, "N{}".format(i))
+        angle = 2 * math.pi * i / count
+        node.setPos(radius * math.cos(angle), radius * math.sin(angle))
+        nodes.append(node)
+    for i in range(count):
+        Edge(nodes[i], nodes[(i + 1) % count], i % 5 + 1)
+
+    for i in range(5, count - 1, 10):
+        detour = Node(None, "D{}".format(i))
+        angle = 2 * math.pi * (i + 0.5) / count
+        detour.setPos(1.2 * radius * math.cos(angle),
+                      1.2 * radius * math.sin(angle))
+        nodes.append(detour)
+        Edge(nodes[i], detour, 3)
+        Edge(detour, nodes[i + 1], 3)
+    return nodes
+
+
+def bench_compile(sizes: tuple = (100, 500, 5000)):
+    """ Compiling map creator graphs to MapData, against the recursive
+    compilation of BASELINE, which only handles maps below the recursion
+    limit """
+    from map_creator import create_map_from_graph
+
+    app()
+    legacy = baseline_module("map_creator.py")
+    for size in sizes:
+        nodes = synthetic_track(size)
+        start = perf_counter()
+        map = create_map_from_graph(nodes)
+        seconds = perf_counter() - start
+        if legacy is not None and size <= 500:
+            # Its debug output is left out, timing only the compilation
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                start = perf_counter()
+                legacy_map = legacy.create_map_from_graph(nodes)
+                legacy_seconds = perf_counter() - start
+        report("compile/{}".format(size), seconds * 1000, "ms")
+        if legacy is not None and size <= 500:
+            report("compile/{}/legacy".format(size), legacy_seconds * 1000,
+                   "ms")
+            assert map.to_json() == legacy_map.to_json()
+
+
+def bench_load(sizes: tuple = (1000, 5000)):
+    """ Loading compiled maps into the map creator, at saved positions and
+    laid out automatically. The loaded graph must compile to the same map. """
+    from map_creator import MapCreatorWidget, create_map_from_graph
+
+    app()
+    widget = MapCreatorWidget()
+    for size in sizes:
+        nodes = synthetic_track(size)
+        positions = {node.name: [node.x(), node.y()] for node in nodes}
+        map = create_map_from_graph(nodes)
+        start = perf_counter()
+        widget.load_map(MapData(map.map), positions)
+        seconds = perf_counter() - start
+        loaded = create_map_from_graph(widget.nodes)
+
+        start = perf_counter()
+        widget.load_map(MapData(map.map))
+        layout_seconds = perf_counter() - start
+        report("load/{}".format(size), seconds * 1000, "ms")
+        report("load/{}/layout".format(size), layout_seconds * 1000, "ms")
+        assert loaded.to_json() == map.to_json()
+
+
+def bench_recompile(size: int = 5000):
+    """ Compiling an edited map in the map creator after renaming a node or
+    changing a weight, against compiling it from scratch """
+    from map_creator import MapCreatorWidget, create_map_from_graph
+
+    app()
+    nodes = synthetic_track(size)
+    positions = {node.name: [node.x(), node.y()] for node in nodes}
+    widget = MapCreatorWidget()
+    widget.load_map(create_map_from_graph(nodes), positions)
+    node = widget.nodes[size // 2]
+    edits = (("full", widget.graph_changed),
+             ("rename", lambda: node.set_name(node.name + "x")),
+             ("weight", lambda: node.edge_list[0].set_weight(
+                 node.edge_list[0].weight % 9 + 1)))
+    times = {}
+    for name, edit in edits:
+        widget.get_map()
+        edit()
+        start = perf_counter()
+        map = widget.get_map()
+        times[name] = perf_counter() - start
+    full_map = create_map_from_graph(widget.nodes)
+    for name, seconds in times.items():
+        report("recompile/{}/{}".format(size, name), seconds * 1000, "ms")
+    assert map.to_json() == full_map.to_json()
+
+
+def bench_validate(size: int = 5000):
+    """ Validating a map in the map creator after a node is dragged, which
+    compiles it from scratch, as done each time editing pauses. Lines
+    printed while validating are counted, the terminal is not redrawn. """
+    from map_creator import MapCreatorWidget, create_map_from_graph
+
+    app()
+    nodes = synthetic_track(size)
+    positions = {node.name: [node.x(), node.y()] for node in nodes}
+    widget = MapCreatorWidget()
+    widget.load_map(create_map_from_graph(nodes), positions)
+    errors = []
+    widget.validated.connect(errors.append)
+
+    node = widget.nodes[size // 2]
+    node.setPos(node.pos() + QPointF(5, 5))  # As mouseMoveEvent
+    for edge in node.edge_list:
+        edge.adjust()
+    widget.graph_changed()
+    widget.validate_timer.stop()
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        start = perf_counter()
+        widget.validate()
+        seconds = perf_counter() - start
+    report("validate/{}/drag".format(size), seconds * 1000, "ms")
+    report("validate/{}/printed".format(size),
+           output.getvalue().count("\n"), "lines")
+    assert errors == [[]]
+
+
+def bench_pan(size: int = 5000, frames: int = 50):
+    """ Frames per second panning a large map in the map creator, zoomed in,
+    zoomed out without labels and zoomed out to the whole map, against
+    drawing it as a small map """
+    from map_creator import MapCreatorWidget, create_map_from_graph
+
+    app()
+    nodes = synthetic_track(size)
+    positions = {node.name: [node.x(), node.y()] for node in nodes}
+    widget = MapCreatorWidget()
+    widget.load_map(create_map_from_graph(nodes), positions)
+    widget.resize(800, 800)
+    image = QImage(widget.viewport().size(), QImage.Format_ARGB32_Premultiplied)
+    whole = 800 / widget.scene().itemsBoundingRect().width()
+
+    for large in (True, False):
+        widget.set_large_map(large)  # Index was built for the large map
+        for name, scale in (("1", 1), ("0.25", 0.25), ("whole", whole)):
+            widget.resetTransform()
+            widget.zoom(scale)
+            center = QPointF(widget.nodes[0].pos())
+
+            def pan():
+                center.setY(center.y() + 20 / scale)
+                widget.centerOn(center)
+                widget.viewport().render(image)
+
+            report_rate("pan/{}/{}{}".format(
+                size, name, "" if large else "/small"),
+                frames, time_calls(pan, frames))
+
+
+def bench_loopback(count: int = 2000):
+    """ Round trip time of encoded messages against a local echo server """
+    port = start_echo_server()
+    connection = pysocket.create_connection(("127.0.0.1", port))
+    connection.setsockopt(pysocket.IPPROTO_TCP, pysocket.TCP_NODELAY, 1)
+
+    message = (ManualDriveInstruction(100, -280).to_json() + "\n").encode()
+    times = []
+    for _ in range(count):
+        start = perf_counter()
+        connection.sendall(message)
+        recieved = b""
+        while not recieved.endswith(b"\n"):
+            recieved += connection.recv(4096)
+        times.append(perf_counter() - start)
+    connection.close()
+
+    times.sort()
+    report("loopback/rtt/p50", statistics.median(times) * 1e6, "us")
+    report("loopback/rtt/p99", times[int(len(times) * 0.99)] * 1e6, "us")
+    report("loopback/rtt/mean", statistics.fmean(times) * 1e6, "us")
+
+
+def write_results(path: str):
+    """ Writes all results as JSON, with the version they were measured on """
+    try:
+        version = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                 capture_output=True, text=True).stdout.strip()
+    except OSError:
+        version = ""
+
+    with open(path, "w") as file:
+        json.dump({"version": version,
+                   "time": strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python": platform.python_version(),
+                   "results": RESULTS}, file, indent=2)
+
+
+BENCHMARKS = {
+    "encode": bench_encode,
+    "decode": bench_decode,
+    "schema": bench_schema,
+    "dispatch": bench_dispatch,
+    "framing": bench_framing,
+    "socket": bench_socket,
+    "binary": bench_binary,
+    "send": bench_send,
+    "analog": bench_analog,
+    "plot": bench_plot,
+    "log": bench_log,
+    "map": bench_map,
+    "route": bench_route,
+    "compile": bench_compile,
+    "load": bench_load,
+    "pan": bench_pan,
+    "recompile": bench_recompile,
+    "validate": bench_validate,
+    "loopback": bench_loopback,
+    "telemetry": bench_telemetry_memory,
+    "export": bench_export,
+    "recorder": bench_recorder,
+    "replay": bench_replay,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of hot paths")
+    parser.add_argument("names", nargs="*",
+                        help="benchmarks to run, all if none given: " +
+                        ", ".join(BENCHMARKS))
+    parser.add_argument("--output", help="write results as JSON to file")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: " + name)
+
+    for name in args.names or list(BENCHMARKS):
+        BENCHMARKS[name]()
+
+    if args.output:
+        write_results(args.output)
@@ -1,74 +1,225 @@
 # Körs med kommandot:
-#   python -m tests.mock_server
+#   python -m tests.mock_server [--host HOST] [--port PORT] [--rate HZ]
+#
+# Simulates the car: speaks the newline-delimited {"Type": {...}} protocol
+# over TCP, so the GUI can be run and load tested without the car. Drive
+# data is sent as binary frames if the client asks with BinaryMode.
 
+import argparse
 import asyncio
-from time import sleep
-
-from src.data import CarData, DriveInstruction, ParameterConfiguration
-from websockets import exceptions, serve
-
-URL = "localhost"
-PORT = "8000"
-
-
-async def handler(ws):
-    '''Handles incomming connection.'''
-    print("Client connected!")
-
-    async for message in ws:
-        print("Recieved:", str(message))
-
-        sleep(5)  # Simulate delay
-
-        if message == "stop":
-            await stop()
-        elif message == "YO!":
-            await send(ws, "YO!")
-        elif message == "mock_car_data":
-            await send(ws, get_mock_car_data())
+import heapq
+import json
+from random import randint
+from time import monotonic
+
+from config import PORT
+from data import BinaryMode, DriveData, MapData, Pong, get_type_and_data
+
+HOST = "localhost"
+
+DRIVE_DATA_RATE = 20
+""" Default rate (Hz) at which drive data is streamed to each client """
+
+INSTRUCTION_TIME = 2.0
+""" Time (s) it takes to complete a semi-autonomous instruction """
+
+EDGE_TIME = 1.0
+""" Time (s) it takes to drive an edge with weight 1 """
+
+MAP_PATH = "map/default_map.json"
+""" Map used until a client sends one """
+
+
+class CarSimulator:
+    """ Simulated car state, one per connected client """
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter, map: dict, rate: float):
+        self.reader = reader
+        self.writer = writer
+        self.map = map
+        self.rate = rate
+
+        self.start_time = monotonic()
+        self.throttle = 0
+        self.steering = 0
+        self.driving_distance = 0.0
+        self.binary = False  # Send drive data as binary frames
+
+        self.instructions: asyncio.Queue = asyncio.Queue()
+        self.mission: asyncio.Task = None
+        self.tasks: list[asyncio.Task] = []
+
+    async def run(self):
+        """ Serves client until it disconnects """
+        self.tasks = [asyncio.create_task(self.stream_drive_data()),
+                      asyncio.create_task(self.complete_instructions())]
+        try:
+            while line := await self.reader.readline():
+                self.handle(line.strip())
+        except ConnectionError:
+            pass
+        finally:
+            for task in self.tasks + [self.mission]:
+                if task is not None:
+                    task.cancel()
+            self.writer.close()
+
+    def send(self, type_name: str, body):
+        """ Sends a message wrapped with its type """
+        if self.writer.is_closing():
+            return
+        message = json.dumps({type_name: body}, separators=(",", ":"))
+        self.writer.write(message.encode("utf-8") + b"\n")
+
+    def send_message(self, message):
+        """ Sends a message object using its own serialization """
+        if not self.writer.is_closing():
+            self.writer.write(message.to_json().encode("utf-8") + b"\n")
+
+    def handle(self, message: bytes):
+        """ Acts on a message from the client """
+        if message == b"":
+            return
+        if message == b"STOP":
+            print("Emergency stop")
+            self.throttle = 0
+            self.steering = 0
+            if self.mission is not None:
+                self.mission.cancel()
+            return
+
+        type, data = get_type_and_data(message)
+        if type == "Error":
+            return
+        elif type == "ManualDriveInstruction":
+            self.throttle = data.throttle
+            self.steering = data.steering
+        elif type == "SemiDriveInstruction":
+            self.instructions.put_nowait(data.id)
+        elif type == "DriveMission":
+            if self.mission is not None:
+                self.mission.cancel()
+            self.mission = asyncio.create_task(
+                self.drive_mission(data.destinations))
+        elif type == "BinaryMode":
+            self.binary = data.version == BinaryMode.VERSION
+            if self.binary:
+                self.send_message(data)  # Acknowledge
+        elif type == "Ping":
+            now = int((monotonic() - self.start_time) * 1e6)  # us
+            self.send_message(Pong(data.id, data.sent, now, now))
+        elif type == "MapData":
+            self.map = data
+            print("New map with", len(data), "nodes")
+        elif type == "ParameterConfiguration":
+            print("New parameters", data)
         else:
-            await send(ws, "idk")
-
-    print("Client disconnected!")
-
-
-async def send(ws, msg: str):
-    print("Sending:", msg)
-    try:
-        await ws.send(msg)
-    except exceptions.ConnectionClosed as e:
-        print("Connection was closed: ", str(e))
-        await stop()
-    except Exception as e:
-        print("Error: ", str(e))
-        await stop()
-
-
-async def stop():
-    print("Stopping server...")
-    global stop_future
-    stop_future.set_result(None)
-
-
-async def main():
-    print("Starting server...")
-    global stop_future
-    stop_future = asyncio.Future()
-
-    async with serve(handler, URL, PORT):
-        print("Server started\n")
-        await stop_future
-
-    print("Server stopped")
-
-
-def get_mock_car_data():
-    carData = CarData(time=225, throttle=25, steering=25, angle=25)
-    return "{" + "\"carData\": " + carData.to_json() + "}"
+            print("Unknown type:", type)
+
+    async def stream_drive_data(self):
+        """ Sends drive data at rate """
+        period = 1 / self.rate
+        next_time = monotonic()
+        while True:
+            elapsed = monotonic() - self.start_time
+            speed = self.throttle * 10  # mm/s
+            self.driving_distance += speed * period / 100  # dm
+
+            data = DriveData(
+                elapsed_time=int(elapsed * 1000), throttle=self.throttle,
+                steering=self.steering, speed=speed,
+                driving_distance=int(self.driving_distance),
+                obstacle_distance=randint(20, 200),
+                lateral_position=randint(-5, 5), angle=randint(-10, 10))
+            if self.binary:
+                self.writer.write(data.to_binary())
+            else:
+                self.send_message(data)
+            await self.writer.drain()
+
+            next_time += period
+            await asyncio.sleep(max(0, next_time - monotonic()))
+
+    async def complete_instructions(self):
+        """ Acknowledges semi-autonomous instructions as they are driven """
+        while True:
+            id = await self.instructions.get()
+            await asyncio.sleep(INSTRUCTION_TIME)
+            self.send("InstructionId", id)
+
+    async def drive_mission(self, destinations: list[str]):
+        """ Drives between destinations, sending positions along the way """
+        for start, goal in zip(destinations, destinations[1:]):
+            path = shortest_path(self.map, start, goal)
+            if path is None:
+                print("No path from", start, "to", goal)
+                return
+
+            for current, next in zip(path, path[1:]):
+                self.send("Position", current + "->" + next)
+                await asyncio.sleep(edge_weight(self.map, current, next)
+                                    * EDGE_TIME)
+                self.send("Position", next)
+
+        self.send("Position", "end")
+
+
+def edge_weight(map: dict, node_1: str, node_2: str) -> int:
+    for edge in map[node_1]:
+        if node_2 in edge:
+            return edge[node_2]
+
+
+def shortest_path(map: dict, start: str, goal: str) -> list[str]:
+    """ Returns shortest path from start to goal, or None if unreachable """
+    distances = {start: 0}
+    previous = {}
+    queue = [(0, start)]
+    while queue:
+        distance, node = heapq.heappop(queue)
+        if node == goal:
+            path = [goal]
+            while path[-1] != start:
+                path.append(previous[path[-1]])
+            return path[::-1]
+        if distance > distances[node]:
+            continue
+
+        for edge in map.get(node, []):
+            for next, weight in edge.items():
+                if distance + weight < distances.get(next, float("inf")):
+                    distances[next] = distance + weight
+                    previous[next] = node
+                    heapq.heappush(queue, (distance + weight, next))
+    return None
+
+
+async def main(host: str, port: int, rate: float):
+    map = MapData({}).load_from_file(MAP_PATH).map
+
+    async def handler(reader, writer):
+        peer = writer.get_extra_info("peername")
+        print("Client connected:", peer)
+        await CarSimulator(reader, writer, map, rate).run()
+        print("Client disconnected:", peer)
+
+    server = await asyncio.start_server(handler, host, port)
+    print("Simulating car on {}:{}, drive data at {} Hz".format(
+        host, port, rate))
+    async with server:
+        await server.serve_forever()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated car")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--rate", type=float, default=DRIVE_DATA_RATE,
+                        help="drive data messages per second and client")
+    args = parser.parse_args()
+
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.host, args.port, args.rate))
     except KeyboardInterrupt:
         print("Terminating server.")  # Don't print stacktrace when CTRL+C
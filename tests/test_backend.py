@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+from backend import (ConnectionManager, FrameDecoder, MessageDispatcher,
+                     SendPriority, backend_signals, socket)
+from data import (BINARY_HEADER, DriveData, DriveMission,
+                  ParameterConfiguration, SemiDriveInstruction,
+                  get_type_and_data)
+
+JSON = DriveData(123456, 100, -280, 1500, 250, 40, -3, 12).to_json() \
+    .encode("utf-8")
+BINARY = DriveData(10, 2, 10, 2, 10, 2, 10, 2).to_binary()
+""" Binary frame with newlines and markers in its payload """
+
+
+def feed_chunks(stream: bytes, size: int, decoder: FrameDecoder = None):
+    decoder = FrameDecoder() if decoder is None else decoder
+    frames = []
+    for start in range(0, len(stream), size):
+        frames += decoder.feed(stream[start:start + size])
+    return frames
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 1460, 1 << 20])
+def test_json_frames(size):
+    assert feed_chunks((JSON + b"\n") * 20, size) == [JSON] * 20
+
+
+@pytest.mark.parametrize("size", [1, 3, 64, 1460])
+def test_mixed_frames(size):
+    stream = JSON + b"\n" + BINARY + BINARY + JSON + b"\n\n" + BINARY
+    assert feed_chunks(stream * 5, size) == [JSON, BINARY, BINARY, JSON,
+                                             BINARY] * 5
+
+
+def test_incomplete_frames_are_kept():
+    decoder = FrameDecoder()
+    assert decoder.feed(JSON[:10]) == []
+    assert decoder.feed(JSON[10:] + b"\n" + BINARY[:3]) == [JSON]
+    assert decoder.feed(BINARY[3:]) == [BINARY]
+    assert decoder.feed(b"") == []
+
+
+def test_broken_frame_is_dropped():
+    decoder = FrameDecoder()
+    frames = feed_chunks(JSON[:30] + BINARY + JSON + b"\n", 16, decoder)
+    assert frames == [BINARY, JSON]
+    assert decoder.dropped == 1
+
+
+def test_clear_drops_partial_frame():
+    decoder = FrameDecoder()
+    decoder.feed(JSON[:30])
+    decoder.clear()
+    assert decoder.feed(JSON + b"\n") == [JSON]
+
+
+def test_decoded_frames():
+    frames = feed_chunks(JSON + b"\n" + BINARY, 5)
+    assert get_type_and_data(frames[0])[1].speed == 1500
+    assert DriveData.from_binary(frames[1][BINARY_HEADER.size:]).steering == 10
+
+
+def test_resync_is_sent_ahead_of_queued_messages(app):
+    sock = socket()
+    sock.queue.clear()
+    manager = ConnectionManager(app)
+    sock.send_message('{"Queued": 1}')  # While disconnected
+    manager.send_state("MapData", '{"MapData": {}}')
+    manager.add_instruction(SemiDriveInstruction(id="a"))
+
+    manager.resync(True)
+    queued = [bytes for bytes, _ in sock.queue]
+    sock.queue.clear()
+    assert queued == [b'{"MapData": {}}\n',
+                      SemiDriveInstruction(id="a").to_json().encode() + b"\n",
+                      b'{"Queued": 1}\n']
+
+
+def test_stop_keeps_queued_configuration(app):
+    sock = socket()
+    sock.queue.clear()
+    dropped = sock.send_stats.dropped
+    messages = ['{"MapData": {}}', SemiDriveInstruction(id="a").to_json(),
+                ParameterConfiguration().to_json(),
+                DriveMission(["A", "B"]).to_json()]
+    for message in messages:
+        sock.enqueue((message + "\n").encode(), SendPriority.NORMAL, 0.0)
+
+    sock.enqueue(b"STOP\n", SendPriority.STOP, 0.0)  # While disconnected
+    queued = [bytes for bytes, _ in sock.queue]
+    sock.queue.clear()
+    assert queued == [(messages[0] + "\n").encode(),
+                      (messages[2] + "\n").encode()]
+    assert sock.send_stats.dropped - dropped == 3  # Plan and the stop
+
+
+def test_invalid_messages_are_counted_and_warned_once(app, capsys):
+    dispatcher = MessageDispatcher()
+    warnings = []
+
+    def log(severity, message):
+        warnings.append(message)
+    backend_signals().log_msg.connect(log)
+    body = {field.name: 0 for field in DriveData.FIELDS}
+    frame = json.dumps({"DriveData": dict(body, speed="fast")}).encode()
+    for _ in range(3):
+        dispatcher.dispatch(frame)
+    backend_signals().log_msg.disconnect(log)
+
+    assert dispatcher.stats["DriveData"].errors == 3
+    assert warnings == ["Invalid DriveData recieved from car: "
+                        "DriveData.speed must be int, got 'fast'"]
+    assert capsys.readouterr().out.count("\n") == 1  # Only the warning
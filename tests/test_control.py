@@ -0,0 +1,92 @@
+import pytest
+
+import control
+from config import CONTROL_RATE, CONTROL_REPEAT_INTERVAL, CONTROL_THRESHOLD
+from control import ManualControl
+from data import get_type_and_data
+
+
+TICK = 1 / CONTROL_RATE + 0.001
+""" A little more than the time between ticks, against rounding """
+
+
+class FakeSocket:
+    """ Keeps sent messages instead of sending them """
+
+    is_connected = True
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, message: str, priority=None):
+        _, data = get_type_and_data(message.encode("utf-8"))
+        self.sent.append((data.throttle, data.steering))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(control, "perf_counter", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def sock(monkeypatch):
+    sock = FakeSocket()
+    monkeypatch.setattr(control, "socket", lambda: sock)
+    return sock
+
+
+@pytest.fixture
+def manual(app, clock, sock):
+    manual = ManualControl(app)
+    manual.start()
+    yield manual
+    manual.timer.stop()
+
+
+def test_small_changes_are_not_sent(manual, sock, clock):
+    assert sock.sent == [(0, 0)]
+    clock[0] += TICK
+    manual.set_state(CONTROL_THRESHOLD, 0)  # From standing still
+    clock[0] += TICK
+    manual.set_state(CONTROL_THRESHOLD + 1, CONTROL_THRESHOLD - 1)
+    clock[0] += TICK
+    manual.set_state(2 * CONTROL_THRESHOLD, 0)
+    assert sock.sent == [(0, 0), (CONTROL_THRESHOLD, 0),
+                         (2 * CONTROL_THRESHOLD, 0)]
+    assert manual.frames_skipped == 1
+
+
+def test_stopping_is_always_sent(manual, sock, clock):
+    clock[0] += TICK
+    manual.set_state(1, 0)
+    clock[0] += TICK
+    manual.set_state(0, 0)
+    assert sock.sent == [(0, 0), (1, 0), (0, 0)]
+
+
+def test_changes_wait_for_rate(manual, sock, clock):
+    manual.set_state(50, 0)
+    assert sock.sent == [(0, 0)]  # Sent less than 1 / CONTROL_RATE s ago
+    clock[0] += TICK
+    manual.update()  # Next tick
+    assert sock.sent == [(0, 0), (50, 0)]
+
+
+def test_unchanged_state_is_repeated(manual, sock, clock):
+    clock[0] += CONTROL_REPEAT_INTERVAL / 2
+    manual.update()
+    assert sock.sent == [(0, 0)]
+    clock[0] += CONTROL_REPEAT_INTERVAL / 2
+    manual.update()
+    assert sock.sent == [(0, 0), (0, 0)]
+
+
+def test_state_is_sent_when_connected(manual, sock, clock):
+    sock.is_connected = False
+    clock[0] += TICK
+    manual.set_state(50, 0)
+    sock.is_connected = True
+    manual.update()
+    assert sock.sent == [(0, 0), (50, 0)]
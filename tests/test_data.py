@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from data import DriveData, MapData, MessageError
+
+NULL_WEIGHT_MAP = {
+    "A2": [{"B2": 1}],
+    "B2": [{"E2": 1}, {"E1": 1}, {"C2": 1}],
+    "B1": [{"A1": 1}],
+    "A1": [{"E1": 1}],
+    "C1": [{"E2": None}, {"E1": None}, {"B1": 1}],
+    "C2": [{"F2": 1}],
+    "F1": [{"C1": 1}],
+    "F2": [{"E2": 1}, {"D2": 1}],
+    "D1": [{"F1": 1}, {"E2": 1}],
+    "D2": [{"F1": 1}, {"E2": 1}],
+    "E1": [{"D1": 1}, {"F1": 1}],
+    "E2": [{"A2": 1}],
+}
+""" Compiled from a map creator graph with an intersection of nodes without
+an edge between them, which gets null weights """
+
+
+def test_default_map_is_complete():
+    assert MapData({}).load_from_file("map/default_map.json") \
+        .verify_complete_map()
+
+
+def test_null_weights_are_reported_not_raised():
+    map = MapData(NULL_WEIGHT_MAP)
+    assert not map.verify_complete_map()
+
+    errors = map.graph.errors()
+    assert 'Invalid weight from "C1" to "E2": None' in errors
+    assert 'Invalid weight from "C1" to "E1": None' in errors
+    assert any(error.startswith('Too many connecting nodes for "C1"')
+               for error in errors)
+
+
+def test_null_weights_are_not_edges():
+    graph = MapData(NULL_WEIGHT_MAP).graph
+    assert not graph.has_edge("C1", "E2")
+    assert graph.weight("C1", "B1") == 1
+    assert graph.neighbours(graph.ids["C1"]) == [(graph.ids["B1"], 1)]
+
+
+def test_orphaned_node():
+    map = MapData({"A1": [{"B1": 1}], "B1": []})
+    assert map.graph.errors() == ['Orphaned node: "B1"']
+    assert not map.verify_complete_map()
+
+
+def test_decode_drive_data():
+    body = {field.name: index for index, field in enumerate(DriveData.FIELDS)}
+    data = DriveData.from_json(body)
+    assert [getattr(data, name) for name in body] == list(body.values())
+    assert data.recieved is None
+    assert DriveData.from_json(json.loads(data.to_json())["DriveData"]) \
+        .angle == data.angle
+
+
+def test_decode_invalid_drive_data():
+    body = {field.name: 0 for field in DriveData.FIELDS}
+    with pytest.raises(MessageError, match="DriveData.speed must be int"):
+        DriveData.from_json(dict(body, speed="fast"))
+    with pytest.raises(MessageError, match="DriveData is missing"):
+        DriveData.from_json({"speed": 0})
+    with pytest.raises(MessageError, match="must be an object"):
+        DriveData.from_json([0])
@@ -0,0 +1,93 @@
+import pytest
+
+import gamepad
+from backend import backend_signals
+from config import CAR_ACC, FULL_STEER, GAMEPAD_DEADZONE
+from gamepad import AnalogControl, SyntheticInput, apply_deadzone
+
+
+class FakeManualControl:
+    """ Keeps states set instead of sending them """
+
+    def __init__(self):
+        self.states = []
+
+    def set_state(self, throttle, steering):
+        self.states.append((throttle, steering))
+
+
+@pytest.fixture
+def manual(monkeypatch):
+    manual = FakeManualControl()
+    monkeypatch.setattr(gamepad, "manual_control", lambda: manual)
+    return manual
+
+
+@pytest.fixture
+def source():
+    return SyntheticInput()
+
+
+@pytest.fixture
+def analog(app, source, manual, monkeypatch):
+    monkeypatch.setattr(gamepad, "GAMEPAD_SMOOTHING", 1.0)  # Follow at once
+    analog = AnalogControl(source)
+    yield analog
+    backend_signals().emergency_stop.disconnect(analog.on_emergency_stop)
+
+
+def test_deadzone():
+    assert apply_deadzone(GAMEPAD_DEADZONE) == 0.0
+    assert apply_deadzone(-GAMEPAD_DEADZONE / 2) == 0.0
+    assert apply_deadzone(1.0) == 1.0
+    assert apply_deadzone(-1.0) == -1.0
+    assert apply_deadzone(1.5) == 1.0  # Uncalibrated stick
+    assert apply_deadzone(0.55, 0.1) == pytest.approx(0.5)
+    assert apply_deadzone(-0.55, 0.1) == pytest.approx(-0.5)
+
+
+def test_synthetic_input_function():
+    source = SyntheticInput(lambda: (0.5, -0.5))
+    source.set(1.0, 1.0)
+    assert source.read() == (0.5, -0.5)
+
+
+def test_rest_is_left_to_other_controls(analog, manual):
+    analog.tick()
+    assert manual.states == []
+
+
+def test_letting_go_stops_at_once(analog, source, manual, monkeypatch):
+    monkeypatch.setattr(gamepad, "GAMEPAD_SMOOTHING", 0.5)
+    source.set(1.0, -1.0)
+    analog.tick()
+    analog.tick()
+    assert manual.states == [(round(CAR_ACC / 2), round(-FULL_STEER / 2)),
+                             (round(CAR_ACC * 3 / 4), round(-FULL_STEER * 3 / 4))]
+    source.set(0.0, 0.0)
+    analog.tick()
+    analog.tick()
+    assert manual.states[2:] == [(0, 0)]  # Once, then left to other controls
+
+
+def test_reversing_is_not_sent(analog, source, manual):
+    source.set(-1.0, 0.5)
+    analog.tick()
+    assert manual.states == [(0, round(FULL_STEER * apply_deadzone(0.5)))]
+
+
+def test_ignored_after_emergency_stop_until_at_rest(analog, source, manual):
+    source.set(1.0, 0.0)
+    analog.tick()
+    backend_signals().emergency_stop.emit()
+    analog.tick()
+    source.set(0.5, 0.0)
+    analog.tick()
+    assert manual.states == [(CAR_ACC, 0)]  # Held input is ignored
+
+    source.set(0.0, 0.0)
+    analog.tick()
+    assert manual.states == [(CAR_ACC, 0)]  # Already stopped, nothing to undo
+    source.set(1.0, 0.0)
+    analog.tick()
+    assert manual.states == [(CAR_ACC, 0), (CAR_ACC, 0)]
@@ -0,0 +1,29 @@
+from threading import Thread
+
+from data import Pong
+from latency import LatencyMonitor
+
+
+def test_probes_are_off_by_default(app):
+    monitor = LatencyMonitor(app)
+    monitor.on_connection_changed(True)
+    assert not monitor.timer.isActive()
+    assert monitor.pending == {}
+
+
+def test_pong_is_handled_in_gui_thread(app):
+    monitor = LatencyMonitor(app)
+    monitor.pending[7] = 100.0
+
+    # Car clock 50 s ahead, 10 ms each way and 2 ms to reply
+    pong = Pong(7, 100000000, 150010000, 150012000)
+    thread = Thread(target=monitor.pong_recieved.emit, args=(pong, 100.022))
+    thread.start()
+    thread.join()
+    assert monitor.pending == {7: 100.0}  # Queued for the GUI thread
+
+    app.processEvents()
+    assert monitor.pending == {}
+    delay, offset = monitor.probes[0]
+    assert abs(delay - 0.020) < 1e-6
+    assert abs(offset - 50) < 1e-6
@@ -0,0 +1,110 @@
+import pytest
+
+from data import MapData
+from map_creator import (Edge, MapCreatorWidget, Node, create_map_from_graph,
+                         load_layout)
+from tests.benchmark import synthetic_track
+
+INTERSECTION_POSITIONS = {
+    "A": (-100, 100), "B": (200, 300), "C": (100, -200),
+    "D": (-100, -300), "E": (200, -300), "F": (300, 200),
+}
+INTERSECTION_EDGES = ["BA", "BC", "DE", "EA", "EB", "FC", "FD", "FE"]
+""" A graph where an intersection is compiled between nodes without an edge
+between them, which gets null weights """
+
+
+@pytest.fixture
+def widget(app):
+    widget = MapCreatorWidget()
+    map = MapData({}).load_from_file("map/default_map.json")
+    widget.load_map(map, load_layout("map/default_map.json"))
+    return widget
+
+
+def set_graph(widget: MapCreatorWidget, positions: dict, edges: list[str]):
+    """ Replaces the graph in widget with nodes at positions and edges
+    between the nodes named by each pair of letters """
+    widget.scene().clear()
+    nodes = {}
+    for name, (x, y) in positions.items():
+        nodes[name] = Node(widget, name)
+        widget.scene().addItem(nodes[name])
+        nodes[name].setPos(x, y)
+    for start, end in edges:
+        widget.scene().addItem(Edge(nodes[start], nodes[end], 1))
+    widget.nodes = list(nodes.values())
+    widget.graph_changed()
+
+
+def test_invalid_map_is_reported(widget):
+    set_graph(widget, INTERSECTION_POSITIONS, INTERSECTION_EDGES)
+    results = []
+    widget.validated.connect(results.append)
+    widget.validate()
+
+    assert len(results) == 1
+    assert any(error.startswith("Invalid weight from") for error in results[0])
+
+
+def test_complete_map_is_valid(widget):
+    results = []
+    widget.validated.connect(results.append)
+    widget.validate()
+    assert results == [[]]
+
+
+def test_validate_after_drag_is_quiet(widget, capsys):
+    node = widget.nodes[0]
+    node.setPos(node.pos().x() + 5, node.pos().y())
+    widget.graph_changed()
+    capsys.readouterr()
+
+    widget.validate()  # Compiles from scratch
+    assert capsys.readouterr().out == ""
+
+
+def test_incremental_compile_matches_full_compile(widget):
+    compiled = widget.get_map()
+    nodes = {node.name: node for node in widget.nodes}
+
+    # A node takes the name another node had
+    nodes["A"].set_name("X")
+    nodes["C"].set_name("A")
+    nodes["A"].edge_list[0].set_weight(7)
+    nodes["B"].edge_list[-1].set_weight(3)
+
+    patched = widget.get_map()
+    assert patched is compiled  # Patched, not compiled again
+    assert patched.map == create_map_from_graph(widget.nodes).map
+    assert patched.graph.errors() == []
+
+
+def test_load_without_layout_keeps_map(widget):
+    expected = MapData({}).load_from_file("map/default_map.json")
+    widget.load_map(MapData({}).load_from_file("map/default_map.json"))
+    results = []
+    widget.validated.connect(results.append)
+    widget.validate()
+    assert results == [[]]
+    assert widget.get_map().map == expected.map
+
+    # Moving a node doesn't tell how the map was laid out either
+    node = widget.nodes[0]
+    node.setPos(node.pos().x() + 100, node.pos().y())
+    widget.node_moved()
+    node.edge_list[0].set_weight(9)
+    weights = widget.get_map().graph.weights
+    assert widget.get_map().map.keys() == expected.map.keys()
+    assert 9 in weights
+
+
+def test_compile_default_map(widget):
+    expected = MapData({}).load_from_file("map/default_map.json")
+    assert create_map_from_graph(widget.nodes).map == expected.map
+
+
+def test_compile_synthetic_track(app):
+    # Compiled by the recursive compiler this replaced
+    expected = MapData({}).load_from_file("tests/maps/synthetic_track_30.json")
+    assert create_map_from_graph(synthetic_track(30)).map == expected.map
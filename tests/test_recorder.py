@@ -0,0 +1,29 @@
+import recorder
+from recorder import SessionReader, SessionRecorder
+
+
+def test_flush_writes_buffered_frames(tmp_path):
+    path = str(tmp_path / "session.rec")
+    session = SessionRecorder(path)
+    session.record(b'{"DriveData": {}}')
+    session.flush()  # As by the timer, before RECORD_BATCH_SIZE is buffered
+
+    frames = [frame for _, frame in SessionReader(path).records()]
+    assert frames == [b'{"DriveData": {}}']
+    session.close()
+
+
+def test_idle_flush_syncs_once(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(recorder.os, "fsync", synced.append)
+    monkeypatch.setattr(recorder, "RECORD_FSYNC_INTERVAL", 0)
+
+    session = SessionRecorder(str(tmp_path / "session.rec"))
+    session.record(b"frame")
+    session.flush()
+    assert len(synced) == 2  # Log and index
+    session.flush()
+    session.flush()
+    assert len(synced) == 2  # Nothing written since
+    session.close()
+    assert len(synced) == 2
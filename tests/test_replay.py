@@ -0,0 +1,58 @@
+import pytest
+
+from backend import backend_signals, drive_data_coalescer, socket
+from data import DriveData
+from latency import LatencyMonitor
+from replay import ReplaySource
+
+LIVE = DriveData(1000, 1, 2, 3, 4, 5, 6, 7)
+REPLAYED = [(time / 1000, DriveData(time, 0, 0, 0, 0, 0, 0, 0))
+            for time in range(0, 500, 100)]
+
+
+@pytest.fixture
+def replay(app):
+    replay = ReplaySource(app)
+    replay.events = list(REPLAYED)
+    history = drive_data_coalescer().history
+    history.clear()
+    history.append(LIVE)
+    yield replay
+    replay.stop()
+    backend_signals().connection_changed.disconnect(replay.on_connection_changed)
+
+
+def times() -> list[int]:
+    return [data.elapsed_time for data in drive_data_coalescer().history]
+
+
+def test_replay_replaces_history(replay, app):
+    assert replay.start(0)
+    while replay.is_running():
+        app.processEvents()
+    assert times() == [0, 100, 200, 300, 400]
+
+
+def test_replay_is_refused_while_connected(replay, monkeypatch):
+    monkeypatch.setattr(socket(), "is_connected", True)
+    assert not replay.start(0)
+    assert not replay.is_running()
+    assert times() == [1000]
+
+
+def test_connecting_stops_replay(replay):
+    replay.start(1.0)
+    replay.step()  # The first sample is due at once
+    backend_signals().connection_changed.emit(True)
+    assert not replay.is_running()
+    assert times() == []
+
+
+def test_replayed_data_gets_no_age(app):
+    monitor = LatencyMonitor(app)
+    monitor.offset = 0.0
+    monitor.on_connection_changed(False)
+    replayed = DriveData(1000, 0, 0, 0, 0, 0, 0, 0)
+    replayed.recieved = 5.0
+    monitor.on_drive_data(replayed)
+    assert list(monitor.ages) == []
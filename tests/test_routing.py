@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+import routing
+from data import MapData
+from routing import Router
+
+RING_MAP = {
+    "A": [{"B": 1}, {"D": 5}],
+    "B": [{"C": 1}, {"A": 5}],
+    "C": [{"D": 1}, {"B": 5}],
+    "D": [{"A": 1}, {"C": 5}],
+}
+""" Four nodes in a ring, short clockwise and long counterclockwise """
+
+
+@pytest.fixture
+def ring(app):
+    router = Router(app)
+    router.set_map(MapData(RING_MAP))
+    return router
+
+
+def test_path_and_distance(ring):
+    assert ring.path("A", "D") == ["A", "B", "C", "D"]
+    assert ring.distance("A", "D") == 3
+    assert ring.distance("D", "A") == 1
+    assert ring.distance("A", "X") is None
+
+
+def test_errors(ring):
+    assert ring.errors(["A", "C"]) == []
+    assert ring.errors(["A", "X", "X"]) == ["Destination X is not in the map"]
+
+
+def test_plan_keeps_start_first(ring):
+    assert ring.plan(["A", "D", "C", "B"]) == ["A", "B", "C", "D"]
+
+
+def test_plan_keeps_repeated_stops_apart(ring):
+    assert ring.plan(["A", "C", "B", "C"]) == ["A", "C", "B", "C"]
+    assert ring.plan(["A", "B", "C", "B", "C"]) == ["A", "B", "C", "B", "C"]
+    assert ring.plan(["A", "B", "A", "C"]) == ["A", "B", "C", "A"]
+    assert ring.plan(["A", "C", "C", "D"]) == ["A", "C", "D", "C"]
+    assert ring.plan(["A", "B", "B", "B"]) is None  # Can't be kept apart
+
+
+def test_plan_keeps_round_trip_end(ring):
+    assert ring.plan(["A", "D", "B", "C", "A"]) == ["A", "B", "C", "D", "A"]
+    assert ring.plan(["A", "B", "A"]) == ["A", "B", "A"]
+
+
+def test_heuristic_plan_keeps_round_trip_end(ring, monkeypatch):
+    monkeypatch.setattr(routing, "ROUTE_EXACT_STOPS", 0)
+    assert ring.plan(["A", "D", "B", "C", "A"]) == ["A", "B", "C", "D", "A"]
+    assert ring.plan(["A", "D", "C", "B"]) == ["A", "B", "C", "D"]
+    assert ring.plan(["A", "C", "B", "C"]) == ["A", "C", "B", "C"]
+
+
+def test_invalid_map_is_not_raised(app, tmp_path, monkeypatch):
+    path = tmp_path / "map.json"
+    path.write_text(json.dumps({"A": 5}))
+    monkeypatch.setattr(routing, "current_map_path", lambda: str(path))
+
+    router = Router(app)
+    assert router.map is None
+    assert router.errors(["A", "B"]) == []